@@ -0,0 +1,4 @@
+"""
+性能基准测试
+在项目根目录执行，例如python -m benchmarks.bench_import，结果保存在benchmarks/results目录下
+"""
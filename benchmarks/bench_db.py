@@ -0,0 +1,180 @@
+"""
+数据库操作基准测试
+设置环境变量QS_BENCH_DSN（如 host=127.0.0.1 port=5432 dbname=bench user=postgres password=...）时使用已有数据库，
+否则用initdb和pg_ctl在临时目录创建一个只在本次测试中使用的PostgreSQL实例，测试结束后删除
+测试表为bench_w{列数}，每次测试前重建
+用法：python -m benchmarks.bench_db [--rows 1000 10000] [--widths 4 16] [--runs 3] [--compare]
+"""
+from benchmarks.common import add_common_arguments, report, summarize, use_temp_config
+from contextlib import contextmanager
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+# 单行操作比批量操作慢两三个数量级，最多测试这么多行
+SINGLE_ROW_LIMIT = 1000
+
+
+def _find_pg_bin(name: str) -> str:
+    """
+    查找PostgreSQL命令，PATH中没有时从pg_config --bindir中查找
+    :param name: 命令名称
+    :return: 命令路径
+    """
+    path = shutil.which(name)
+    if path:
+        return path
+    pg_config = shutil.which('pg_config')
+    if pg_config:
+        bin_dir = subprocess.run([pg_config, '--bindir'], capture_output=True, text=True, check=True).stdout.strip()
+        candidate = os.path.join(bin_dir, name)
+        if os.path.isfile(candidate):
+            return candidate
+    raise RuntimeError(f'找不到{name}，请安装PostgreSQL或设置QS_BENCH_DSN')
+
+
+def _free_port() -> int:
+    """
+    取一个空闲端口
+    :return: 端口号
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def throwaway_postgres():
+    """
+    提供测试用的数据库连接参数，没有设置QS_BENCH_DSN时创建临时实例，退出时停止并删除
+    :return: {'host', 'port', 'user', 'password', 'database'}
+    """
+    dsn = os.getenv('QS_BENCH_DSN')
+    if dsn:
+        params = dict(item.split('=', 1) for item in dsn.split())
+        yield {
+            'host': params.get('host', '127.0.0.1'),
+            'port': params.get('port', '5432'),
+            'user': params.get('user', 'postgres'),
+            'password': params.get('password', ''),
+            'database': params.get('dbname', 'postgres'),
+        }
+        return
+
+    data_dir = tempfile.mkdtemp(prefix='qs_bench_pg_')
+    port = _free_port()
+    subprocess.run([_find_pg_bin('initdb'), '-D', data_dir, '-U', 'postgres', '-A', 'trust', '-E', 'UTF8'],
+                   capture_output=True, check=True)
+    # 测试实例不需要持久化，关闭fsync减少磁盘抖动对结果的影响
+    subprocess.run([_find_pg_bin('pg_ctl'), '-D', data_dir, '-w', '-l', os.path.join(data_dir, 'server.log'),
+                    '-o', f'-p {port} -k {data_dir} -c listen_addresses=127.0.0.1 -c fsync=off', 'start'],
+                   capture_output=True, check=True)
+    try:
+        yield {'host': '127.0.0.1', 'port': str(port), 'user': 'postgres', 'password': '', 'database': 'postgres'}
+    finally:
+        subprocess.run([_find_pg_bin('pg_ctl'), '-D', data_dir, '-m', 'fast', 'stop'], capture_output=True)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def make_rows(count: int, width: int, offset: int = 0) -> list[dict]:
+    """
+    生成测试数据，id为主键，其余为文本列
+    :param count: 行数
+    :param width: 文本列数
+    :param offset: id起始值
+    :return: 行列表
+    """
+    return [dict({'id': offset + i}, **{f'c{j}': f'value_{offset + i}_{j}' for j in range(width)})
+            for i in range(count)]
+
+
+def reset_table(pg, table_name: str, width: int) -> None:
+    """
+    重建测试表
+    :param pg: PgDbOperator
+    :param table_name: 表名
+    :param width: 文本列数
+    :return: 无
+    """
+    columns = ', '.join(f'c{j} text' for j in range(width))
+    with pg.connection() as cur:
+        cur.execute(f'DROP TABLE IF EXISTS {table_name}')
+        cur.execute(f'CREATE TABLE {table_name} (id bigint PRIMARY KEY, {columns})')
+
+
+def bench_case(pg, rows: int, width: int, runs: int) -> dict:
+    """
+    测试一组行数和列数下各操作的吞吐量
+    :param pg: PgDbOperator
+    :param rows: 行数
+    :param width: 文本列数
+    :param runs: 次数
+    :return: {操作: {'rows', 'seconds', 'rows_per_second'}}
+    """
+    table_name = f'bench_w{width}'
+    data = make_rows(rows, width)
+    single_rows = data[:SINGLE_ROW_LIMIT]
+    # 后一半与已有数据冲突，一半新插入，upsert同时覆盖两条路径
+    upsert_data = make_rows(rows, width, offset=rows // 2)
+    operations = {
+        'insert': (lambda: [pg.insert(table_name, row) for row in single_rows], len(single_rows), False),
+        'inserts': (lambda: pg.inserts(table_name, data), rows, False),
+        'upsert': (lambda: [pg.upsert(table_name, row, ['id']) for row in upsert_data[:SINGLE_ROW_LIMIT]],
+                   min(rows, SINGLE_ROW_LIMIT), True),
+        'upserts': (lambda: pg.upserts(table_name, upsert_data, ['id']), rows, True),
+        'select_star': (lambda: pg.select_star(table_name, ''), rows, True),
+    }
+    results = {}
+    for name, (func, count, needs_data) in operations.items():
+        samples = []
+        for _ in range(runs):
+            reset_table(pg, table_name, width)
+            if needs_data:
+                pg.inserts(table_name, data)
+            start = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - start)
+        seconds = summarize(samples)
+        results[name] = {'rows': count, 'seconds': seconds, 'rows_per_second': count / seconds['median']}
+    with pg.connection() as cur:
+        cur.execute(f'DROP TABLE IF EXISTS {table_name}')
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='数据库操作基准测试')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000], help='测试的行数')
+    parser.add_argument('--widths', type=int, nargs='+', default=[4, 16], help='测试表的文本列数')
+    parser.add_argument('--runs', type=int, default=3, help='每个操作的运行次数')
+    add_common_arguments(parser)
+    args = parser.parse_args()
+
+    with throwaway_postgres() as db:
+        use_temp_config({
+            'log': {'log_path': tempfile.mkdtemp(prefix='qs_bench_log_'), 'console_log_level': 'WARNING',
+                    'file_log_level': 'WARNING'},
+            # 查询缓存会让重复查询不访问数据库，测试时关闭
+            'postgresql': dict(db, enable='True', query_cache_enable='False'),
+        })
+        from db_connect.pg_db_operator import PgDbOperator
+        pg = PgDbOperator()
+        try:
+            results = {}
+            for width in args.widths:
+                for rows in args.rows:
+                    case = f'rows{rows}_w{width}'
+                    results[case] = bench_case(pg, rows, width, args.runs)
+                    for name, result in results[case].items():
+                        print(f"{case:<16} {name:<12} {result['rows_per_second']:12,.0f} rows/s")
+        finally:
+            pg.close()
+    sys.exit(report('db', results, args.compare, args.threshold))
+
+
+if __name__ == '__main__':
+    main()
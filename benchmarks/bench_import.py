@@ -0,0 +1,57 @@
+"""
+导入耗时基准测试
+每个包在新的子进程中导入，只计算import语句本身的耗时，并检查导入后是否加载了重量级依赖
+用法：python -m benchmarks.bench_import [--runs 10] [--compare]
+"""
+from benchmarks.common import PROJECT_ROOT, add_common_arguments, report, summarize
+import argparse
+import json
+import subprocess
+import sys
+
+PACKAGES = ['config', 'logger', 'db_connect', 'message_push', 'file_rw_io']
+# 只导入包时不应该被加载的依赖
+HEAVY_MODULES = ['requests', 'psycopg2', 'asyncpg', 'pandas', 'numpy', 'sqlite3']
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {package}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'elapsed': elapsed, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(package: str, runs: int) -> dict:
+    """
+    在子进程中多次导入同一个包
+    :param package: 包名
+    :param runs: 次数
+    :return: 耗时统计和导入后加载的重量级依赖
+    """
+    samples = []
+    heavy = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', _PROBE.format(package=package, heavy=HEAVY_MODULES)],
+                                cwd=PROJECT_ROOT, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        samples.append(result['elapsed'])
+        heavy = result['heavy']
+    return {'seconds': summarize(samples), 'heavy_modules_loaded': heavy}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='导入耗时基准测试')
+    parser.add_argument('--runs', type=int, default=10, help='每个包的导入次数')
+    add_common_arguments(parser)
+    args = parser.parse_args()
+
+    results = {package: measure(package, args.runs) for package in PACKAGES}
+    for package, result in results.items():
+        print(f"{package:<14} median {result['seconds']['median'] * 1000:8.2f} ms  "
+              f"heavy: {','.join(result['heavy_modules_loaded']) or '-'}")
+    sys.exit(report('import', results, args.compare, args.threshold))
+
+
+if __name__ == '__main__':
+    main()
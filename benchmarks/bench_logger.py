@@ -0,0 +1,91 @@
+"""
+日志吞吐量基准测试
+每种日志配置在新的子进程中测试，避免formatters对logging模块的全局设置影响其他配置
+控制台处理器设为CRITICAL，只测试文件处理器；异步配置的计时包括等待后台线程写完
+用法：python -m benchmarks.bench_logger [--records 100000] [--runs 3] [--compare]
+"""
+from benchmarks.common import PROJECT_ROOT, add_common_arguments, report, summarize, use_temp_config
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+
+# 配置名称 -> [log]段落中覆盖的配置项
+CONFIGURATIONS = {
+    'sync_full': {'log_format': 'full', 'log_caller_info': 'True'},
+    'sync_compact': {'log_format': 'compact', 'log_caller_info': 'False'},
+    'sync_json': {'log_format': 'json', 'log_caller_info': 'False'},
+    'sync_sized_gzip': {'log_format': 'compact', 'log_caller_info': 'False',
+                        'log_max_bytes': str(8 * 1024 * 1024), 'log_compress': 'gzip'},
+    'async_full': {'log_format': 'full', 'log_caller_info': 'True', 'log_async': 'True'},
+    'async_compact': {'log_format': 'compact', 'log_caller_info': 'False', 'log_async': 'True'},
+}
+
+
+def run_child(name: str, records: int) -> None:
+    """
+    子进程：按指定配置初始化日志并写入records条日志，输出耗时
+    :param name: 配置名称
+    :param records: 日志条数
+    :return: 无
+    """
+    log_dir = tempfile.mkdtemp(prefix='qs_bench_log_')
+    overrides = dict(CONFIGURATIONS[name], log_path=log_dir, console_log_level='CRITICAL', file_log_level='DEBUG')
+    use_temp_config({'log': overrides})
+    from logger import log
+
+    start = time.perf_counter()
+    for i in range(records):
+        log.info('benchmark record %s, value=%s', i, i * 0.5)
+    listener = getattr(log, 'queue_listener', None)
+    if listener is not None:
+        listener.stop()
+    handlers = listener.handlers if listener is not None else log.handlers
+    for handler in handlers:
+        handler.flush()
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'elapsed': elapsed}))
+
+
+def measure(name: str, records: int, runs: int) -> dict:
+    """
+    多次运行同一配置
+    :param name: 配置名称
+    :param records: 每次写入的日志条数
+    :param runs: 次数
+    :return: 耗时统计和每秒记录数
+    """
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_logger', '--child', name,
+                                 '--records', str(records)],
+                                cwd=PROJECT_ROOT, capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1])['elapsed'])
+    seconds = summarize(samples)
+    return {'records': records, 'seconds': seconds, 'records_per_second': records / seconds['median']}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='日志吞吐量基准测试')
+    parser.add_argument('--records', type=int, default=100000, help='每次写入的日志条数')
+    parser.add_argument('--runs', type=int, default=3, help='每种配置的运行次数')
+    parser.add_argument('--only', nargs='*', choices=list(CONFIGURATIONS), help='只测试指定的配置')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    add_common_arguments(parser)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.records)
+        return
+
+    results = {name: measure(name, args.records, args.runs) for name in (args.only or CONFIGURATIONS)}
+    for name, result in results.items():
+        print(f"{name:<16} {result['records_per_second']:12,.0f} records/s  "
+              f"median {result['seconds']['median']:.3f} s")
+    sys.exit(report('logger', results, args.compare, args.threshold))
+
+
+if __name__ == '__main__':
+    main()
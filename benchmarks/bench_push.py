@@ -0,0 +1,109 @@
+"""
+钉钉消息推送基准测试
+在本机启动模拟钉钉接口的HTTP服务，测试同步发送的单条延迟，以及异步发送的入队延迟和全部发送完成的吞吐量
+用法：python -m benchmarks.bench_push [--messages 200] [--server-delay-ms 0] [--compare]
+"""
+from benchmarks.common import add_common_arguments, report, summarize, use_temp_config
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import sys
+import tempfile
+import threading
+import time
+
+
+class MockDingTalkHandler(BaseHTTPRequestHandler):
+    """
+    模拟钉钉机器人接口，读取请求体后返回成功
+    """
+    # 每个请求的模拟处理时间，秒
+    delay = 0.0
+    # 使用HTTP/1.1，保持连接，与真实接口一致
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.delay:
+            time.sleep(self.delay)
+        body = json.dumps({'errcode': 0, 'errmsg': 'ok'}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 不输出访问日志
+        pass
+
+
+def start_server(delay: float) -> ThreadingHTTPServer:
+    """
+    在随机端口启动模拟服务
+    :param delay: 每个请求的模拟处理时间，秒
+    :return: 服务对象
+    """
+    MockDingTalkHandler.delay = delay
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockDingTalkHandler)
+    threading.Thread(target=server.serve_forever, name='mock_dingtalk', daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='钉钉消息推送基准测试')
+    parser.add_argument('--messages', type=int, default=200, help='发送的消息条数')
+    parser.add_argument('--server-delay-ms', type=float, default=0, help='模拟接口每个请求的处理时间，毫秒')
+    add_common_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_server(args.server_delay_ms / 1000)
+    port = server.server_address[1]
+    use_temp_config({
+        'log': {'log_path': tempfile.mkdtemp(prefix='qs_bench_log_'), 'console_log_level': 'CRITICAL',
+                'file_log_level': 'WARNING'},
+        'MessagePush': {'is_enable': 'True'},
+        'DingDing': {'enable': 'True', 'webhook': f'http://127.0.0.1:{port}/robot/send?access_token=bench',
+                     'secret': 'bench_secret', 'async_send': 'True', 'rate_limit_per_minute': '1000000',
+                     'queue_size': str(args.messages + 1)},
+    })
+    from message_push.dingding import Dingding
+    dingding = Dingding()
+
+    # 同步发送：每条消息一次HTTP请求，测量单条延迟
+    samples = []
+    for i in range(args.messages):
+        start = time.perf_counter()
+        response = dingding.send_message_sync(f'benchmark message {i}')
+        samples.append(time.perf_counter() - start)
+        if not dingding._is_success(response):
+            raise RuntimeError('模拟接口返回失败')
+    sync_seconds = sum(samples)
+
+    # 异步发送：测量入队延迟和全部发送完成的总耗时
+    enqueue_samples = []
+    start = time.perf_counter()
+    for i in range(args.messages):
+        enqueue_start = time.perf_counter()
+        dingding.send_message(f'benchmark message {i}')
+        enqueue_samples.append(time.perf_counter() - enqueue_start)
+    dingding.flush()
+    async_seconds = time.perf_counter() - start
+    server.shutdown()
+
+    results = {
+        'send_message_sync': {'latency': summarize(samples),
+                              'messages_per_second': args.messages / sync_seconds},
+        'send_message_async': {'enqueue_latency': summarize(enqueue_samples),
+                               'messages_per_second': args.messages / async_seconds},
+    }
+    print(f"同步发送 median {results['send_message_sync']['latency']['median'] * 1000:.2f} ms  "
+          f"p95 {results['send_message_sync']['latency']['p95'] * 1000:.2f} ms  "
+          f"{results['send_message_sync']['messages_per_second']:,.0f} msg/s")
+    print(f"异步发送 入队median {results['send_message_async']['enqueue_latency']['median'] * 1e6:.1f} us  "
+          f"{results['send_message_async']['messages_per_second']:,.0f} msg/s（含合并发送）")
+    sys.exit(report('push', results, args.compare, args.threshold))
+
+
+if __name__ == '__main__':
+    main()
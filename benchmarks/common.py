@@ -0,0 +1,156 @@
+"""
+基准测试公共函数
+"""
+import configparser
+import glob
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+# 比较结果时参与比较的指标，True表示越大越好，False表示越小越好
+COMPARED_METRICS = {
+    'median': False,
+    'p95': False,
+    'rows_per_second': True,
+    'records_per_second': True,
+    'messages_per_second': True,
+}
+
+
+def summarize(samples: list[float]) -> dict:
+    """
+    统计多次测量的耗时
+    :param samples: 每次测量的秒数
+    :return: {'runs', 'median', 'p95', 'min', 'max', 'mean'}
+    """
+    ordered = sorted(samples)
+    return {
+        'runs': len(samples),
+        'median': statistics.median(samples),
+        'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'min': min(samples),
+        'max': max(samples),
+        'mean': statistics.fmean(samples),
+    }
+
+
+def save_results(name: str, results: dict) -> str:
+    """
+    把结果保存为json文件，文件名带时间，便于多次运行之间比较
+    :param name: 基准测试名称
+    :param results: 测试结果
+    :return: 文件路径
+    """
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    data = {
+        'name': name,
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'results': results,
+    }
+    path = os.path.join(RESULTS_DIR, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def load_previous(name: str, exclude: str = None):
+    """
+    读取同名基准测试最近一次保存的结果
+    :param name: 基准测试名称
+    :param exclude: 不参与查找的文件路径，一般为本次保存的文件
+    :return: 结果字典，没有历史结果时为None
+    """
+    paths = sorted(path for path in glob.glob(os.path.join(RESULTS_DIR, f"{name}_*.json")) if path != exclude)
+    if not paths:
+        return None
+    with open(paths[-1], 'r', encoding='utf-8') as f:
+        return json.load(f)['results']
+
+
+def compare_results(previous: dict, current: dict, threshold: float = 0.1, path: str = '') -> list[str]:
+    """
+    逐项比较两次结果，只比较COMPARED_METRICS中的指标
+    :param previous: 上次的结果
+    :param current: 本次的结果
+    :param threshold: 变差超过该比例时视为退化
+    :param path: 当前比较的位置，递归时使用
+    :return: 退化项的说明列表
+    """
+    regressions = []
+    for key, value in current.items():
+        old = previous.get(key) if isinstance(previous, dict) else None
+        location = f"{path}.{key}" if path else key
+        if isinstance(value, dict):
+            if isinstance(old, dict):
+                regressions.extend(compare_results(old, value, threshold, location))
+        elif key in COMPARED_METRICS and isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            change = (value - old) / old
+            worse = -change if COMPARED_METRICS[key] else change
+            if worse > threshold:
+                regressions.append(f"{location}: {old:.6g} -> {value:.6g} ({change:+.1%})")
+    return regressions
+
+
+def report(name: str, results: dict, compare: bool = False, threshold: float = 0.1) -> int:
+    """
+    保存结果，需要时与上次结果比较并列出退化项
+    :param name: 基准测试名称
+    :param results: 测试结果
+    :param compare: 是否与上次结果比较
+    :param threshold: 退化阈值
+    :return: 进程退出码，有退化时为1
+    """
+    previous = load_previous(name) if compare else None
+    print(f"结果已保存：{save_results(name, results)}")
+    if not compare:
+        return 0
+    if previous is None:
+        print('没有可比较的历史结果')
+        return 0
+    regressions = compare_results(previous, results, threshold)
+    if not regressions:
+        print(f'与上次结果相比没有超过{threshold:.0%}的退化')
+        return 0
+    print('性能退化：')
+    for line in regressions:
+        print(f'  {line}')
+    return 1
+
+
+def add_common_arguments(parser) -> None:
+    """
+    添加各基准测试共用的命令行参数
+    :param parser: argparse.ArgumentParser
+    :return: 无
+    """
+    parser.add_argument('--compare', action='store_true', help='与上次保存的结果比较，有退化时退出码为1')
+    parser.add_argument('--threshold', type=float, default=0.1, help='视为退化的变差比例')
+
+
+def use_temp_config(overrides: dict) -> str:
+    """
+    以config.ini.dist为模板生成临时配置文件，并通过QS_CONFIG_PATH让config_读取它
+    必须在config_第一次使用之前调用
+    :param overrides: {段落: {键: 值}}
+    :return: 临时配置文件路径
+    """
+    parser = configparser.ConfigParser()
+    parser.read(os.path.join(PROJECT_ROOT, 'config.ini.dist'), encoding='utf-8')
+    for section, values in overrides.items():
+        if not parser.has_section(section):
+            parser.add_section(section)
+        for key, value in values.items():
+            parser.set(section, key, str(value))
+    fd, path = tempfile.mkstemp(prefix='qs_bench_', suffix='.ini')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        parser.write(f)
+    os.environ['QS_CONFIG_PATH'] = path
+    return path
@@ -1,10 +1,34 @@
-from file_config_loader import FileConfigLoader
-from file_rw_io import ROOTPATH
+from config.file_config_loader import FileConfigLoader
+import threading
 
 """
 CONFIG_读取配置文件
 1 请将config.ini.dist配置好后，复制并更改后缀名称
 2 使用方法CONFIG_.get('[session]', 'key')
+3 config_在第一次使用时才读取配置文件，导入本模块没有副作用
+4 [config] hot_reload开启时，配置文件变化后自动重新读取，各模块用config_.subscribe(段落, 回调)响应变化
 """
 
-config_ = FileConfigLoader('config.ini', ROOTPATH)
\ No newline at end of file
+_lock = threading.Lock()
+
+
+def get_config() -> FileConfigLoader:
+    """
+    获取全局配置对象，第一次调用时读取配置文件
+    :return: 配置对象
+    """
+    global config_
+    with _lock:
+        if 'config_' not in globals():
+            from file_rw_io import ROOTPATH
+            config_ = FileConfigLoader('config.ini', ROOTPATH)
+            if config_.getboolean('config', 'hot_reload', fallback=False):
+                config_.start_watching(config_.getfloat('config', 'reload_poll_interval', fallback=2.0))
+    return config_
+
+
+def __getattr__(name: str):
+    # from config import config_ 时才创建配置对象
+    if name == 'config_':
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
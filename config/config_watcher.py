@@ -0,0 +1,99 @@
+"""
+配置文件监视模块
+配置文件变化后通知FileConfigLoader重新读取
+Linux下安装了inotify_simple时使用inotify，否则定时检查文件的修改时间
+"""
+import os
+import threading
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+class ConfigWatcher(object):
+    """
+    配置文件监视线程
+    """
+    def __init__(self, path: str, on_change, poll_interval: float = 2.0) -> None:
+        """
+        初始化监视线程
+        :param path: 配置文件路径
+        :param on_change: 文件变化后调用的函数，无参数
+        :param poll_interval: 轮询修改时间的间隔，秒；使用inotify时为检查停止标志的间隔
+        """
+        self.path = os.path.abspath(path)
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+        self.use_inotify = inotify_simple is not None
+        self._thread = threading.Thread(target=self._run, name='config_watcher', daemon=True)
+
+    def start(self) -> None:
+        """
+        启动监视线程
+        :return: 无
+        """
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        停止监视线程
+        :return: 无
+        """
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join(self.poll_interval + 1)
+
+    def _stat(self):
+        """
+        文件的修改时间和大小，文件不存在时为None
+        :return: (修改时间纳秒, 大小)
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _run(self) -> None:
+        """
+        监视线程主循环
+        :return: 无
+        """
+        if self.use_inotify:
+            try:
+                self._run_inotify()
+                return
+            except OSError:
+                # inotify实例数达到上限等情况，退回轮询
+                pass
+        self._run_polling()
+
+    def _run_polling(self) -> None:
+        """
+        定时比较文件的修改时间和大小
+        :return: 无
+        """
+        last = self._stat()
+        while not self._stop_event.wait(self.poll_interval):
+            current = self._stat()
+            if current is not None and current != last:
+                last = current
+                self.on_change()
+
+    def _run_inotify(self) -> None:
+        """
+        监视配置文件所在目录，编辑器保存时常用“写临时文件再改名”的方式，直接监视文件会丢失后续变化
+        只监视写完关闭和改名移入，不监视创建：文件刚创建时还是空的，此时读取会得到不完整的配置
+        :return: 无
+        """
+        flags = inotify_simple.flags
+        dir_name, file_name = os.path.split(self.path)
+        with inotify_simple.INotify() as inotify:
+            inotify.add_watch(dir_name, flags.CLOSE_WRITE | flags.MOVED_TO)
+            while not self._stop_event.is_set():
+                events = inotify.read(timeout=int(self.poll_interval * 1000))
+                if any(event.name == file_name for event in events):
+                    self.on_change()
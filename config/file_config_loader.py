@@ -3,21 +3,120 @@
 详细参数需要每个模块自己获取
 """
 import configparser
+import json
 import os
+import stat
+import threading
 
 
+# 指定配置文件路径的环境变量，设置后不再搜索
+CONFIG_PATH_ENV = 'QS_CONFIG_PATH'
+# 向上搜索的最大目录层数
+MAX_SEARCH_DEPTH = 5
+# 配置文件路径缓存，按当前工作目录记录上次找到的配置文件
+# 放在当前用户的缓存目录中，公共临时目录中的文件可能被其他用户改为指向他们控制的配置文件
+PATH_CACHE_FILE = os.path.join(os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                               'quantum_script', 'config_path.json')
+
+# 没有传入fallback时的标记
+_MISSING = object()
+
+
+class ConfigSnapshot(object):
+    """
+    解析好的配置快照，读取时不再经过configparser的插值处理，类型转换的结果也会缓存
+    """
+    def __init__(self, parser: configparser.ConfigParser) -> None:
+        """
+        从configparser对象生成快照
+        :param parser: 已读取配置文件的configparser对象
+        """
+        self.sections = {section: dict(parser.items(section)) for section in parser.sections()}
+        self._typed = {}
+        self._lock = threading.Lock()
+
+    def get(self, section: str, key: str, fallback=_MISSING) -> str:
+        """
+        获取字符串配置
+        :param section: 配置文件段落
+        :param key: 配置文件键
+        :param fallback: 配置项不存在时返回的值，不传时抛出异常
+        :return: 配置文件内容，字符串
+        """
+        try:
+            values = self.sections[section]
+        except KeyError:
+            if fallback is _MISSING:
+                raise configparser.NoSectionError(section)
+            return fallback
+        try:
+            return values[key.lower()]
+        except KeyError:
+            if fallback is _MISSING:
+                raise configparser.NoOptionError(key, section)
+            return fallback
+
+    def get_typed(self, kind: str, convert, section: str, key: str, fallback=_MISSING):
+        """
+        获取转换了类型的配置，转换结果按(类型, 段落, 键)缓存
+        :param kind: 类型名称，作为缓存键的一部分
+        :param convert: 转换函数，参数为字符串
+        :param section: 配置文件段落
+        :param key: 配置文件键
+        :param fallback: 配置项不存在时返回的值，不传时抛出异常
+        :return: 转换后的值
+        """
+        cache_key = (kind, section, key.lower())
+        try:
+            return self._typed[cache_key]
+        except KeyError:
+            pass
+        value = self.get(section, key, None)
+        if value is None:
+            if fallback is _MISSING:
+                # 用get抛出对应的异常
+                self.get(section, key)
+            return fallback
+        result = convert(value)
+        with self._lock:
+            self._typed[cache_key] = result
+        return result
+
+
+def _to_boolean(value: str) -> bool:
+    """
+    与configparser相同的布尔值规则
+    :param value: 字符串
+    :return: 布尔值
+    """
+    try:
+        return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+    except KeyError:
+        raise ValueError(f'不是布尔值：{value}')
+
+
+def _to_list(value: str) -> list[str]:
+    """
+    把逗号或换行分隔的字符串拆成列表，去掉空项
+    :param value: 字符串
+    :return: 列表
+    """
+    return [item.strip() for item in value.replace('\n', ',').split(',') if item.strip()]
+
 
 class FileConfigLoader(object):
     """
     配置文件加载器
     """
-    def __init__(self, file_name: str, ROOTPATH: str) -> None:
+    def __init__(self, file_name: str, ROOTPATH: str, use_path_cache: bool = True) -> None:
         """
         初始化配置文件加载器
         :param file_name: 配置文件名称
+        :param use_path_cache: 是否使用配置文件路径缓存
         """
         self.file_name = file_name
         self.ROOTPATH = ROOTPATH
+        self.use_path_cache = use_path_cache
         # 起配置文件对象
         self.config = configparser.ConfigParser()
         # 获取config文件路径
@@ -26,13 +125,27 @@ class FileConfigLoader(object):
             raise Exception(f'项目根目录的{file_name}配置文件不存在')
         # 不会占用文件
         self.config.read(self.config_path, encoding='utf-8')
+        # 解析好的配置快照，所有读取都从快照中取值，重新读取时整体替换
+        self.snapshot = ConfigSnapshot(self.config)
+        # 段落 -> 订阅该段落变化的回调函数列表
+        self._subscribers = {}
+        self._reload_lock = threading.Lock()
+        self.watcher = None
 
     def __load_path(self, file_name: str='config.ini'):
         """
-        读取配置文件路径，如果没有，则搜索项目
+        读取配置文件路径，按以下顺序查找：
+        1 环境变量QS_CONFIG_PATH指定的路径
+        2 ROOTPATH的上一层目录（默认位置）
+        3 路径缓存中当前工作目录对应的路径
+        4 从ROOTPATH和当前工作目录向上逐层查找，最多MAX_SEARCH_DEPTH层
         :param file_name:配置文件名称
         :return:对应的路径
         """
+        env_path = os.getenv(CONFIG_PATH_ENV)
+        if env_path:
+            return env_path if os.path.isfile(env_path) else None
+
         # 读取当前程序文件所在目录
         # this_script_dir = os.path.dirname(os.path.abspath(__file__))
         this_script_dir = self.ROOTPATH
@@ -40,33 +153,193 @@ class FileConfigLoader(object):
         config_file_path = os.path.join(this_script_dir, f'../{file_name}')
         if os.path.isfile(config_file_path):
             return config_file_path
-        else:
-            parent_dir = os.path.dirname(this_script_dir)
-            for root, dirs, files in os.walk(parent_dir):
-                if file_name in files:
-                    return os.path.join(root, file_name)
-            return None
 
-    def get(self, section: str, key: str) -> str:
+        cache_key = f"{os.getcwd()}|{os.path.abspath(this_script_dir)}|{file_name}"
+        if self.use_path_cache:
+            cached_path = self._read_path_cache().get(cache_key)
+            if cached_path and os.path.isfile(cached_path):
+                return cached_path
+
+        for start_dir in (os.path.abspath(this_script_dir), os.getcwd()):
+            current_dir = start_dir
+            for _ in range(MAX_SEARCH_DEPTH + 1):
+                candidate = os.path.join(current_dir, file_name)
+                if os.path.isfile(candidate):
+                    if self.use_path_cache:
+                        self._write_path_cache(cache_key, candidate)
+                    return candidate
+                parent_dir = os.path.dirname(current_dir)
+                if parent_dir == current_dir:
+                    break
+                current_dir = parent_dir
+        return None
+
+    @staticmethod
+    def _is_private(path: str) -> bool:
+        """
+        检查路径缓存文件是否只能被当前用户修改：属于当前用户，其他用户和同组用户不可写
+        没有uid的系统（Windows）只依赖用户目录本身的权限
+        :param path: 文件或目录路径
+        :return: 是否安全
+        """
+        if not hasattr(os, 'getuid'):
+            return True
+        info = os.stat(path)
+        return info.st_uid == os.getuid() and not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+    def _read_path_cache(self) -> dict:
+        """
+        读取配置文件路径缓存，文件不存在、损坏或者权限不安全时返回空字典
+        :return: {缓存键: 配置文件路径}
+        """
+        try:
+            if not (self._is_private(os.path.dirname(PATH_CACHE_FILE)) and self._is_private(PATH_CACHE_FILE)):
+                return {}
+            with open(PATH_CACHE_FILE, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return cache if isinstance(cache, dict) else {}
+
+    def _write_path_cache(self, cache_key: str, path: str) -> None:
+        """
+        写入配置文件路径缓存，写入失败不影响使用
+        :param cache_key: 缓存键
+        :param path: 配置文件路径
+        :return: 无
+        """
+        cache = self._read_path_cache()
+        cache[cache_key] = path
+        tmp_path = f"{PATH_CACHE_FILE}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(PATH_CACHE_FILE), mode=0o700, exist_ok=True)
+            # 只有当前用户可读写
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False)
+            os.replace(tmp_path, PATH_CACHE_FILE)
+        except OSError:
+            pass
+
+    def subscribe(self, section: str, callback) -> None:
+        """
+        订阅段落变化，重新读取配置后该段落有变化时调用callback(config)
+        :param section: 配置文件段落
+        :param callback: 回调函数，参数为本配置对象
+        :return: 无
+        """
+        with self._reload_lock:
+            self._subscribers.setdefault(section, []).append(callback)
+
+    def reload(self) -> list[str]:
+        """
+        重新读取配置文件，生成新快照后整体替换，再通知有变化的段落的订阅者
+        文件无法读取、内容有误或者缺少原有的段落（如文件为空或只写了一半）时保留原配置，删除段落需要重启程序
+        :return: 有变化的段落列表
+        """
+        with self._reload_lock:
+            parser = configparser.ConfigParser()
+            try:
+                with open(self.config_path, 'r', encoding='utf-8') as f:
+                    parser.read_file(f)
+                snapshot = ConfigSnapshot(parser)
+            except (OSError, UnicodeDecodeError, configparser.Error) as e:
+                from logger import log
+                log.error('配置文件重新读取失败，继续使用原配置：%s', e)
+                return []
+            old_sections = self.snapshot.sections
+            missing = [section for section in old_sections if section not in snapshot.sections]
+            if missing:
+                from logger import log
+                log.error('重新读取的配置文件缺少段落%s，可能还没有写完，继续使用原配置', ','.join(missing))
+                return []
+            changed = [section for section in set(old_sections) | set(snapshot.sections)
+                       if old_sections.get(section) != snapshot.sections.get(section)]
+            # 替换属性是原子操作，读取方要么拿到旧快照要么拿到新快照
+            self.config = parser
+            self.snapshot = snapshot
+            callbacks = [(section, callback) for section in changed
+                         for callback in self._subscribers.get(section, [])]
+        for section, callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                from logger import log
+                log.error('配置段落%s变化后的回调执行失败：%s', section, e)
+        return changed
+
+    def start_watching(self, poll_interval: float = 2.0) -> None:
+        """
+        启动配置文件监视线程，文件变化后自动重新读取
+        :param poll_interval: 轮询间隔，秒
+        :return: 无
+        """
+        from config.config_watcher import ConfigWatcher
+        if self.watcher is not None:
+            return
+        self.watcher = ConfigWatcher(self.config_path, self.reload, poll_interval)
+        self.watcher.start()
+
+    def stop_watching(self) -> None:
+        """
+        停止配置文件监视线程
+        :return: 无
+        """
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    def get(self, section: str, key: str, fallback=_MISSING) -> str:
         """
         获取配置文件内容
         :param section: 配置文件段落
         :param key: 配置文件键
+        :param fallback: 配置项不存在时返回该值，不传时抛出异常
         :return: 配置文件内容，字符串
         """
-        return self.config.get(section, key)
+        return self.snapshot.get(section, key, fallback)
 
-    def getboolean(self, section: str, key: str) -> bool:
+    def getboolean(self, section: str, key: str, fallback=_MISSING) -> bool:
         """
         获取配置文件内容
         :param section: 配置文件段落
         :param key: 配置文件键
+        :param fallback: 配置项不存在时返回该值，不传时抛出异常
         :return: 配置文件内容，布尔值
         """
-        return self.config.getboolean(section, key)
+        return self.snapshot.get_typed('bool', _to_boolean, section, key, fallback)
+
+    def getint(self, section: str, key: str, fallback=_MISSING) -> int:
+        """
+        获取配置文件内容
+        :param section: 配置文件段落
+        :param key: 配置文件键
+        :param fallback: 配置项不存在时返回该值，不传时抛出异常
+        :return: 配置文件内容，整数
+        """
+        return self.snapshot.get_typed('int', int, section, key, fallback)
+
+    def getfloat(self, section: str, key: str, fallback=_MISSING) -> float:
+        """
+        获取配置文件内容
+        :param section: 配置文件段落
+        :param key: 配置文件键
+        :param fallback: 配置项不存在时返回该值，不传时抛出异常
+        :return: 配置文件内容，浮点数
+        """
+        return self.snapshot.get_typed('float', float, section, key, fallback)
+
+    def getlist(self, section: str, key: str, fallback=_MISSING) -> list[str]:
+        """
+        获取配置文件内容，逗号或换行分隔
+        :param section: 配置文件段落
+        :param key: 配置文件键
+        :param fallback: 配置项不存在时返回该值，不传时抛出异常
+        :return: 配置文件内容，字符串列表
+        """
+        return self.snapshot.get_typed('list', _to_list, section, key, fallback)
 
 
 if __name__ == '__main__':
     # 测试代码
     loader = FileConfigLoader('config.ini', '.')
-    
\ No newline at end of file
@@ -1,9 +1,52 @@
-# 首先读取配置文件查看用的是什么数据库连接
-from config import config_
-if config_.getboolean('postgresql', 'enable'):
-    from pg_db_operator import PgDbOperator
-    pg = PgDbOperator()
+import threading
 
+"""
+数据库连接实例
+1 pg：同步数据库连接，[postgresql] enable = True时可用，使用方法from db_connect import pg
+2 apg：异步数据库连接，[postgresql] async_enable = True时可用，需要在事件循环中使用
+3 两者都在第一次使用时才读取配置并建立连接池，导入本模块没有副作用
+"""
 
+_lock = threading.Lock()
 
 
+def get_pg():
+    """
+    获取同步数据库连接，第一次调用时创建连接池
+    :return: PgDbOperator实例
+    """
+    global pg
+    with _lock:
+        if 'pg' not in globals():
+            # 首先读取配置文件查看用的是什么数据库连接
+            from config import config_
+            if not config_.getboolean('postgresql', 'enable'):
+                raise AttributeError('未开启postgresql数据库连接')
+            from db_connect.pg_db_operator import PgDbOperator
+            pg = PgDbOperator()
+    return pg
+
+
+def get_apg():
+    """
+    获取异步数据库连接，连接池在事件循环中第一次使用时创建
+    :return: AsyncPgDbOperator实例
+    """
+    global apg
+    with _lock:
+        if 'apg' not in globals():
+            from config import config_
+            if not config_.getboolean('postgresql', 'async_enable', fallback=False):
+                raise AttributeError('未开启postgresql异步数据库连接')
+            from db_connect.async_pg_db_operator import AsyncPgDbOperator
+            apg = AsyncPgDbOperator()
+    return apg
+
+
+def __getattr__(name: str):
+    # from db_connect import pg 时才创建连接
+    if name == 'pg':
+        return get_pg()
+    if name == 'apg':
+        return get_apg()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,306 @@
+"""
+PostgreSQL异步操作模块
+与PgDbOperator的方法一一对应，基于asyncpg和其异步连接池，所有方法都需要await
+注意asyncpg使用$1、$2作为占位符，且对参数类型的检查比psycopg2严格
+"""
+from config import config_
+from logger import log
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+import asyncio
+import os
+
+import asyncpg
+
+
+class AsyncPgDbOperator:
+    def __init__(self):
+        self.config = config_
+        self.host = os.getenv('DB_HOST', self.config.get('postgresql', 'host'))
+        self.port = os.getenv('DB_PORT', self.config.get('postgresql', 'port'))
+        self.user = os.getenv('DB_USER', self.config.get('postgresql', 'user'))
+        self.password = os.getenv('DB_PASSWORD', self.config.get('postgresql', 'password'))
+        self.database = os.getenv('DB_DATABASE', self.config.get('postgresql', 'database'))
+        # 连接池大小，与同步连接池共用配置
+        self.pool_max_conn = int(self.config.get('postgresql', 'pool_max_conn', fallback='10'))
+        min_conn = self.config.get('postgresql', 'pool_min_conn', fallback='').strip()
+        self.pool_min_conn = int(min_conn) if min_conn else self.pool_max_conn
+        # 当前模式，每次取出连接时在事务内设置search_path
+        self.schema = None
+        # 连接池需要在事件循环中创建，第一次使用时才建立
+        self.pool = None
+        self._pool_lock = None
+
+    async def _get_pool(self) -> asyncpg.Pool:
+        """
+        获取连接池，第一次调用时创建
+        :return:连接池
+        """
+        if self.pool is not None:
+            return self.pool
+        if self._pool_lock is None:
+            self._pool_lock = asyncio.Lock()
+        async with self._pool_lock:
+            if self.pool is None:
+                try:
+                    self.pool = await asyncpg.create_pool(
+                        host=self.host,
+                        port=self.port,
+                        user=self.user,
+                        password=self.password,
+                        database=self.database,
+                        min_size=self.pool_min_conn,
+                        max_size=self.pool_max_conn,
+                    )
+                except Exception as e:
+                    log.critical("连接数据库错误: %s", e)
+                    raise
+        return self.pool
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[asyncpg.Connection]:
+        """
+        从连接池取出一个连接并开启事务，用法：async with apg.connection() as conn:
+        正常结束时提交，出现异常时回滚，最后把连接放回连接池
+        asyncpg每次取出连接都返回新的代理对象，归还时执行RESET ALL，所以模式不能按连接记录，每次取出都在事务内设置
+        :return:连接
+        """
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if self.schema:
+                    # 只在本事务内生效，与RESET ALL无关
+                    await conn.execute("SELECT set_config('search_path', $1, true)", self.schema)
+                yield conn
+
+    async def switch_schema(self, schema_name: str) -> None:
+        """
+        切换模式，之后取出的每个连接都会使用该模式
+        :param schema_name:模式名称
+        :return:无
+        """
+        self.schema = schema_name
+        # 先在一个连接上执行一次，模式名有误时立即报错
+        async with self.connection():
+            pass
+
+    async def insert(self, table_name: str, data_dict: dict) -> None:
+        """
+        插入单行数据
+        :param table_name:表名称
+        :param data_dict:数据字典
+        :return:无
+        """
+        columns = ','.join(data_dict.keys())
+        placeholders = ','.join(f"${i}" for i in range(1, len(data_dict) + 1))
+        sql = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
+        try:
+            async with self.connection() as conn:
+                await conn.execute(sql, *data_dict.values())
+        except Exception as e:
+            log.error("插入数据错误: %s", e)
+            log.error("%s未执行成功", sql)
+            raise
+
+    async def inserts(self, table_name: str, data_list: list[dict], chunk_size: int = 10000) -> int:
+        """
+        批量插入数据，使用COPY写入，每个分块一个事务
+        :param table_name:表名称，可以带模式名，如schema.table
+        :param data_list:数据列表，字段以第一行为准
+        :param chunk_size:每个分块的行数，一个分块提交一次
+        :return:写入的总行数
+        """
+        if not data_list:
+            return 0
+        columns = list(data_list[0].keys())
+        schema_name, _, table = table_name.rpartition('.')
+        total = 0
+        try:
+            for i in range(0, len(data_list), chunk_size):
+                records = [tuple(row.get(col) for col in columns) for row in data_list[i:i + chunk_size]]
+                async with self.connection() as conn:
+                    await conn.copy_records_to_table(table, records=records, columns=columns,
+                                                     schema_name=schema_name or None)
+                total += len(records)
+        except Exception as e:
+            log.error("COPY数据错误: %s", e)
+            log.error("COPY %s未执行成功，已写入%s条数据", table_name, total)
+            raise
+        log.info("COPY %s 执行成功，写入%s条数据", table_name, total)
+        return total
+
+    async def delete(self, table_name: str, condition: str) -> None:
+        """
+        删除数据
+        :param table_name:表名称
+        :param condition:删除条件
+        :return:无
+        """
+        sql = f"DELETE FROM {table_name} WHERE {condition}"
+        try:
+            async with self.connection() as conn:
+                await conn.execute(sql)
+        except Exception as e:
+            log.error("删除数据错误: %s", e)
+
+    async def update(self, table_name: str, data_dict: dict, condition: str) -> None:
+        """
+        更新单行数据
+        :param table_name:表名称
+        :param data_dict:数据字典
+        :param condition:更新条件
+        :return:无
+        """
+        set_clause = ', '.join([f"{key} = ${i}" for i, key in enumerate(data_dict.keys(), 1)])
+        sql = f"UPDATE {table_name} SET {set_clause} WHERE {condition}"
+        try:
+            async with self.connection() as conn:
+                await conn.execute(sql, *data_dict.values())
+        except Exception as e:
+            log.error("更新数据错误: %s", e)
+
+    async def select(self, table_name: str, field_list: list[str], condition: str) -> list:
+        """
+        查询数据，指定了字段
+        :param table_name: 表格名称
+        :param field_list: 需要的字段，列表格式
+        :param condition: 条件
+        :return: 查询结果列表
+        """
+        fields = ','.join(field_list)
+        if condition == 'TRUE':
+            sql = f"SELECT {fields} FROM {table_name}"
+        else:
+            sql = f"SELECT {fields} FROM {table_name} WHERE {condition}"
+        return await self.select_custom(sql)
+
+    async def select_star(self, table_name: str, condition: str) -> list:
+        """
+        查询所有数据
+        :param table_name:表名称
+        :param condition:查询条件
+        :return:查询结果列表
+        """
+        if condition == 'TRUE':
+            sql = f"SELECT * FROM {table_name}"
+        else:
+            sql = f"SELECT * FROM {table_name} WHERE {condition}"
+        return await self.select_custom(sql)
+
+    async def select_custom(self, sql: str) -> list:
+        """
+        执行自定义sql语句
+        :param sql:sql语句
+        :return:查询结果列表，每行为元组，与同步版本一致
+        """
+        try:
+            async with self.connection() as conn:
+                records = await conn.fetch(sql)
+            return [tuple(record) for record in records]
+        except Exception as e:
+            log.error("查询语句错误: %s", e)
+            raise
+
+    async def iter_select(self, table_name: str, field_list: list[str], condition: str,
+                          prefetch: int = 2000) -> AsyncIterator[tuple]:
+        """
+        流式查询数据，指定了字段，使用服务端游标，用法：async for row in apg.iter_select(...):
+        :param table_name: 表格名称
+        :param field_list: 需要的字段，列表格式
+        :param condition: 条件
+        :param prefetch: 每次从服务端拉取的行数
+        :return: 行的异步生成器
+        """
+        fields = ','.join(field_list)
+        if condition == 'TRUE':
+            sql = f"SELECT {fields} FROM {table_name}"
+        else:
+            sql = f"SELECT {fields} FROM {table_name} WHERE {condition}"
+        async for row in self.iter_custom(sql, prefetch):
+            yield row
+
+    async def iter_custom(self, sql: str, prefetch: int = 2000) -> AsyncIterator[tuple]:
+        """
+        流式执行自定义查询语句
+        :param sql:sql语句
+        :param prefetch: 每次从服务端拉取的行数
+        :return: 行的异步生成器
+        """
+        async with self.connection() as conn:
+            try:
+                async for record in conn.cursor(sql, prefetch=prefetch):
+                    yield tuple(record)
+            except Exception as e:
+                log.error("查询语句错误: %s", e)
+                raise
+
+    async def upsert(self, table_name: str, data_dict: dict, key_columns: list[str]) -> None:
+        """
+        upsert单行数据，如果数据库中存在主键，则更新，否则插入
+        :param table_name:表名称
+        :param data_dict:数据字典
+        :param key_columns:主键列
+        :return:无
+        """
+        if not data_dict:
+            return
+        sql = _upsert_sql(table_name, tuple(data_dict.keys()), tuple(key_columns))
+        try:
+            async with self.connection() as conn:
+                await conn.execute(sql, *data_dict.values())
+            log.info("%s upsert成功", table_name)
+        except Exception as e:
+            log.error("%s upsert失败: %s", table_name, e)
+            raise
+
+    async def upserts(self, table_name: str, data_list: list[dict], key_columns: list[str],
+                      page_size: int = 500) -> None:
+        """
+        批量upsert数据，如果数据库中存在主键，则更新，否则插入
+        每行的字段可以不同，按字段组合分组，每页一个事务，页内使用executemany流水线执行
+        :param table_name:表名称
+        :param data_list:数据列表
+        :param key_columns:主键列
+        :param page_size:每个事务包含的行数
+        :return:无
+        """
+        if not data_list:
+            return
+        groups = {}
+        for row in data_list:
+            groups.setdefault(tuple(row.keys()), []).append(tuple(row.values()))
+        try:
+            for columns, rows in groups.items():
+                sql = _upsert_sql(table_name, columns, tuple(key_columns))
+                for i in range(0, len(rows), page_size):
+                    async with self.connection() as conn:
+                        await conn.executemany(sql, rows[i:i + page_size])
+            log.info("UPSERT %s 执行成功，执行%s条数据", table_name, len(data_list))
+        except Exception as e:
+            log.error("UPSERT %s 执行失败: %s", table_name, e)
+            raise
+
+    async def close(self) -> None:
+        """
+        关闭连接池
+        :return:无
+        """
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+
+def _upsert_sql(table_name: str, columns: tuple, key_columns: tuple) -> str:
+    """
+    生成单行upsert语句，使用$n占位符
+    :param table_name:表名称
+    :param columns:字段元组
+    :param key_columns:主键元组
+    :return:sql语句
+    """
+    columns_str = ','.join(columns)
+    placeholders = ','.join(f"${i}" for i in range(1, len(columns) + 1))
+    conflict_target = ','.join(key_columns)
+    set_clause = ', '.join([f"{col}=EXCLUDED.{col}" for col in columns])
+    return (f"INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders}) "
+            f"ON CONFLICT ({conflict_target}) DO UPDATE SET {set_clause}")
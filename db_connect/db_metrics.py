@@ -0,0 +1,404 @@
+"""
+数据库操作统计模块
+按方法、按表统计耗时分布、行数，按语句统计执行耗时和读取字节数，另外统计连接池等待时间和提交次数
+超过阈值的慢查询写日志，统计结果可以在进程内读取，也可以定时导出为Prometheus文本或json文件
+关闭时操作对象不创建本模块的对象，除一次属性判断外没有额外开销
+"""
+from logger import log
+from psycopg2.extensions import connection as _BaseConnection, cursor as _BaseCursor
+import atexit
+import json
+import os
+import threading
+import time
+
+# 耗时分布的分桶上限，秒
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# 慢查询日志中sql的最大长度
+_SLOW_SQL_MAX_LENGTH = 2000
+# 迭代游标时每读取多少行汇总一次读取统计
+_ITER_FLUSH_ROWS = 1000
+
+
+class Histogram(object):
+    """
+    累计分桶的耗时分布，和Prometheus的histogram一致
+    """
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """
+        记录一次耗时
+        :param seconds: 秒数
+        :return: 无
+        """
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.counts[index] += 1
+                break
+
+    def to_dict(self) -> dict:
+        """
+        转换为字典，分桶为累计值
+        :return: {'count', 'sum', 'max', 'avg', 'buckets': {上限: 累计次数}}
+        """
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        buckets['+Inf'] = self.count
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'max': self.max,
+            'avg': self.total / self.count if self.count else 0.0,
+            'buckets': buckets,
+        }
+
+
+def _estimate_bytes(rows) -> int:
+    """
+    估算查询结果的字节数，字符串和二进制按长度计算，其他类型按8字节计算
+    :param rows: 行列表
+    :return: 字节数
+    """
+    total = 0
+    for row in rows:
+        for value in row:
+            if isinstance(value, (str, bytes, bytearray, memoryview)):
+                total += len(value)
+            elif value is not None:
+                total += 8
+    return total
+
+
+class DbMetrics(object):
+    """
+    数据库操作统计
+    """
+    def __init__(self, slow_query_seconds: float = 1.0, dump_path: str = '', dump_interval: float = 60) -> None:
+        """
+        初始化统计对象
+        :param slow_query_seconds: 慢查询阈值，秒，为0时不记录慢查询
+        :param dump_path: 导出文件路径，扩展名为.json时导出json，否则导出Prometheus文本，为空时不导出
+        :param dump_interval: 导出间隔，秒
+        """
+        self.slow_query_seconds = slow_query_seconds
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self._lock = threading.Lock()
+        # 方法名 -> 耗时分布，(方法名, 表名) -> 耗时分布
+        self._methods = {}
+        self._tables = {}
+        self._rows = {}
+        self._queries = Histogram()
+        self._pool_wait = Histogram()
+        self._commits = Histogram()
+        self._counters = {'query_rows': 0, 'fetched_rows': 0, 'fetched_bytes': 0, 'slow_queries': 0, 'errors': 0}
+        self.cursor_factory = self._make_cursor_factory()
+        self.connection_factory = self._make_connection_factory()
+        self._stop_event = threading.Event()
+        if dump_path:
+            threading.Thread(target=self._dump_loop, name='db_metrics_dump', daemon=True).start()
+            # 程序退出时导出最终结果
+            atexit.register(self.close)
+
+    def _make_cursor_factory(self) -> type:
+        """
+        生成记录执行耗时和读取行数的游标类，作为连接的cursor_factory使用
+        :return: 游标类
+        """
+        metrics = self
+
+        class InstrumentedCursor(_BaseCursor):
+            def execute(self, query, vars=None):
+                start = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    metrics.observe_query(query, time.perf_counter() - start, self.rowcount)
+
+            def executemany(self, query, vars_list):
+                start = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    metrics.observe_query(query, time.perf_counter() - start, self.rowcount)
+
+            def copy_expert(self, sql, file, size=8192):
+                start = time.perf_counter()
+                try:
+                    return super().copy_expert(sql, file, size)
+                finally:
+                    metrics.observe_query(sql, time.perf_counter() - start, self.rowcount)
+
+            def fetchone(self):
+                row = super().fetchone()
+                if row is not None:
+                    metrics.observe_fetch((row,))
+                return row
+
+            def fetchmany(self, size=None):
+                rows = super().fetchmany(size) if size is not None else super().fetchmany()
+                metrics.observe_fetch(rows)
+                return rows
+
+            def fetchall(self):
+                rows = super().fetchall()
+                metrics.observe_fetch(rows)
+                return rows
+
+            def __next__(self):
+                # 逐行迭代（流式查询）时先在游标上累计，每_ITER_FLUSH_ROWS行和迭代结束、游标关闭时汇总一次
+                try:
+                    row = super().__next__()
+                except StopIteration:
+                    self._flush_iterated()
+                    raise
+                pending = self.__dict__.setdefault('_iterated', [0, 0])
+                pending[0] += 1
+                pending[1] += _estimate_bytes((row,))
+                if pending[0] >= _ITER_FLUSH_ROWS:
+                    self._flush_iterated()
+                return row
+
+            def close(self):
+                self._flush_iterated()
+                return super().close()
+
+            def _flush_iterated(self):
+                pending = self.__dict__.pop('_iterated', None)
+                if pending:
+                    metrics.observe_fetch_count(pending[0], pending[1])
+
+        return InstrumentedCursor
+
+    def _make_connection_factory(self) -> type:
+        """
+        生成记录提交耗时、默认使用统计游标的连接类，作为连接池的connection_factory使用
+        :return: 连接类
+        """
+        metrics = self
+
+        class InstrumentedConnection(_BaseConnection):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.cursor_factory = metrics.cursor_factory
+
+            def commit(self):
+                start = time.perf_counter()
+                try:
+                    return super().commit()
+                finally:
+                    metrics.observe_commit(time.perf_counter() - start)
+
+        return InstrumentedConnection
+
+    def observe_method(self, method_name: str, table_name: str, seconds: float, rows: int, failed: bool) -> None:
+        """
+        记录一次操作方法的调用
+        :param method_name: 方法名
+        :param table_name: 表名，不涉及单张表时为空
+        :param seconds: 耗时，秒
+        :param rows: 行数，未知时为None
+        :param failed: 是否抛出了异常
+        :return: 无
+        """
+        with self._lock:
+            histogram = self._methods.get(method_name)
+            if histogram is None:
+                histogram = self._methods[method_name] = Histogram()
+            histogram.observe(seconds)
+            if table_name:
+                key = (method_name, table_name)
+                histogram = self._tables.get(key)
+                if histogram is None:
+                    histogram = self._tables[key] = Histogram()
+                histogram.observe(seconds)
+                if rows:
+                    self._rows[key] = self._rows.get(key, 0) + rows
+            if failed:
+                self._counters['errors'] += 1
+
+    def observe_query(self, sql, seconds: float, rows: int) -> None:
+        """
+        记录一条语句的执行，超过阈值时写慢查询日志
+        :param sql: sql语句，可以是字符串、bytes或psycopg2.sql对象
+        :param seconds: 耗时，秒
+        :param rows: 影响或返回的行数，未知时为-1
+        :return: 无
+        """
+        with self._lock:
+            self._queries.observe(seconds)
+            if rows and rows > 0:
+                self._counters['query_rows'] += rows
+            slow = 0 < self.slow_query_seconds <= seconds
+            if slow:
+                self._counters['slow_queries'] += 1
+        if slow:
+            if isinstance(sql, bytes):
+                sql = sql.decode('utf-8', 'replace')
+            log.warning('慢查询，耗时%.3f秒，行数%s：%s', seconds, rows, str(sql)[:_SLOW_SQL_MAX_LENGTH])
+
+    def observe_fetch(self, rows) -> None:
+        """
+        记录读取的行数和估算的字节数
+        :param rows: 行列表
+        :return: 无
+        """
+        self.observe_fetch_count(len(rows), _estimate_bytes(rows))
+
+    def observe_fetch_count(self, rows: int, size: int) -> None:
+        """
+        记录读取的行数和字节数，迭代游标时按累计值记录
+        :param rows: 行数
+        :param size: 字节数
+        :return: 无
+        """
+        with self._lock:
+            self._counters['fetched_rows'] += rows
+            self._counters['fetched_bytes'] += size
+
+    def observe_pool_wait(self, seconds: float) -> None:
+        """
+        记录一次从连接池取连接的等待时间
+        :param seconds: 秒数
+        :return: 无
+        """
+        with self._lock:
+            self._pool_wait.observe(seconds)
+
+    def observe_commit(self, seconds: float) -> None:
+        """
+        记录一次提交
+        :param seconds: 秒数
+        :return: 无
+        """
+        with self._lock:
+            self._commits.observe(seconds)
+
+    def snapshot(self) -> dict:
+        """
+        当前的统计结果
+        :return: {'methods': {方法名: 耗时分布}, 'tables': {'方法名:表名': 耗时分布和行数},
+                  'queries', 'pool_wait', 'commits': 耗时分布, 'counters': 计数}
+        """
+        with self._lock:
+            tables = {}
+            for (method_name, table_name), histogram in self._tables.items():
+                item = histogram.to_dict()
+                item['rows'] = self._rows.get((method_name, table_name), 0)
+                tables[f"{method_name}:{table_name}"] = item
+            return {
+                'time': time.time(),
+                'methods': {name: histogram.to_dict() for name, histogram in self._methods.items()},
+                'tables': tables,
+                'queries': self._queries.to_dict(),
+                'pool_wait': self._pool_wait.to_dict(),
+                'commits': self._commits.to_dict(),
+                'counters': dict(self._counters),
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        按Prometheus文本格式输出统计结果
+        :return: 文本
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def add_histogram(metric: str, labels: str, data: dict) -> None:
+            separator = ',' if labels else ''
+            for bound, count in data['buckets'].items():
+                lines.append(f'{metric}_bucket{{{labels}{separator}le="{bound}"}} {count}')
+            suffix = f'{{{labels}}}' if labels else ''
+            lines.append(f'{metric}_sum{suffix} {data["sum"]}')
+            lines.append(f'{metric}_count{suffix} {data["count"]}')
+
+        lines.append('# TYPE qs_db_method_seconds histogram')
+        for name, data in snapshot['methods'].items():
+            add_histogram('qs_db_method_seconds', f'method="{name}"', data)
+        lines.append('# TYPE qs_db_table_seconds histogram')
+        for key, data in snapshot['tables'].items():
+            method_name, table_name = key.split(':', 1)
+            add_histogram('qs_db_table_seconds', f'method="{method_name}",table="{table_name}"', data)
+        lines.append('# TYPE qs_db_table_rows_total counter')
+        for key, data in snapshot['tables'].items():
+            method_name, table_name = key.split(':', 1)
+            lines.append(f'qs_db_table_rows_total{{method="{method_name}",table="{table_name}"}} {data["rows"]}')
+        for metric, key in (('qs_db_query_seconds', 'queries'), ('qs_db_pool_wait_seconds', 'pool_wait'),
+                            ('qs_db_commit_seconds', 'commits')):
+            lines.append(f'# TYPE {metric} histogram')
+            add_histogram(metric, '', snapshot[key])
+        for name, value in snapshot['counters'].items():
+            lines.append(f'# TYPE qs_db_{name}_total counter')
+            lines.append(f'qs_db_{name}_total {value}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str = None) -> None:
+        """
+        把统计结果写入文件，先写临时文件再改名，读取方不会读到写了一半的文件
+        :param path: 文件路径，为空时使用初始化时的路径；扩展名为.json时写json，否则写Prometheus文本
+        :return: 无
+        """
+        path = path or self.dump_path
+        if path.endswith('.json'):
+            content = json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        else:
+            content = self.to_prometheus()
+        dir_name = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dir_name, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def _dump_loop(self) -> None:
+        """
+        定时导出线程
+        :return: 无
+        """
+        while not self._stop_event.wait(self.dump_interval):
+            try:
+                self.dump()
+            except OSError as e:
+                log.warning('数据库统计导出失败: %s', e)
+
+    def reset(self) -> None:
+        """
+        清空统计结果
+        :return: 无
+        """
+        with self._lock:
+            self._methods.clear()
+            self._tables.clear()
+            self._rows.clear()
+            self._queries = Histogram()
+            self._pool_wait = Histogram()
+            self._commits = Histogram()
+            self._counters = dict.fromkeys(self._counters, 0)
+
+    def close(self) -> None:
+        """
+        停止定时导出，并导出最终结果
+        :return: 无
+        """
+        if self._stop_event.is_set():
+            return
+        self._stop_event.set()
+        if self.dump_path:
+            try:
+                self.dump()
+            except OSError as e:
+                log.warning('数据库统计导出失败: %s', e)
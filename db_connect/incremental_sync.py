@@ -0,0 +1,173 @@
+"""
+增量同步模块
+按水位字段（更新时间或自增id）只读取上次同步之后的新数据写入目标表，不再整表读取
+每对(源表, 目标表)的水位记录在目标库的状态表中，每批数据的写入和水位的推进在同一个事务中提交，
+程序中断后从最后一次提交的位置继续，不会漏数据也不会重复推进
+水位字段不能为空，值为空的行不会被同步；同一水位值有多行时用主键排序分页，不会因为LIMIT截断而漏行
+"""
+from logger import log
+import json
+
+_STATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS {state_table} (
+    source text NOT NULL,
+    target text NOT NULL,
+    watermark_column text NOT NULL,
+    watermark jsonb,
+    updated_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (source, target)
+)
+"""
+
+
+class IncrementalSync(object):
+    """
+    基于水位的增量同步
+    """
+    def __init__(self, pg, source_pg=None, state_table: str = 'qs_sync_state') -> None:
+        """
+        初始化增量同步
+        :param pg: 目标库的PgDbOperator，状态表也在目标库中
+        :param source_pg: 源库的PgDbOperator，为空时源表和目标表在同一个库中
+        :param state_table: 状态表名称
+        """
+        self.pg = pg
+        self.source_pg = source_pg
+        self.state_table = state_table
+        self._state_table_ready = False
+
+    def _ensure_state_table(self) -> None:
+        """
+        第一次使用时创建状态表
+        :return: 无
+        """
+        if self._state_table_ready:
+            return
+        with self.pg.connection() as cur:
+            cur.execute(_STATE_TABLE_SQL.format(state_table=self.state_table))
+        self._state_table_ready = True
+
+    def get_watermark(self, source: str, target: str):
+        """
+        读取当前水位
+        :param source: 源表名称
+        :param target: 目标表名称
+        :return: {'column', 'value', 'keys', 'updated_at'}，没有同步过时为None
+        """
+        self._ensure_state_table()
+        with self.pg.connection() as cur:
+            cur.execute(f"SELECT watermark_column, watermark, updated_at FROM {self.state_table} "
+                        f"WHERE source = %s AND target = %s", (source, target))
+            row = cur.fetchone()
+        if row is None:
+            return None
+        watermark = row[1] or {}
+        return {'column': row[0], 'value': watermark.get('value'), 'keys': watermark.get('keys'),
+                'updated_at': row[2]}
+
+    def reset(self, source: str, target: str) -> None:
+        """
+        删除水位，下次同步从头开始
+        :param source: 源表名称
+        :param target: 目标表名称
+        :return: 无
+        """
+        self._ensure_state_table()
+        with self.pg.connection() as cur:
+            cur.execute(f"DELETE FROM {self.state_table} WHERE source = %s AND target = %s", (source, target))
+
+    def sync(self, source: str, target: str, watermark_column: str, key_columns: list[str],
+             columns: list[str] = None, condition: str = '', batch_size: int = 5000, page_size: int = 500,
+             transform=None) -> int:
+        """
+        把源表中水位之后的数据upsert到目标表，每批一个事务，直到没有新数据
+        :param source: 源表名称
+        :param target: 目标表名称
+        :param watermark_column: 水位字段，只增不减的更新时间或自增id
+        :param key_columns: 主键列，同时作为同一水位值内的排序字段和目标表的冲突字段
+        :param columns: 读取的字段，为空时读取全部字段；水位字段和主键列会自动加入
+        :param condition: 额外的过滤条件，为空时不过滤；语句带参数执行，条件中的%需要写成%%
+        :param batch_size: 每批读取的行数
+        :param page_size: 写入时每条语句包含的行数
+        :param transform: 写入前对每行数据的处理函数，参数和返回值为字典，返回None时跳过该行
+        :return: 写入的行数
+        """
+        self._ensure_state_table()
+        order_columns = [watermark_column] + [col for col in key_columns if col != watermark_column]
+        if columns:
+            select_columns = ', '.join(list(columns) + [col for col in order_columns if col not in columns])
+        else:
+            select_columns = '*'
+        order_by = ', '.join(order_columns)
+        where = f"({condition})" if condition else 'TRUE'
+        total = 0
+        try:
+            while True:
+                count, done = self._sync_batch(source, target, watermark_column, key_columns, order_columns,
+                                               select_columns, order_by, where, batch_size, page_size, transform)
+                total += count
+                if done:
+                    break
+        finally:
+            if total:
+                self.pg.invalidate_cache(target)
+        log.info("增量同步 %s -> %s 完成，写入%s条数据", source, target, total)
+        return total
+
+    def _sync_batch(self, source: str, target: str, watermark_column: str, key_columns: list[str],
+                    order_columns: list[str], select_columns: str, order_by: str, where: str,
+                    batch_size: int, page_size: int, transform) -> tuple[int, bool]:
+        """
+        同步一批数据：锁定水位，读取水位之后的一批行，写入目标表并推进水位，在同一个事务中提交
+        :return: (写入的行数, 是否已经没有更多数据)
+        """
+        with self.pg.connection() as cur:
+            # 插入空水位后加行锁，同一对表的并发同步依次执行
+            cur.execute(f"INSERT INTO {self.state_table} (source, target, watermark_column) VALUES (%s, %s, %s) "
+                        f"ON CONFLICT (source, target) DO NOTHING", (source, target, watermark_column))
+            cur.execute(f"SELECT watermark_column, watermark FROM {self.state_table} "
+                        f"WHERE source = %s AND target = %s FOR UPDATE", (source, target))
+            stored_column, watermark = cur.fetchone()
+            if stored_column != watermark_column:
+                raise ValueError(f'{source} -> {target}的水位字段为{stored_column}，'
+                                 f'与本次的{watermark_column}不一致，请先reset')
+
+            sql = f"SELECT {select_columns} FROM {source} WHERE {where} AND {watermark_column} IS NOT NULL"
+            params = []
+            if watermark:
+                # 行比较 (水位, 主键...) > (上次的值...)，可以使用(水位, 主键)上的索引
+                sql += f" AND ({order_by}) > ({', '.join(['%s'] * len(order_columns))})"
+                params.extend([watermark['value']] + watermark['keys'])
+            sql += f" ORDER BY {order_by} LIMIT %s"
+            params.append(batch_size)
+            rows = self._fetch(cur, sql, tuple(params))
+            if not rows:
+                return 0, True
+
+            last = rows[-1]
+            data_list = rows if transform is None else [row for row in map(transform, rows) if row is not None]
+            if data_list:
+                self.pg._upsert_batched(cur, target, data_list, key_columns, page_size, commit=False)
+            new_watermark = {'value': last[watermark_column],
+                             'keys': [last[col] for col in order_columns[1:]]}
+            cur.execute(f"UPDATE {self.state_table} SET watermark = %s, updated_at = now() "
+                        f"WHERE source = %s AND target = %s",
+                        (json.dumps(new_watermark, ensure_ascii=False, default=str), source, target))
+        return len(data_list), len(rows) < batch_size
+
+    def _fetch(self, cur, sql: str, params: tuple) -> list[dict]:
+        """
+        读取一批源数据，源表在同一个库时使用目标库的事务，读取和写入看到的是同一份快照
+        :param cur: 目标库游标
+        :param sql: 查询语句
+        :param params: 参数
+        :return: 行字典列表
+        """
+        if self.source_pg is None:
+            cur.execute(sql, params)
+            names = [desc[0] for desc in cur.description]
+            return [dict(zip(names, row)) for row in cur.fetchall()]
+        with self.source_pg.connection() as source_cur:
+            source_cur.execute(sql, params)
+            names = [desc[0] for desc in source_cur.description]
+            return [dict(zip(names, row)) for row in source_cur.fetchall()]
@@ -1,9 +1,176 @@
 from config import config_
 from logger import log
+from db_connect.db_metrics import DbMetrics
+from db_connect.query_cache import QueryCache, normalize_table, qualify_table, tables_in_sql
+from db_connect.sql_builder import Condition, to_condition, to_write_condition
+from db_connect.statement_cache import StatementCache
 # import psycopg2
 # from psycopg2.extras import DictCursor
-from psycopg2.pool import SimpleConnectionPool
+from psycopg2.extensions import connection as _BaseConnection
+from psycopg2.extras import Json, execute_values
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from typing import Iterable, Iterator
+import datetime
+import inspect
+import io
+import itertools
+import json
 import os
+import time
+import uuid
+
+# 并行写入时连接池已满，等待其他线程归还连接的最长秒数
+POOL_WAIT_SECONDS = 30
+
+
+class _NotCopyable(Exception):
+    """
+    值的文本形式不能确定是否为合法的COPY输入，所在分块改用INSERT写入
+    """
+
+
+def _copy_field(value) -> str:
+    """
+    把单个值转换成COPY csv格式的字段
+    None不加引号（即NULL），其余的值都加引号，这样空字符串不会被当成NULL
+    二进制转为bytea的\\x十六进制格式，字典转为json，时间间隔转为秒数；
+    列表和元组既可能写入数组字段也可能写入json字段，无法从值判断，抛出_NotCopyable
+    :param value:字段值
+    :return:csv字段字符串
+    """
+    if value is None:
+        return ''
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return '"\\x' + bytes(value).hex() + '"'
+    if isinstance(value, dict):
+        value = json.dumps(value, ensure_ascii=False)
+    elif isinstance(value, datetime.timedelta):
+        value = f'{value.total_seconds()} seconds'
+    elif isinstance(value, (list, tuple)):
+        raise _NotCopyable(type(value).__name__)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+class _PooledConnection(_BaseConnection):
+    """
+    连接池使用的连接类，可以在连接对象上记录该连接已经设置的模式和预编译语句缓存
+    连接被关闭后记录随连接对象一起释放，不会因为新连接复用了旧连接的id而误判
+    """
+    _qs_schema = None
+    _qs_statement_cache = None
+
+
+def _pool_sizes(config) -> tuple[int, int]:
+    """
+    读取连接池大小
+    psycopg2的连接池在空闲连接数达到最小连接数后会直接关闭归还的连接，最小连接数为空时与最大连接数相同，避免并发时反复重连
+    :param config:配置对象
+    :return:(最小连接数, 最大连接数)
+    """
+    max_conn = int(config.get('postgresql', 'pool_max_conn', fallback='10'))
+    min_conn = config.get('postgresql', 'pool_min_conn', fallback='').strip()
+    return (int(min_conn) if min_conn else max_conn), max_conn
+
+
+@lru_cache(maxsize=256)
+def _upsert_values_sql(table_name: str, columns: tuple, key_columns: tuple) -> str:
+    """
+    生成execute_values使用的upsert语句模板，按(表, 字段, 主键)缓存
+    :param table_name:表名称
+    :param columns:字段元组
+    :param key_columns:主键元组
+    :return:带VALUES %s占位符的sql语句
+    """
+    columns_str = ','.join(columns)
+    conflict_target = ','.join(key_columns)
+    set_clause = ', '.join([f"{col}=EXCLUDED.{col}" for col in columns])
+    return (f"INSERT INTO {table_name} ({columns_str}) VALUES %s "
+            f"ON CONFLICT ({conflict_target}) DO UPDATE SET {set_clause}")
+
+
+def _group_by_columns(data_list: list[dict], key_columns: tuple) -> list[tuple]:
+    """
+    按字段组合把数据分组，并按主键去重，各组按返回的顺序执行，结果与逐行执行一致
+    同一条多行语句里不能两次更新同一行，所以同组内相同主键只保留最后一行；
+    同一主键在之前的组之后又出现在其他字段组合里时，不能并入之前的组，否则后出现的行会被先执行的组覆盖，
+    这时新开一组排在后面
+    :param data_list:数据列表
+    :param key_columns:主键元组
+    :return:[(字段元组, [值元组, ...]), ...]
+    """
+    groups = []
+    # 字段组合 -> 该字段组合最后一组的序号
+    last_group = {}
+    # 主键 -> 该主键最后一次出现所在组的序号
+    key_group = {}
+    for row in data_list:
+        columns = tuple(row.keys())
+        key = tuple(row.get(col) for col in key_columns)
+        index = last_group.get(columns)
+        if index is None or key_group.get(key, -1) > index:
+            index = len(groups)
+            groups.append((columns, {}))
+            last_group[columns] = index
+        group = groups[index][1]
+        # 先删再加，保证保留的是最后一次出现的位置
+        group.pop(key, None)
+        group[key] = tuple(row.values())
+        key_group[key] = index
+    return [(columns, list(group.values())) for columns, group in groups]
+
+
+def _invalidates_cache(method):
+    """
+    写入方法的装饰器，方法结束后（无论成功与否）使该表的查询缓存失效
+    分块提交的方法失败时可能已经写入了一部分，所以失败也要失效
+    被装饰方法的第一个参数必须是表名
+    """
+    @wraps(method)
+    def wrapper(self, table_name, *args, **kwargs):
+        try:
+            return method(self, table_name, *args, **kwargs)
+        finally:
+            if self.query_cache is not None:
+                self.query_cache.invalidate(table_name, self.schema)
+    return wrapper
+
+
+def _timed(method):
+    """
+    统计方法耗时和行数的装饰器，统计关闭时只多一次属性判断
+    第一个参数为table_name的方法同时按表统计；写入方法返回的整数、查询方法返回的列表长度计为行数
+    """
+    method_name = method.__name__
+    per_table = list(inspect.signature(method).parameters)[1:2] == ['table_name']
+    is_select = method_name.startswith('select')
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        metrics = self.metrics
+        if metrics is None:
+            return method(self, *args, **kwargs)
+        start = time.perf_counter()
+        result = None
+        failed = True
+        try:
+            result = method(self, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            if isinstance(result, int) and not isinstance(result, bool):
+                rows = result
+            elif is_select and isinstance(result, list):
+                rows = len(result)
+            else:
+                rows = None
+            table_name = None
+            if per_table:
+                table_name = normalize_table(args[0] if args else kwargs['table_name'])
+            metrics.observe_method(method_name, table_name, time.perf_counter() - start, rows, failed)
+    return wrapper
 
 
 class PgDbOperator:
@@ -15,28 +182,169 @@ class PgDbOperator:
         self.password = os.getenv('DB_PASSWORD', self.config.get('postgresql', 'password'))
         self.database = os.getenv('DB_DATABASE', self.config.get('postgresql', 'database'))
 
+        # 连接池大小
+        self.pool_min_conn, self.pool_max_conn = _pool_sizes(self.config)
+        # 当前模式，连接取出时按需设置search_path，已经设置的模式记录在连接对象上
+        self.schema = None
+        # 预编译语句缓存大小，为0时不使用预编译语句；每个连接的缓存记录在连接对象上
+        # PREPARE的语句属于数据库会话，经过PgBouncer事务模式连接时会失效，默认关闭
+        self.statement_cache_size = int(self.config.get('postgresql', 'statement_cache_size', fallback='0'))
+        # 表的字段类型缓存，key为(模式, 表名)，批量删除和批量更新时用于参数类型转换
+        self._column_types = {}
+        # 查询结果缓存，默认关闭
+        self.query_cache = None
+        if self.config.getboolean('postgresql', 'query_cache_enable', fallback=False):
+            self.query_cache = QueryCache(
+                max_bytes=int(self.config.get('postgresql', 'query_cache_max_bytes', fallback=str(64 * 1024 * 1024))),
+                default_ttl=float(self.config.get('postgresql', 'query_cache_ttl', fallback='60')),
+                cache_dir=self.config.get('postgresql', 'query_cache_dir', fallback=''),
+            )
+
+        # 操作统计，默认关闭
+        self.metrics = None
+        pool_kwargs = {'connection_factory': _PooledConnection}
+        if self.config.getboolean('postgresql', 'metrics_enable', fallback=False):
+            self.metrics = DbMetrics(
+                slow_query_seconds=self.config.getfloat('postgresql', 'slow_query_ms', fallback=1000) / 1000,
+                dump_path=self.config.get('postgresql', 'metrics_dump_path', fallback=''),
+                dump_interval=self.config.getfloat('postgresql', 'metrics_dump_interval', fallback=60),
+            )
+            # 连接池中的连接都使用统计连接类，提交和游标执行的语句都会被记录；统计连接类同样可以记录模式
+            pool_kwargs['connection_factory'] = self.metrics.connection_factory
+
         # 尝试连接数据库
         try:
-            self.pool = SimpleConnectionPool(
-                minconn=1,
-                maxconn=10,
-                dsn=f"host={self.host} port={self.port} dbname={self.database} user={self.user} password={self.password}"
+            self.pool = ThreadedConnectionPool(
+                minconn=self.pool_min_conn,
+                maxconn=self.pool_max_conn,
+                dsn=f"host={self.host} port={self.port} dbname={self.database} user={self.user} password={self.password}",
+                **pool_kwargs
             )
         except Exception as e:
-            log.critical(f"连接数据库错误: {e}")
+            log.critical("连接数据库错误: %s", e)
             raise
-        self.conn = self.pool.getconn()
-        self.cur = self.conn.cursor()
+        # 配置文件热加载时调整连接池大小和缓存参数，连接参数变化需要重启
+        if hasattr(self.config, 'subscribe'):
+            self.config.subscribe('postgresql', self._on_config_change)
+
+    def _on_config_change(self, config) -> None:
+        """
+        postgresql段落变化后的回调
+        :param config:重新读取后的配置对象
+        :return:无
+        """
+        self.resize_pool(*_pool_sizes(config))
+        if self.query_cache is not None:
+            self.query_cache.default_ttl = float(config.get('postgresql', 'query_cache_ttl', fallback='60'))
+        if self.metrics is not None:
+            self.metrics.slow_query_seconds = config.getfloat('postgresql', 'slow_query_ms', fallback=1000) / 1000
+
+    def resize_pool(self, min_conn: int, max_conn: int) -> None:
+        """
+        调整连接池大小，缩小时立即关闭多余的空闲连接，正在使用的连接归还后按新的大小处理
+        :param min_conn:最少保留的空闲连接数
+        :param max_conn:最多连接数
+        :return:无
+        """
+        if min_conn < 0 or max_conn < max(min_conn, 1):
+            raise ValueError(f'连接池大小不合法：min={min_conn}, max={max_conn}')
+        with self.pool._lock:
+            self.pool.minconn = min_conn
+            self.pool.maxconn = max_conn
+            while len(self.pool._pool) > min_conn:
+                self.pool._pool.pop().close()
+        self.pool_min_conn = min_conn
+        self.pool_max_conn = max_conn
+        log.info('数据库连接池大小已调整为%s-%s', min_conn, max_conn)
+
+    @contextmanager
+    def connection(self, cursor_name: str = None) -> Iterator:
+        """
+        从连接池取出一个连接，返回其游标，用法：with pg.connection() as cur:
+        正常结束时提交，出现异常时回滚，最后把连接放回连接池，可在多线程中同时使用
+        :param cursor_name:服务端游标名称，为空时使用普通游标
+        :return:游标
+        """
+        if self.metrics is None:
+            conn = self.pool.getconn()
+        else:
+            start = time.perf_counter()
+            conn = self.pool.getconn()
+            self.metrics.observe_pool_wait(time.perf_counter() - start)
+        try:
+            # 同步模式，每个连接只在模式变化后设置一次，新建的连接没有记录，取出时一定会设置
+            if self.schema and getattr(conn, '_qs_schema', None) != self.schema:
+                with conn.cursor() as cur:
+                    cur.execute(f"SET search_path TO {self.schema}")
+                conn.commit()
+                conn._qs_schema = self.schema
+            with conn.cursor(name=cursor_name) as cur:
+                yield cur
+            conn.commit()
+        except BaseException:
+            # 连接已经断开时无需回滚，放回连接池时会被丢弃
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def _execute_prepared(self, cur, key: tuple, sql: str, params: tuple) -> None:
+        """
+        通过当前连接的预编译语句缓存执行语句，缓存关闭时直接执行
+        :param cur:游标
+        :param key:缓存键，(操作, 表名, 字段元组, 主键元组或条件)
+        :param sql:sql语句，缓存开启时使用$n占位符，关闭时使用%s占位符
+        :param params:参数元组
+        :return:无
+        """
+        if self.statement_cache_size <= 0:
+            cur.execute(sql, params)
+            return
+        conn = cur.connection
+        cache = getattr(conn, '_qs_statement_cache', None)
+        if cache is None:
+            cache = conn._qs_statement_cache = StatementCache(self.statement_cache_size)
+        cache.execute(cur, key, sql, params)
+
+    def statement_cache_stats(self) -> dict:
+        """
+        预编译语句缓存的命中统计，汇总连接池中现有的连接，已经关闭的连接不再计入
+        :return:{'hits': 命中次数, 'misses': 未命中次数, 'size': 当前缓存的语句数}
+        """
+        with self.pool._lock:
+            connections = list(self.pool._pool) + list(self.pool._used.values())
+        caches = [conn._qs_statement_cache for conn in connections
+                  if getattr(conn, '_qs_statement_cache', None) is not None]
+        return {
+            'hits': sum(cache.hits for cache in caches),
+            'misses': sum(cache.misses for cache in caches),
+            'size': sum(len(cache) for cache in caches),
+        }
+
+    def _placeholders(self, count: int) -> str:
+        """
+        生成占位符字符串，开启预编译语句缓存时使用$n，否则使用%s
+        :param count:占位符个数
+        :return:,隔开的占位符字符串
+        """
+        if self.statement_cache_size > 0:
+            return ','.join(f"${i}" for i in range(1, count + 1))
+        return ','.join(['%s'] * count)
 
     def switch_schema(self, schema_name: str) -> None:
         """
-        切换模式
+        切换模式，之后取出的每个连接都会使用该模式
         :param schema_name:模式名称
         :return:无
         """
-        self.cur.execute(f"SET search_path TO {schema_name}")
-        self.conn.commit()
+        self.schema = schema_name
+        # 先在一个连接上执行一次，模式名有误时立即报错
+        with self.connection():
+            pass
 
+    @_timed
+    @_invalidates_cache
     def insert(self, table_name: str, data_dict: dict) -> None:
         """
         插入单行数据
@@ -46,115 +354,556 @@ class PgDbOperator:
         """
         # 生成,隔开的字符串
         columns = ','.join(data_dict.keys())
-        # 生成%s占位符的字符串
-        placeholders = ','.join(['%s'] * len(data_dict))
+        # 生成占位符的字符串
+        placeholders = self._placeholders(len(data_dict))
         # 暂时不考虑时间格式
         sql = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
         try:
-            self.cur.execute(sql, tuple(data_dict.values()))
-            self.conn.commit()
+            with self.connection() as cur:
+                self._execute_prepared(cur, ('insert', table_name, tuple(data_dict.keys())),
+                                       sql, tuple(data_dict.values()))
         except Exception as e:
-            log.error(f"插入数据错误: {e}")
-            self.conn.rollback()
-            log.error(f"{sql}未执行成功")
+            log.error("插入数据错误: %s", e)
+            log.error("%s未执行成功", sql)
             raise
 
-    def inserts(self, table_name: str, data_list: list) -> None:
+    @_timed
+    @_invalidates_cache
+    def inserts(self, table_name: str, data_list: Iterable[dict], chunk_size: int = 10000) -> int:
         """
-        批量插入数据
+        批量插入数据，使用COPY ... FROM STDIN写入，每个分块一个事务
         :param table_name:表名称
-        :param data_list:数据列表
+        :param data_list:数据列表，也可以是生成字典的迭代器，字段以第一行为准
+        :param chunk_size:每个分块的行数，一个分块提交一次
+        :return:写入的总行数
+        """
+        rows = iter(data_list)
+        # 以第一行的字段作为COPY的字段
+        first_row = next(rows, None)
+        if not first_row:
+            return 0
+        columns = list(first_row.keys())
+        sql = f"COPY {table_name} ({','.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+
+        total = 0
+        chunk = [first_row]
+        try:
+            with self.connection() as cur:
+                for row in rows:
+                    chunk.append(row)
+                    if len(chunk) >= chunk_size:
+                        total += self._copy_values(cur, sql, [[row.get(col) for col in columns] for row in chunk],
+                                                   fallback=(table_name, table_name, columns))
+                        chunk = []
+                # 处理剩余不足一个分块的数据
+                if chunk:
+                    total += self._copy_values(cur, sql, [[row.get(col) for col in columns] for row in chunk],
+                                               fallback=(table_name, table_name, columns))
+        except Exception as e:
+            log.error("COPY数据错误: %s", e)
+            log.error("%s未执行成功，已写入%s条数据", sql, total)
+            raise
+        log.info("COPY %s 执行成功，写入%s条数据", table_name, total)
+        return total
+
+    def _copy_values(self, cur, sql: str, rows: list, fallback: tuple, commit: bool = True) -> int:
+        """
+        把一个分块的数据写成csv缓冲区后通过COPY写入
+        分块中有不能转为COPY文本的值（列表等）时，该分块改用execute_values写入，由psycopg2转换类型
+        :param cur:游标
+        :param sql:COPY语句
+        :param rows:分块数据，每行为按字段顺序排列的值序列
+        :param fallback:改用INSERT时的(写入的表, 读取字段类型的表, 字段列表)
+        :param commit:写入后是否提交事务
+        :return:写入的行数
+        """
+        buffer = io.StringIO()
+        try:
+            for values in rows:
+                buffer.write(','.join(map(_copy_field, values)))
+                buffer.write('\n')
+        except _NotCopyable:
+            self._insert_values(cur, *fallback, rows)
+        else:
+            buffer.seek(0)
+            cur.copy_expert(sql, buffer)
+        if commit:
+            cur.connection.commit()
+        return len(rows)
+
+    def _insert_values(self, cur, target_table: str, types_table: str, columns: list, rows: list) -> None:
+        """
+        用execute_values写入一个分块，json和jsonb字段中的列表和字典包装为Json，其余列表由psycopg2转为数组
+        :param cur:游标
+        :param target_table:写入的表
+        :param types_table:读取字段类型的表，写入临时表时为临时表对应的目标表
+        :param columns:字段列表
+        :param rows:分块数据
         :return:无
         """
-        pass
+        column_types = self._get_column_types(cur, types_table)
+        json_indexes = [index for index, col in enumerate(columns)
+                        if column_types.get(col.strip('"').lower()) in ('json', 'jsonb')]
+        values = []
+        for row in rows:
+            row = list(row)
+            for index, value in enumerate(row):
+                if isinstance(value, dict) or (index in json_indexes and isinstance(value, (list, tuple))):
+                    row[index] = Json(value)
+            values.append(row)
+        execute_values(cur, f"INSERT INTO {target_table} ({','.join(columns)}) VALUES %s", values,
+                       page_size=len(values))
 
-    def delete(self, table_name: str, condition: str) -> None:
+    @_timed
+    def select_arrays(self, sql: str, itersize: int = 10000) -> dict:
+        """
+        按列返回查询结果，结果直接从游标分批读取后按列拼接，不生成逐行的字典
+        安装了numpy时每列为numpy数组，否则为列表
+        :param sql:sql语句
+        :param itersize:每次从服务端拉取的行数
+        :return:{字段名: 该列的数组}
+        """
+        try:
+            with self.connection(cursor_name=f"qs_arrays_{uuid.uuid4().hex}") as cur:
+                cur.itersize = itersize
+                cur.execute(sql)
+                columns = None
+                while True:
+                    rows = cur.fetchmany(itersize)
+                    if not rows:
+                        break
+                    # 服务端游标要拉取第一批数据后才有字段描述
+                    if columns is None:
+                        columns = {desc[0]: [] for desc in cur.description}
+                    for values, column in zip(zip(*rows), columns.values()):
+                        column.extend(values)
+                if columns is None:
+                    columns = {desc[0]: [] for desc in cur.description or []}
+        except Exception as e:
+            log.error("查询语句错误: %s", e)
+            raise
+        try:
+            import numpy
+        except ImportError:
+            return columns
+        return {name: numpy.array(values) for name, values in columns.items()}
+
+    @_timed
+    def select_frame(self, sql: str, **read_csv_kwargs):
+        """
+        查询结果返回为pandas.DataFrame，通过COPY ... TO STDOUT导出csv后由pandas直接解析
+        csv中不带类型信息，日期等字段需要通过parse_dates、dtype等参数指定
+        :param sql:sql语句
+        :param read_csv_kwargs:传给pandas.read_csv的参数
+        :return:DataFrame
+        """
+        import pandas
+
+        buffer = io.StringIO()
+        try:
+            with self.connection() as cur:
+                cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true)", buffer)
+        except Exception as e:
+            log.error("查询语句错误: %s", e)
+            raise
+        buffer.seek(0)
+        return pandas.read_csv(buffer, **read_csv_kwargs)
+
+    @_timed
+    @_invalidates_cache
+    def write_frame(self, table_name: str, frame, key_columns: list[str] = None, chunk_size: int = 10000) -> int:
+        """
+        通过COPY写入DataFrame或{字段名: 数组}字典，不生成逐行的字典
+        不传key_columns时直接写入目标表，每个分块一个事务；
+        传入key_columns时先写入临时表，再整体upsert到目标表，整个过程一个事务
+        :param table_name:表名称
+        :param frame:pandas.DataFrame，或{字段名: 列表/数组}字典，空值请使用None
+        :param key_columns:主键列，为空时只插入
+        :param chunk_size:每个分块的行数
+        :return:写入的总行数
+        """
+        if hasattr(frame, 'itertuples'):
+            columns = [str(col) for col in frame.columns]
+            # pandas的空值统一转成None，写入后为NULL
+            rows = frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None)
+        else:
+            columns = list(frame.keys())
+            rows = zip(*frame.values())
+        columns_str = ','.join(columns)
+
+        total = 0
+        try:
+            with self.connection() as cur:
+                if key_columns:
+                    stage_table = f"qs_stage_{uuid.uuid4().hex}"
+                    cur.execute(f"CREATE TEMP TABLE {stage_table} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP")
+                    sql = f"COPY {stage_table} ({columns_str}) FROM STDIN WITH (FORMAT csv)"
+                else:
+                    sql = f"COPY {table_name} ({columns_str}) FROM STDIN WITH (FORMAT csv)"
+                while True:
+                    chunk = list(itertools.islice(rows, chunk_size))
+                    if not chunk:
+                        break
+                    # upsert模式下临时表在提交时删除，所以只在最后统一提交
+                    total += self._copy_values(cur, sql, chunk, commit=not key_columns,
+                                               fallback=(stage_table if key_columns else table_name, table_name, columns))
+                if key_columns:
+                    conflict_target = ','.join(key_columns)
+                    set_clause = ', '.join([f"{col}=EXCLUDED.{col}" for col in columns])
+                    # 临时表中主键重复时，保留最后写入的一行
+                    cur.execute(f"INSERT INTO {table_name} ({columns_str}) "
+                                f"SELECT DISTINCT ON ({conflict_target}) {columns_str} FROM {stage_table} "
+                                f"ORDER BY {conflict_target}, ctid DESC "
+                                f"ON CONFLICT ({conflict_target}) DO UPDATE SET {set_clause}")
+        except Exception as e:
+            log.error("写入%s错误: %s", table_name, e)
+            raise
+        log.info("COPY %s 执行成功，写入%s条数据", table_name, total)
+        return total
+
+    @_timed
+    @_invalidates_cache
+    def delete(self, table_name: str, condition) -> None:
         """
         删除数据
         :param table_name:表名称
-        :param condition:删除条件
+        :param condition:删除条件，字符串或sql_builder中的条件，见sql_builder模块；不能为空，删除全表时传入'TRUE'
         :return:无
         """
-        sql = f"DELETE FROM {table_name} WHERE {condition}"
+        condition = to_write_condition(condition)
+        sql = f"DELETE FROM {table_name}"
         try:
-            self.cur.execute(sql)
-            self.conn.commit()
+            with self.connection() as cur:
+                if isinstance(condition, Condition):
+                    # 值作为参数传递，结构相同的条件复用同一条预编译语句
+                    if self.statement_cache_size > 0:
+                        sql = f"{sql} WHERE {condition.template(cur, '$')}"
+                        self._execute_prepared(cur, ('delete', table_name, condition.key), sql, condition.params)
+                    else:
+                        sql = f"{sql} WHERE {condition.template(cur)}"
+                        cur.execute(sql, condition.params)
+                else:
+                    sql = f"{sql} WHERE {condition or 'TRUE'}"
+                    cur.execute(sql)
         except Exception as e:
-            log.error(f"删除数据错误: {e}")
-            self.conn.rollback()
+            log.error("删除数据错误: %s", e)
 
-    def update(self, table_name: str, data_dict: dict, condition: str) -> None:
+    @_timed
+    @_invalidates_cache
+    def update(self, table_name: str, data_dict: dict, condition) -> None:
         """
         更新单行数据
         :param table_name:表名称
         :param data_dict:数据字典
-        :param condition:更新条件
+        :param condition:更新条件，字符串或sql_builder中的条件，见sql_builder模块；不能为空，更新全表时传入'TRUE'
         :return:无
         """
-        set_clause = ', '.join([f"{key} = %s" for key in data_dict.keys()])
-        sql = f"UPDATE {table_name} SET {set_clause} WHERE {condition}"
+        condition = to_write_condition(condition)
+        try:
+            with self.connection() as cur:
+                if isinstance(condition, Condition):
+                    placeholders = self._placeholders(len(data_dict)).split(',')
+                    set_clause = ', '.join([f"{key} = {placeholder}"
+                                            for key, placeholder in zip(data_dict.keys(), placeholders)])
+                    # 条件的占位符接在SET的占位符后面编号
+                    style = '$' if self.statement_cache_size > 0 else '%s'
+                    sql = f"UPDATE {table_name} SET {set_clause} WHERE {condition.template(cur, style, len(data_dict) + 1)}"
+                    self._execute_prepared(cur, ('update', table_name, tuple(data_dict.keys()), condition.key),
+                                           sql, tuple(data_dict.values()) + condition.params)
+                else:
+                    # 字符串条件每次调用一般都不同，预编译只会增加PREPARE和DEALLOCATE，直接执行
+                    set_clause = ', '.join([f"{key} = %s" for key in data_dict.keys()])
+                    sql = f"UPDATE {table_name} SET {set_clause} WHERE {condition or 'TRUE'}"
+                    cur.execute(sql, tuple(data_dict.values()))
+        except Exception as e:
+            log.error("更新数据错误: %s", e)
+
+    def _get_column_types(self, cur, table_name: str) -> dict:
+        """
+        从系统表读取字段类型，按(模式, 表名)缓存，表结构变化后需要重新创建操作对象
+        :param cur:游标
+        :param table_name:表名称
+        :return:{字段名: 类型名称}，如{'id': 'bigint', 'price': 'numeric(10,2)'}
+        """
+        key = (self.schema, table_name)
+        column_types = self._column_types.get(key)
+        if column_types is None:
+            cur.execute("SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute "
+                        "WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped", (table_name,))
+            column_types = dict(cur.fetchall())
+            self._column_types[key] = column_types
+        return column_types
+
+    @staticmethod
+    def _typed_template(column_types: dict, columns: tuple) -> str:
+        """
+        生成VALUES的行模板，每个值按字段类型转换，避免VALUES中的值被推断为text
+        :param column_types:字段类型
+        :param columns:字段元组
+        :return:如(%s::bigint,%s::text)
+        """
+        missing = [col for col in columns if col not in column_types]
+        if missing:
+            raise ValueError(f"表中没有字段：{','.join(missing)}")
+        return '(' + ','.join(f"%s::{column_types[col]}" for col in columns) + ')'
+
+    @_timed
+    @_invalidates_cache
+    def deletes(self, table_name: str, keys: list, key_columns, batch_size: int = 1000) -> int:
+        """
+        按主键批量删除，每批一条语句、一个事务
+        单个主键列时使用 = ANY(数组)，多个主键列时与VALUES列表关联删除
+        :param table_name:表名称
+        :param keys:主键列表，单个主键列时元素为值，多个主键列时元素为元组或字典
+        :param key_columns:主键列，单个主键列时可以传字符串
+        :param batch_size:每批删除的主键数
+        :return:删除的行数
+        """
+        key_columns = (key_columns,) if isinstance(key_columns, str) else tuple(key_columns)
+        if not keys:
+            return 0
+        if len(key_columns) == 1:
+            col = key_columns[0]
+            values = [key[col] if isinstance(key, dict) else key[0] if isinstance(key, (tuple, list)) else key
+                      for key in keys]
+        else:
+            values = [tuple(key[col] for col in key_columns) if isinstance(key, dict) else tuple(key) for key in keys]
+
+        total = 0
         try:
-            self.cur.execute(sql, tuple(data_dict.values()))
-            self.conn.commit()
+            with self.connection() as cur:
+                column_types = self._get_column_types(cur, table_name)
+                template = self._typed_template(column_types, key_columns)
+                if len(key_columns) == 1:
+                    col = key_columns[0]
+                    # 数组按主键列的类型转换，uuid等类型的主键也能比较
+                    sql = f"DELETE FROM {table_name} WHERE {col} = ANY(%s::{column_types[col]}[])"
+                else:
+                    join = ' AND '.join(f"t.{col} = v.{col}" for col in key_columns)
+                    sql = (f"DELETE FROM {table_name} AS t USING (VALUES %s) AS v ({','.join(key_columns)}) "
+                           f"WHERE {join}")
+                for i in range(0, len(values), batch_size):
+                    batch = values[i:i + batch_size]
+                    if len(key_columns) == 1:
+                        cur.execute(sql, (batch,))
+                    else:
+                        # 一批只生成一条语句，rowcount才是整批的删除行数
+                        execute_values(cur, sql, batch, template=template, page_size=len(batch))
+                    total += cur.rowcount
+                    cur.connection.commit()
         except Exception as e:
-            log.error(f"更新数据错误: {e}")
-            self.conn.rollback()
+            log.error("批量删除 %s 失败，已删除%s条数据: %s", table_name, total, e)
+            raise
+        log.info("批量删除 %s 执行成功，删除%s条数据", table_name, total)
+        return total
 
-    def select(self, table_name: str, field_list: list[str], condition: str) -> list:
+    @_timed
+    @_invalidates_cache
+    def updates(self, table_name: str, data_list: list[dict], key_columns, batch_size: int = 1000) -> int:
+        """
+        按主键批量更新，使用 UPDATE ... FROM (VALUES ...) 关联更新，每批一条语句、一个事务
+        字段组合不同的行分组执行，分组的执行顺序与逐行执行的结果一致，同一主键出现多次时以最后一次为准
+        :param table_name:表名称
+        :param data_list:数据列表，每行必须包含全部主键列
+        :param key_columns:主键列，单个主键列时可以传字符串
+        :param batch_size:每批更新的行数
+        :return:更新的行数
+        """
+        key_columns = (key_columns,) if isinstance(key_columns, str) else tuple(key_columns)
+        if not data_list:
+            return 0
+        total = 0
+        try:
+            with self.connection() as cur:
+                column_types = self._get_column_types(cur, table_name)
+                for columns, rows in _group_by_columns(data_list, key_columns):
+                    missing = [col for col in key_columns if col not in columns]
+                    if missing:
+                        raise ValueError(f"数据中缺少主键列：{','.join(missing)}")
+                    set_clause = ', '.join(f"{col} = v.{col}" for col in columns if col not in key_columns)
+                    if not set_clause:
+                        continue
+                    join = ' AND '.join(f"t.{col} = v.{col}" for col in key_columns)
+                    sql = (f"UPDATE {table_name} AS t SET {set_clause} FROM (VALUES %s) AS v ({','.join(columns)}) "
+                           f"WHERE {join}")
+                    template = self._typed_template(column_types, columns)
+                    for i in range(0, len(rows), batch_size):
+                        batch = rows[i:i + batch_size]
+                        execute_values(cur, sql, batch, template=template, page_size=len(batch))
+                        total += cur.rowcount
+                        cur.connection.commit()
+        except Exception as e:
+            log.error("批量更新 %s 失败，已更新%s条数据: %s", table_name, total, e)
+            raise
+        log.info("批量更新 %s 执行成功，更新%s条数据", table_name, total)
+        return total
+
+    @_timed
+    def select(self, table_name: str, field_list: list[str], condition, cache_ttl: float = None) -> list:
         """
         查询数据，指定了字段
         :param table_name: 表格名称
         :param field_list: 需要的字段，列表格式
-        :param condition: 条件
+        :param condition: 条件，字符串或sql_builder中的条件，见sql_builder模块
+        :param cache_ttl: 开启查询缓存时本次结果的缓存秒数，为空时使用默认值，为0时不使用缓存
         :return: 查询结果列表
         """
         # fields = '(' + ','.join(field_list) + ')'
         fields = ','.join(field_list)
-        if condition == 'TRUE':
-            sql = f"SELECT {fields} FROM {table_name}"
-        else:
-            sql = f"SELECT {fields} FROM {table_name} WHERE {condition}"
-        try:
-            self.cur.execute(sql)
-            results = self.cur.fetchall()
-            return results
-        except Exception as e:
-            log.error(f"查询语句错误: {e}")
-            raise
+        sql, condition = self._with_condition(f"SELECT {fields} FROM {table_name}", condition)
+        return self._fetchall(sql, qualify_table(table_name, self.schema), cache_ttl, condition=condition)
 
-    def select_star(self, table_name: str, condition: str) -> list:
+    @_timed
+    def select_star(self, table_name: str, condition, cache_ttl: float = None) -> list:
         """
         查询所有数据
         :param table_name:表名称
-        :param condition:查询条件
+        :param condition:查询条件，字符串或sql_builder中的条件，见sql_builder模块
+        :param cache_ttl:开启查询缓存时本次结果的缓存秒数，为空时使用默认值，为0时不使用缓存
         :return:查询结果列表
         """
-        if condition == 'TRUE':
-            sql = f"SELECT * FROM {table_name}"
-        else:
-            sql = f"SELECT * FROM {table_name} WHERE {condition}"
-        try:
-            self.cur.execute(sql)
-            results = self.cur.fetchall()
-            return results
-        except Exception as e:
-            log.error(f"查询语句错误: {e}")
-            raise
+        sql, condition = self._with_condition(f"SELECT * FROM {table_name}", condition)
+        return self._fetchall(sql, qualify_table(table_name, self.schema), cache_ttl, condition=condition)
 
-    def select_custom(self, sql: str) -> list:
+    @_timed
+    def select_custom(self, sql: str, cache_ttl: float = None, params: tuple = None) -> list:
         """
         执行自定义sql语句
         :param sql:sql语句
+        :param cache_ttl:开启查询缓存时本次结果的缓存秒数，为空时使用默认值，为0时不使用缓存，
+                         涉及的表从FROM和JOIN子句中识别，识别不出时不使用缓存
+        :param params:sql语句中%s占位符对应的参数，为空时sql中的%不需要转义
         :return:查询结果列表
         """
+        return self._fetchall(sql, tables_in_sql(sql, self.schema), cache_ttl, params=params)
+
+    @staticmethod
+    def _with_condition(sql: str, condition) -> tuple:
+        """
+        处理查询条件：字符串条件按原来的方式拼接到sql后面，sql_builder中的条件返回给调用方，取得连接后再编译
+        :param sql:不含WHERE的sql语句
+        :param condition:条件
+        :return:(sql语句, Condition或None)
+        """
+        condition = to_condition(condition)
+        if condition is None:
+            return sql, None
+        if isinstance(condition, Condition):
+            return sql, condition
+        return f"{sql} WHERE {condition}", None
+
+    def _fetchall(self, sql: str, tables: tuple, cache_ttl: float = None, params: tuple = None,
+                  condition: Condition = None) -> list:
+        """
+        执行查询并返回全部结果，开启查询缓存时先读缓存
+        :param sql:sql语句，condition不为空时为不含WHERE的部分
+        :param tables:涉及的表的失效标签元组，见query_cache.qualify_table，为None时不使用缓存
+        :param cache_ttl:缓存秒数，为空时使用默认值，为0时不使用缓存
+        :param params:sql语句的参数，condition不为空时使用条件的参数
+        :param condition:sql_builder中的条件，开启预编译语句缓存时按(语句, 条件结构)预编译
+        :return:查询结果列表
+        """
+        if condition is not None:
+            params = condition.params
+        # 识别不出涉及的表时无法按表失效，不使用缓存
+        use_cache = self.query_cache is not None and cache_ttl != 0 and tables is not None
+        if use_cache:
+            # 条件的模板由结构决定，缓存键用结构代替编译后的语句，命中时不需要取连接
+            key = self.query_cache.make_key(sql, params if condition is None else (condition.key, params),
+                                            self.schema)
+            hit, results = self.query_cache.get(key)
+            if hit:
+                return list(results)
+            generations = self.query_cache.snapshot(tables)
         try:
-            self.cur.execute(sql)
-            results = self.cur.fetchall()
-            return results
+            with self.connection() as cur:
+                if condition is None:
+                    cur.execute(sql, params)
+                elif self.statement_cache_size > 0:
+                    self._execute_prepared(cur, ('select', sql, condition.key),
+                                           f"{sql} WHERE {condition.template(cur, '$')}", params)
+                else:
+                    cur.execute(f"{sql} WHERE {condition.template(cur)}", params)
+                results = cur.fetchall()
         except Exception as e:
-            log.error(f"查询语句错误: {e}")
+            log.error("查询语句错误: %s", e)
             raise
+        if use_cache:
+            self.query_cache.set(key, results, tables, generations, cache_ttl)
+        return results
+
+    def iter_select(self, table_name: str, field_list: list[str], condition,
+                    itersize: int = 2000, batch_size: int = 0) -> Iterator:
+        """
+        流式查询数据，指定了字段，使用服务端游标，内存占用与表大小无关
+        :param table_name: 表格名称
+        :param field_list: 需要的字段，列表格式
+        :param condition: 条件，字符串或sql_builder中的条件，见sql_builder模块
+        :param itersize: 每次从服务端拉取的行数
+        :param batch_size: 为0时逐行返回，大于0时每次返回一批行组成的列表
+        :return: 行或行列表的生成器
+        """
+        fields = ','.join(field_list)
+        sql, condition = self._with_condition(f"SELECT {fields} FROM {table_name}", condition)
+        return self._iter_query(sql, itersize, batch_size, condition=condition)
+
+    def iter_star(self, table_name: str, condition, itersize: int = 2000, batch_size: int = 0) -> Iterator:
+        """
+        流式查询所有字段
+        :param table_name:表名称
+        :param condition:查询条件，字符串或sql_builder中的条件，见sql_builder模块
+        :param itersize: 每次从服务端拉取的行数
+        :param batch_size: 为0时逐行返回，大于0时每次返回一批行组成的列表
+        :return:行或行列表的生成器
+        """
+        sql, condition = self._with_condition(f"SELECT * FROM {table_name}", condition)
+        return self._iter_query(sql, itersize, batch_size, condition=condition)
 
+    def iter_custom(self, sql: str, itersize: int = 2000, batch_size: int = 0, params: tuple = None) -> Iterator:
+        """
+        流式执行自定义查询语句
+        :param sql:sql语句
+        :param itersize: 每次从服务端拉取的行数
+        :param batch_size: 为0时逐行返回，大于0时每次返回一批行组成的列表
+        :param params:sql语句中%s占位符对应的参数
+        :return:行或行列表的生成器
+        """
+        return self._iter_query(sql, itersize, batch_size, params=params)
+
+    def _iter_query(self, sql: str, itersize: int, batch_size: int, params: tuple = None,
+                    condition: Condition = None) -> Iterator:
+        """
+        流式查询的公共实现
+        服务端游标只在事务内有效，迭代期间一直占用一个连接，迭代结束或生成器被关闭时归还
+        服务端游标不能声明在预编译语句上，条件按%s占位符编译
+        :param sql:sql语句，condition不为空时为不含WHERE的部分
+        :param itersize: 每次从服务端拉取的行数
+        :param batch_size: 为0时逐行返回，大于0时每次返回一批行组成的列表
+        :param params:sql语句的参数
+        :param condition:sql_builder中的条件
+        :return:行或行列表的生成器
+        """
+        with self.connection(cursor_name=f"qs_iter_{uuid.uuid4().hex}") as cur:
+            cur.itersize = itersize
+            try:
+                if condition is not None:
+                    sql = f"{sql} WHERE {condition.template(cur.connection)}"
+                    params = condition.params
+                cur.execute(sql, params)
+                if batch_size > 0:
+                    while True:
+                        rows = cur.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        yield rows
+                else:
+                    yield from cur
+            except Exception as e:
+                log.error("查询语句错误: %s", e)
+                raise
+
+    @_timed
+    @_invalidates_cache
     def upsert(self, table_name: str, data_dict: dict, key_columns: list[str]) -> None:
         """
         upsert单行数据，如果数据库中存在主键，则更新，否则插入
@@ -168,107 +917,206 @@ class PgDbOperator:
             return
         # 构建单条upsert语句
         columns = ','.join(data_dict.keys())
-        placeholders = ','.join(['%s'] * len(data_dict))
+        placeholders = self._placeholders(len(data_dict))
         conflict_target = ','.join(key_columns)
         set_clause = ', '.join([f"{col}=EXCLUDED.{col}" for col in data_dict.keys()])
         upsert_template = (f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders}) "
-                           f"ON CONFLICT ({conflict_target}) DO UPDATE SET {set_clause};")
+                           f"ON CONFLICT ({conflict_target}) DO UPDATE SET {set_clause}")
 
         # 尝试执行单条upsert语句
         try:
-            self.cur.execute(upsert_template, tuple(data_dict.values()))
-            self.conn.commit()
-            log.info(f"{table_name} upsert成功")
+            with self.connection() as cur:
+                self._execute_prepared(cur, ('upsert', table_name, tuple(data_dict.keys()), tuple(key_columns)),
+                                       upsert_template, tuple(data_dict.values()))
+            log.info("%s upsert成功", table_name)
             return
         except Exception as e:
-            log.error(f"{table_name} upsert失败: {e}")
-            self.conn.rollback()
+            log.error("%s upsert失败: %s", table_name, e)
             raise
 
-    def upserts(self, table_name: str, data_list: list[dict[str, any]], key_columns: list[str]) -> None:
+    @_timed
+    @_invalidates_cache
+    def upserts(self, table_name: str, data_list: list[dict[str, any]], key_columns: list[str],
+                page_size: int = 500) -> None:
         """
         批量upsert数据，如果数据库中存在主键，则更新，否则插入
+        按页拼成多行VALUES语句执行，每页提交一次
         :param table_name:表名称
         :param data_list:数据列表
         :param key_columns:主键列
+        :param page_size:每条语句包含的行数
         :return:无
         """
         # 检查传入数据是否为空
         if not data_list:
             return
-        # 构建UPSERT语句模板，都是拿第一行的数据作为模板
-        placeholders = ','.join(['%s'] * len(data_list[0]))
-        columns_str = ','.join(data_list[0].keys())
-        conflict_target = ','.join(key_columns)
-        set_clause = ', '.join([f"{col}=EXCLUDED.{col}" for col in data_list[0].keys()])
-        upsert_template = (f"INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders}) "
-                           f"ON CONFLICT ({conflict_target}) DO UPDATE SET {set_clause};")
-        # 尝试执行语句
         try:
-            batch_count = 0
-            for row in data_list:
-                self.cur.execute(upsert_template, tuple(row.values()))
-                batch_count += 1
-                # 达到500条时提交
-                if batch_count >= 500:
-                    self.conn.commit()
-                    batch_count = 0
-            # 处理剩余次数不足的数据
-            if batch_count > 0:
-                self.conn.commit()
-            # print("batch_count", batch_count)
-            log.info(f"UPSERT {table_name} 执行成功，执行{len(data_list)}条语句")
-            return
+            with self.connection() as cur:
+                self._upsert_batched(cur, table_name, data_list, key_columns, page_size)
+            log.info("UPSERT %s 执行成功，执行%s条数据", table_name, len(data_list))
         except Exception as e:
-            log.error(f"UPSERT {table_name} 执行失败: {e}")
-            self.conn.rollback()
+            log.error("UPSERT %s 执行失败: %s", table_name, e)
             raise
 
-    def upserts_dif_len_dict(self, table_name: str, data_list: list[dict[str, any]], key_columns: list[str]) -> None:
+    @_timed
+    @_invalidates_cache
+    def upserts_dif_len_dict(self, table_name: str, data_list: list[dict[str, any]], key_columns: list[str],
+                             page_size: int = 500) -> None:
         """
         批量upsert数据，如果数据库中存在主键，则更新，否则插入
+        每行的字段可以不同，按字段组合分组后批量执行，同一主键出现多次时以最后一次为准
         :param table_name:表名称
         :param data_list:数据列表
         :param key_columns:主键列
+        :param page_size:每条语句包含的行数
         :return:无
         """
         # 检查传入数据是否为空
         if not data_list:
             return
-        # 开始循环
-        batch_count = 0
+        # 先检查关键字段，避免写了一半才发现数据有问题
         for row in data_list:
-            if all(column in row.keys() for column in key_columns):
-                # 构建sql语句
-                placeholders = ','.join(['%s'] * len(row))
-                columns_str = ','.join(row.keys())
-                conflict_target = ','.join(key_columns)
-                set_clause = ', '.join([f"{col}=EXCLUDED.{col}" for col in row.keys()])
-                upsert_template = (f'INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders}) '
-                                   f'ON CONFLICT ({conflict_target}) DO UPDATE SET {set_clause};')
-                # 开始写数据
-                try:
-                    self.cur.execute(upsert_template, tuple(row.values()))
-                    batch_count += 1
-                    # 达到500条时提交
-                    if batch_count >= 500:
-                        self.conn.commit()
-                        batch_count = 0
-                except Exception as e:
-                    log.error(f"UPSERT {table_name} 执行失败: {e}")
-                    self.conn.rollback()
-                    raise
-            else:
-                log.error(f"{row} 缺失关键字段:{key_columns}")
+            if not all(column in row.keys() for column in key_columns):
+                log.error("%s 缺失关键字段:%s", row, key_columns)
                 raise ValueError(f"{row} 缺失关键字段:{key_columns}")
-        # 处理剩余次数不足的数据
-        if batch_count > 0:
-            self.conn.commit()
+        try:
+            with self.connection() as cur:
+                self._upsert_batched(cur, table_name, data_list, key_columns, page_size)
+        except Exception as e:
+            log.error("UPSERT %s 执行失败: %s", table_name, e)
+            raise
+
+    @_timed
+    @_invalidates_cache
+    def upserts_parallel(self, table_name: str, data_list: list[dict[str, any]], key_columns: list[str],
+                         workers: int = 0, page_size: int = 500, retries: int = 2) -> list[dict]:
+        """
+        并行批量upsert，按主键哈希分区，每个分区在线程池中使用独立的连接和事务写入
+        相同主键一定落在同一分区，分区之间不会争抢同一行，避免死锁
+        每个分区单独提交，部分分区失败时已经成功的分区不会回滚，调用方应检查返回结果，对失败的分区重新写入
+        :param table_name:表名称
+        :param data_list:数据列表
+        :param key_columns:主键列
+        :param workers:并行数，为0时使用连接池最大连接数减一，给其他线程留一个连接；最多不超过连接池最大连接数
+        :param page_size:每条语句包含的行数
+        :param retries:分区失败后的重试次数
+        :return:每个分区的结果列表，包含partition、rows、success、attempts、error
+        """
+        if not data_list:
+            return []
+        workers = min(workers or max(self.pool_max_conn - 1, 1), self.pool_max_conn, len(data_list))
+        # 按主键哈希分区
+        partitions = [[] for _ in range(workers)]
+        for row in data_list:
+            try:
+                key = tuple(row[col] for col in key_columns)
+            except KeyError:
+                log.error("%s 缺失关键字段:%s", row, key_columns)
+                raise ValueError(f"{row} 缺失关键字段:{key_columns}")
+            partitions[hash(key) % workers].append(row)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pg_upsert') as executor:
+            futures = [executor.submit(self._upsert_partition, table_name, index, rows, key_columns, page_size, retries)
+                       for index, rows in enumerate(partitions) if rows]
+            results = [future.result() for future in futures]
+
+        failed = [result for result in results if not result['success']]
+        if failed:
+            log.error("UPSERT %s 并行执行有%s个分区失败: %s", table_name, len(failed),
+                      [(result['partition'], result['error']) for result in failed])
+        else:
+            log.info("UPSERT %s 并行执行成功，%s个分区共%s条数据", table_name, len(results), len(data_list))
+        return results
+
+    def _upsert_partition(self, table_name: str, index: int, rows: list[dict], key_columns: list[str],
+                          page_size: int, retries: int) -> dict:
+        """
+        写入一个分区，整个分区一个事务，失败后按退避时间重试
+        psycopg2的连接池没有空闲连接时直接报错而不是等待，此时等待其他线程归还连接，不计入重试次数
+        :param table_name:表名称
+        :param index:分区编号
+        :param rows:分区数据
+        :param key_columns:主键列
+        :param page_size:每条语句包含的行数
+        :param retries:重试次数
+        :return:分区结果
+        """
+        result = {'partition': index, 'rows': len(rows), 'success': False, 'attempts': 0, 'error': None}
+        attempt = 0
+        pool_wait_until = None
+        while attempt <= retries:
+            result['attempts'] = attempt + 1
+            try:
+                with self.connection() as cur:
+                    self._upsert_batched(cur, table_name, rows, key_columns, page_size, commit=False)
+                result['success'] = True
+                result['error'] = None
+                return result
+            except PoolError as e:
+                # 连接池已满，最多等待POOL_WAIT_SECONDS秒
+                now = time.monotonic()
+                if pool_wait_until is None:
+                    pool_wait_until = now + POOL_WAIT_SECONDS
+                if now < pool_wait_until and not self.pool.closed:
+                    time.sleep(0.05)
+                    continue
+                result['error'] = str(e)
+                log.warning("UPSERT %s 分区%s等待连接超时: %s", table_name, index, e)
+                pool_wait_until = None
+                attempt += 1
+            except Exception as e:
+                result['error'] = str(e)
+                log.warning("UPSERT %s 分区%s第%s次执行失败: %s", table_name, index, attempt + 1, e)
+                if attempt < retries:
+                    time.sleep(0.5 * 2 ** attempt)
+                attempt += 1
+        return result
+
+    @staticmethod
+    def _upsert_batched(cur, table_name: str, data_list: list[dict], key_columns: list[str],
+                        page_size: int, commit: bool = True) -> None:
+        """
+        批量upsert的执行引擎
+        按字段组合分组，每组按页生成多行VALUES的INSERT ... ON CONFLICT语句，同一主键以最后一次出现为准
+        :param cur:游标
+        :param table_name:表名称
+        :param data_list:数据列表
+        :param key_columns:主键列
+        :param page_size:每条语句包含的行数
+        :param commit:是否每页提交一次，为False时由调用方统一提交
+        :return:无
+        """
+        key_columns = tuple(key_columns)
+        for columns, rows in _group_by_columns(data_list, key_columns):
+            sql = _upsert_values_sql(table_name, columns, key_columns)
+            for i in range(0, len(rows), page_size):
+                execute_values(cur, sql, rows[i:i + page_size], page_size=page_size)
+                if commit:
+                    cur.connection.commit()
+
+    def invalidate_cache(self, table_name: str) -> None:
+        """
+        手动使某张表的查询缓存失效，用于其他途径写入数据库之后
+        :param table_name:表名称
+        :return:无
+        """
+        if self.query_cache is not None:
+            self.query_cache.invalidate(table_name, self.schema)
+
+    def metrics_snapshot(self) -> dict:
+        """
+        当前的操作统计，统计关闭时为空字典
+        :return:统计结果，见DbMetrics.snapshot
+        """
+        if self.metrics is None:
+            return {}
+        return self.metrics.snapshot()
 
     def close(self) -> None:
         """
-        关闭连接
+        关闭连接池中的所有连接
         :return:无
         """
-        self.cur.close()
-        self.pool.putconn(self.conn)
+        if self.metrics is not None:
+            self.metrics.close()
+        self.pool.closeall()
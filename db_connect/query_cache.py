@@ -0,0 +1,379 @@
+"""
+查询结果缓存模块
+内存LRU缓存按字节数限制大小，可选磁盘缓存作为第二层
+通过本进程的操作对象写入某张表时，涉及该表的缓存自动失效；
+其他进程的写入无法感知，只能依靠过期时间，磁盘缓存同理
+缓存键包含当前模式（search_path），失效按“模式名.表名”进行，切换模式后不会读到其他模式的缓存
+"""
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import re
+import threading
+import time
+
+# FROM、JOIN关键字，后面是表名列表
+_FROM_PATTERN = re.compile(r'\b(?:from|join)\s+', re.IGNORECASE)
+# 表名或(子查询)后面的别名，别名后面的逗号表示还有下一张表
+_ALIAS = (r'(?:\s+(?:as\s+)?(?!(?:where|join|on|using|group|order|limit|offset|union|window|having|inner|left|right|'
+          r'full|cross|natural|lateral|for|fetch|except|intersect)\b)\w+)?')
+# 表名，可以带模式名和引号
+_TABLE_ITEM = re.compile(r'([\w.]+|"(?:[^"]|"")+"(?:\.(?:\w+|"(?:[^"]|"")+"))*)' + _ALIAS, re.IGNORECASE)
+_SUBQUERY_ALIAS = re.compile(_ALIAS, re.IGNORECASE)
+# FROM子句之后的子句关键字
+_CLAUSE_END = re.compile(r'\b(?:where|group|order|limit|offset|union|window|having|except|intersect|for|fetch|'
+                         r'returning)\b', re.IGNORECASE)
+# 字符串常量、带引号的标识符和$$字符串，其中的空白字符不能合并
+_QUOTED_PATTERN = re.compile(r"[Ee]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|(\$\w*\$).*?\1",
+                             re.DOTALL)
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    规范化sql语句，合并引号外的空白字符并去掉末尾的分号，使写法略有不同的相同语句命中同一缓存
+    字符串常量中的空白字符保持原样，'a  b'和'a b'是不同的语句
+    :param sql: sql语句
+    :return: 规范化后的sql语句
+    """
+    parts = []
+    position = 0
+    for match in _QUOTED_PATTERN.finditer(sql):
+        parts.append(_WHITESPACE.sub(' ', sql[position:match.start()]))
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(_WHITESPACE.sub(' ', sql[position:]))
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+def normalize_table(table_name: str) -> str:
+    """
+    规范化表名，去掉模式名和引号并转为小写
+    按表名失效时宁可多失效，不能漏失效
+    :param table_name: 表名，可以带模式名
+    :return: 规范化后的表名
+    """
+    return table_name.split('.')[-1].strip('"').lower()
+
+
+def _unquote(identifier: str) -> str:
+    return identifier.strip().strip('"').lower()
+
+
+def qualify_table(table_name: str, schema: str = None) -> tuple:
+    """
+    生成表的失效标签“模式名.表名”（去掉引号并转为小写）
+    带模式名的表只对应该模式；不带模式名的表可能是搜索路径中任意一个模式的表，对应搜索路径中的每个模式，
+    宁可多失效，不能漏失效
+    :param table_name: 表名，可以带模式名
+    :param schema: 当前的模式（search_path），多个模式用逗号隔开，为空时按默认的public处理
+    :return: 标签元组
+    """
+    parts = table_name.split('.')
+    schemas = parts[-2:-1] or (schema or 'public').split(',')
+    return tuple(f"{_unquote(name)}.{_unquote(parts[-1])}" for name in schemas)
+
+
+def _skip_space(sql: str, position: int) -> int:
+    """
+    跳过空白字符
+    :param sql: sql语句
+    :param position: 起始位置
+    :return: 第一个非空白字符的位置
+    """
+    while position < len(sql) and sql[position].isspace():
+        position += 1
+    return position
+
+
+def _skip_parentheses(sql: str, position: int) -> int:
+    """
+    跳过从position开始的一对括号，括号内字符串常量中的括号不计
+    :param sql: sql语句
+    :param position: 左括号的位置
+    :return: 右括号后面的位置，括号不匹配时为-1
+    """
+    depth = 0
+    while position < len(sql):
+        char = sql[position]
+        if char in '\'"$':
+            match = _QUOTED_PATTERN.match(sql, position)
+            if match is not None:
+                position = match.end()
+                continue
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                return position + 1
+        position += 1
+    return -1
+
+
+def _has_trailing_comma(sql: str, position: int) -> bool:
+    """
+    检查表名列表之后、本层FROM子句结束之前是否还有逗号
+    :param sql: sql语句
+    :param position: 表名列表结束的位置
+    :return: 是否有逗号
+    """
+    while position < len(sql):
+        char = sql[position]
+        if char in '\'"$':
+            match = _QUOTED_PATTERN.match(sql, position)
+            if match is not None:
+                position = match.end()
+                continue
+        if char == '(':
+            position = _skip_parentheses(sql, position)
+            if position < 0:
+                return True
+            continue
+        if char in ');':
+            return False
+        if char == ',':
+            return True
+        if _CLAUSE_END.match(sql, position) and (position == 0 or not (sql[position - 1].isalnum()
+                                                                       or sql[position - 1] == '_')):
+            return False
+        position += 1
+    return False
+
+
+def tables_in_sql(sql: str, schema: str = None):
+    """
+    从sql语句中找出FROM和JOIN后面的表名，FROM后面逗号隔开的多张表都会被识别
+    FROM后面是函数或者无法识别的写法时返回None，调用方不缓存这样的查询，避免写入漏识别的表后读到旧结果
+    :param sql: sql语句
+    :param schema: 当前的模式，见qualify_table
+    :return: 表的失效标签元组，无法识别时为None
+    """
+    tables = set()
+    for match in _FROM_PATTERN.finditer(sql):
+        position = match.end()
+        while True:
+            if sql.startswith('(', position):
+                # (子查询)中的表由子查询中的FROM识别，这里只跳过括号和别名
+                position = _skip_parentheses(sql, position)
+                if position < 0:
+                    return None
+                position = _SUBQUERY_ALIAS.match(sql, position).end()
+            else:
+                item = _TABLE_ITEM.match(sql, position)
+                if item is None:
+                    return None
+                position = _skip_space(sql, item.end())
+                if sql.startswith('(', position):
+                    # 表函数，读取的表无法识别
+                    return None
+                tables.update(qualify_table(item.group(1), schema))
+            position = _skip_space(sql, position)
+            if not sql.startswith(',', position):
+                break
+            position = _skip_space(sql, position + 1)
+        if _has_trailing_comma(sql, position):
+            # JOIN ... ON ...之后又用逗号连接了其他表，无法可靠识别
+            return None
+    return tuple(sorted(tables))
+
+
+class QueryCache:
+    """
+    查询结果缓存
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, default_ttl: float = 60, cache_dir: str = '') -> None:
+        """
+        初始化查询结果缓存
+        :param max_bytes: 内存缓存的最大字节数（按序列化后的大小计算）
+        :param default_ttl: 默认过期时间，秒
+        :param cache_dir: 磁盘缓存目录，为空时不使用磁盘缓存；不能与写入被缓存表的其他进程共用
+        """
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.cache_dir = cache_dir
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        # key -> (过期时间, 字节数, 表名元组, 结果)
+        self._entries = OrderedDict()
+        # 表名 -> 涉及该表的key集合
+        self._table_keys = {}
+        # 表名 -> 失效次数，读开始前记录，写入缓存时比较，防止并发写入后缓存了旧结果
+        self._generations = {}
+        # 表名 -> 最近一次失效的时间，用于判断磁盘缓存是否已失效
+        self._invalidated_at = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(sql: str, params: tuple = None, schema: str = None) -> str:
+        """
+        生成缓存键，同一语句在不同模式下查询的是不同的表，模式也是键的一部分
+        :param sql: sql语句
+        :param params: 参数
+        :param schema: 当前的模式（search_path）
+        :return: 缓存键
+        """
+        return hashlib.sha1(repr((schema, normalize_sql(sql), params)).encode('utf-8')).hexdigest()
+
+    def snapshot(self, tables: tuple) -> tuple:
+        """
+        记录查询开始时各表的失效次数，写入缓存时传回
+        :param tables: 表的失效标签元组
+        :return: 失效次数元组
+        """
+        return tuple(self._generations.get(table, 0) for table in tables)
+
+    def get(self, key: str):
+        """
+        读取缓存，先查内存再查磁盘
+        :param key: 缓存键
+        :return: (是否命中, 结果)
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[3]
+                self._remove(key)
+        if self.cache_dir:
+            value = self._disk_get(key, now)
+            if value is not None:
+                return True, value[1]
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def set(self, key: str, value, tables: tuple, generations: tuple, ttl: float = None) -> None:
+        """
+        写入缓存
+        :param key: 缓存键
+        :param value: 查询结果
+        :param tables: 涉及的表的失效标签元组，见qualify_table
+        :param generations: 查询开始前snapshot返回的失效次数
+        :param ttl: 过期时间，秒，为空时使用默认值
+        :return: 无
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        # 单个结果超过总容量的一半就不缓存了，避免把其他缓存全部挤掉
+        if len(data) > self.max_bytes // 2:
+            return
+        now = time.time()
+        with self._lock:
+            # 查询期间表被写入过，结果可能是旧的
+            if self.snapshot(tables) != generations:
+                return
+            self._remove(key)
+            self._entries[key] = (now + ttl, len(data), tables, value)
+            self._size += len(data)
+            for table in tables:
+                self._table_keys.setdefault(table, set()).add(key)
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        if self.cache_dir:
+            self._disk_set(key, (now, now + ttl, tables), data)
+
+    def invalidate(self, table_name: str, schema: str = None) -> None:
+        """
+        使涉及某张表的缓存全部失效
+        :param table_name: 表名，可以带模式名
+        :param schema: 写入时的模式（search_path），见qualify_table
+        :return: 无
+        """
+        now = time.time()
+        with self._lock:
+            for table in qualify_table(table_name, schema):
+                self._generations[table] = self._generations.get(table, 0) + 1
+                self._invalidated_at[table] = now
+                for key in list(self._table_keys.pop(table, ())):
+                    self._remove(key)
+
+    def clear(self) -> None:
+        """
+        清空内存缓存和磁盘缓存
+        :return: 无
+        """
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+        if self.cache_dir:
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.endswith('.qcache'):
+                    os.remove(os.path.join(self.cache_dir, file_name))
+
+    def stats(self) -> dict:
+        """
+        缓存统计
+        :return: {'hits': 命中次数, 'misses': 未命中次数, 'entries': 内存缓存条数, 'bytes': 内存缓存字节数}
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'bytes': self._size}
+
+    def _remove(self, key: str) -> None:
+        """
+        删除内存中的一条缓存，调用方需持有锁
+        :param key: 缓存键
+        :return: 无
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._size -= entry[1]
+        for table in entry[2]:
+            keys = self._table_keys.get(table)
+            if keys is not None:
+                keys.discard(key)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.qcache")
+
+    def _disk_get(self, key: str, now: float):
+        """
+        读取磁盘缓存，过期或者表已失效时删除文件
+        :param key: 缓存键
+        :param now: 当前时间
+        :return: (表名元组, 结果)，没有可用缓存时为None
+        """
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                created_at, expires_at, tables = pickle.load(f)
+                stale = expires_at <= now or any(self._invalidated_at.get(table, 0) >= created_at
+                                                 for table in tables)
+                value = None if stale else pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if stale:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        with self._lock:
+            self.hits += 1
+        return tables, value
+
+    def _disk_set(self, key: str, header: tuple, data: bytes) -> None:
+        """
+        写入磁盘缓存，先写临时文件再替换，避免其他进程读到一半的文件
+        :param key: 缓存键
+        :param header: (创建时间, 过期时间, 表名元组)
+        :param data: 序列化后的结果
+        :return: 无
+        """
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
@@ -0,0 +1,286 @@
+"""
+查询条件构造模块
+条件中的值全部作为参数传递，不再拼接进sql语句：值不同、结构相同的条件生成相同的语句，可以被预编译和复用执行计划，也不会被注入
+字段名通过psycopg2.sql.Identifier加引号，未加引号的普通字段名先转为小写，与PostgreSQL对未加引号标识符的处理一致
+用法：
+Where(code='000001', trade_date__gte='2024-01-01')           code = %s AND trade_date >= %s
+Where({'code': ['000001', '000002']})                         code = ANY(%s)
+Or(Where(status=None), Where(status__in=[1, 2]))              (status IS NULL) OR (status = ANY(%s))
+Raw('amount > %s AND amount < %s', (1, 10))                  已有的(sql, 参数)写法
+PgDbOperator中接收condition的方法都可以传入以上对象，也可以传入(sql, 参数)元组或字典，原来的字符串条件照旧使用
+删除和更新的条件不能为空，需要处理全表时显式传入'TRUE'
+"""
+from psycopg2 import sql
+import re
+import threading
+
+# 已编译的条件模板数量上限，超出后淘汰最早编译的
+_TEMPLATE_CACHE_SIZE = 2048
+# (条件结构, 占位符风格, 起始序号) -> 条件模板
+_templates = {}
+# 字段名 -> 加好引号的字段名
+_identifiers = {}
+_lock = threading.Lock()
+
+_PLAIN_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_$]*$')
+_QUOTED_IDENTIFIER = re.compile(r'^"(?:[^"]|"")+"$')
+_IDENTIFIER_PART = re.compile(r'"(?:[^"]|"")+"|[^.]+')
+_PLACEHOLDER = re.compile(r'%([%s])')
+
+# 运算符后缀 -> sql运算符
+_OPERATORS = {
+    'eq': '=',
+    'ne': '<>',
+    'gt': '>',
+    'gte': '>=',
+    'lt': '<',
+    'lte': '<=',
+    'like': 'LIKE',
+    'ilike': 'ILIKE',
+    'in': '=',
+    'isnull': None,
+}
+
+
+def quote_identifier(name: str, context) -> str:
+    """
+    给字段名或表名加引号，可以带模式名；结果按名称缓存，同一名称只需要一次连接上下文
+    :param name: 名称，如 code、public.daily、"MixedCase"
+    :param context: psycopg2的连接或游标
+    :return: 加好引号的名称
+    """
+    quoted = _identifiers.get(name)
+    if quoted is not None:
+        return quoted
+    parts = []
+    for part in _IDENTIFIER_PART.findall(name):
+        if _QUOTED_IDENTIFIER.match(part):
+            parts.append(part)
+        else:
+            parts.append(sql.Identifier(part.lower() if _PLAIN_IDENTIFIER.match(part) else part).as_string(context))
+    quoted = '.'.join(parts)
+    with _lock:
+        _identifiers[name] = quoted
+    return quoted
+
+
+def _placeholder(style: str, index: int) -> str:
+    """
+    生成一个占位符
+    :param style: '%s'为psycopg2占位符，'$'为预编译语句的$n占位符
+    :param index: 序号，从1开始
+    :return: 占位符
+    """
+    return '%s' if style == '%s' else f'${index}'
+
+
+class Condition(object):
+    """
+    查询条件基类
+    key为条件的结构（不含值），params为参数元组；结构相同的条件编译出相同的模板
+    """
+    key = None
+    params = ()
+
+    def template(self, context, style: str = '%s', start: int = 1) -> str:
+        """
+        编译为sql条件模板，按(结构, 占位符风格, 起始序号)缓存
+        :param context: psycopg2的连接或游标，给字段名加引号时使用
+        :param style: '%s'为psycopg2占位符，'$'为预编译语句的$n占位符
+        :param start: $n占位符的起始序号，条件前面还有其他参数时使用
+        :return: 不含WHERE的条件模板
+        """
+        cache_key = (self.key, style, start)
+        text = _templates.get(cache_key)
+        if text is None:
+            text = self._build(context, style, start)
+            with _lock:
+                if len(_templates) >= _TEMPLATE_CACHE_SIZE:
+                    _templates.pop(next(iter(_templates)))
+                _templates[cache_key] = text
+        return text
+
+    def _build(self, context, style: str, start: int) -> str:
+        """
+        生成条件模板，由子类实现
+        """
+        raise NotImplementedError
+
+    def __and__(self, other):
+        return And(self, to_condition(other))
+
+    def __or__(self, other):
+        return Or(self, to_condition(other))
+
+    def __invert__(self):
+        return Not(self)
+
+
+class Raw(Condition):
+    """
+    sql片段和参数，片段中使用%s占位符，字面的%写成%%
+    """
+    def __init__(self, text, params: tuple = ()) -> None:
+        """
+        :param text: sql条件片段，也可以是psycopg2.sql.Composable对象
+        :param params: 参数
+        """
+        self.text = text
+        self.params = tuple(params)
+        self.key = ('raw', text if isinstance(text, str) else repr(text))
+
+    def _build(self, context, style: str, start: int) -> str:
+        text = self.text if isinstance(self.text, str) else self.text.as_string(context)
+        if style == '%s':
+            return text
+        index = start - 1
+
+        def replace(match):
+            nonlocal index
+            if match.group(1) == '%':
+                return '%%'
+            index += 1
+            return f'${index}'
+        return _PLACEHOLDER.sub(replace, text)
+
+
+class Where(Condition):
+    """
+    字段条件，多个字段之间为AND
+    键为字段名或 字段名__运算符，运算符见_OPERATORS，省略时为eq；
+    eq的值为None时为IS NULL，为列表、元组或集合时为= ANY；ne同理；isnull的值为True或False
+    """
+    def __init__(self, predicates: dict = None, **kwargs) -> None:
+        """
+        :param predicates: {字段名或字段名__运算符: 值}，字段名中有__时使用该参数
+        :param kwargs: 同predicates
+        """
+        items = dict(predicates or {}, **kwargs)
+        if not items:
+            raise ValueError('条件不能为空')
+        self._items = []
+        shape = []
+        params = []
+        for name, value in items.items():
+            column, operator = name, 'eq'
+            if '__' in name:
+                prefix, suffix = name.rsplit('__', 1)
+                if suffix in _OPERATORS:
+                    column, operator = prefix, suffix
+            if operator == 'isnull':
+                kind = 'null' if value else 'not_null'
+            elif value is None and operator in ('eq', 'ne'):
+                kind = 'null' if operator == 'eq' else 'not_null'
+            elif operator in ('eq', 'ne', 'in') and isinstance(value, (list, tuple, set, frozenset)):
+                # psycopg2把列表转为数组，元组会被转为(a, b)
+                kind = 'any'
+                params.append(list(value))
+            elif operator == 'in':
+                raise ValueError(f'{name}的值必须是列表')
+            else:
+                kind = 'value'
+                params.append(value)
+            self._items.append((column, operator, kind))
+            shape.append((column, operator, kind))
+        self.key = ('where', tuple(shape))
+        self.params = tuple(params)
+
+    def _build(self, context, style: str, start: int) -> str:
+        parts = []
+        index = start
+        for column, operator, kind in self._items:
+            quoted = quote_identifier(column, context)
+            if kind == 'null':
+                parts.append(f'{quoted} IS NULL')
+                continue
+            if kind == 'not_null':
+                parts.append(f'{quoted} IS NOT NULL')
+                continue
+            placeholder = _placeholder(style, index)
+            index += 1
+            if kind == 'any':
+                if operator == 'ne':
+                    parts.append(f'{quoted} <> ALL({placeholder})')
+                else:
+                    parts.append(f'{quoted} = ANY({placeholder})')
+            else:
+                parts.append(f'{quoted} {_OPERATORS[operator]} {placeholder}')
+        return ' AND '.join(parts)
+
+
+class _Combined(Condition):
+    """
+    多个条件的组合
+    """
+    joiner = ''
+
+    def __init__(self, *conditions) -> None:
+        """
+        :param conditions: 条件，可以是Condition、字典或(sql, 参数)元组
+        """
+        self.conditions = [to_condition(condition) for condition in conditions]
+        if not self.conditions or not all(isinstance(condition, Condition) for condition in self.conditions):
+            raise ValueError('组合条件只能包含条件对象、字典或(sql, 参数)元组')
+        self.key = (self.joiner, tuple(condition.key for condition in self.conditions))
+        self.params = tuple(param for condition in self.conditions for param in condition.params)
+
+    def _build(self, context, style: str, start: int) -> str:
+        parts = []
+        index = start
+        for condition in self.conditions:
+            parts.append(f'({condition.template(context, style, index)})')
+            index += len(condition.params)
+        return f' {self.joiner} '.join(parts)
+
+
+class And(_Combined):
+    joiner = 'AND'
+
+
+class Or(_Combined):
+    joiner = 'OR'
+
+
+class Not(Condition):
+    """
+    条件取反
+    """
+    def __init__(self, condition) -> None:
+        self.condition = to_condition(condition)
+        if not isinstance(self.condition, Condition):
+            raise ValueError('NOT只能用于条件对象、字典或(sql, 参数)元组')
+        self.key = ('not', self.condition.key)
+        self.params = self.condition.params
+
+    def _build(self, context, style: str, start: int) -> str:
+        return f'NOT ({self.condition.template(context, style, start)})'
+
+
+def to_condition(condition):
+    """
+    把各种写法的条件统一转换
+    :param condition: Condition、字典、(sql, 参数)元组、psycopg2.sql.Composable或字符串
+    :return: 无条件（None、空字符串、'TRUE'）时为None；字符串原样返回，由调用方按原来的方式拼接；其他为Condition
+    """
+    if condition is None or isinstance(condition, Condition):
+        return condition
+    if isinstance(condition, str):
+        return None if condition.strip() in ('', 'TRUE') else condition
+    if isinstance(condition, dict):
+        return Where(condition)
+    if isinstance(condition, sql.Composable):
+        return Raw(condition)
+    if isinstance(condition, (tuple, list)) and len(condition) == 2 and isinstance(condition[0], (str, sql.Composable)):
+        return Raw(condition[0], condition[1])
+    raise TypeError(f'不支持的条件类型：{type(condition).__name__}')
+
+
+def to_write_condition(condition):
+    """
+    转换删除、更新的条件，漏传的条件（None、空字符串）不能被当成全表，否则会误删、误改整张表
+    :param condition: 同to_condition
+    :return: 显式传入'TRUE'时为None，表示全表；其他同to_condition
+    """
+    if condition is None or (isinstance(condition, str) and not condition.strip()):
+        raise ValueError('删除和更新的条件不能为空，处理全表时请传入TRUE')
+    return to_condition(condition)
@@ -0,0 +1,54 @@
+"""
+预编译语句缓存模块
+PREPARE的语句只在当前数据库会话内有效，所以每个连接对应一个缓存，缓存记录在连接对象上，随连接一起释放
+"""
+from collections import OrderedDict
+
+
+class StatementCache:
+    """
+    单个连接的预编译语句LRU缓存
+    """
+    def __init__(self, max_size: int = 100) -> None:
+        """
+        初始化预编译语句缓存
+        :param max_size: 最多保留的预编译语句数量，超过后淘汰最久未使用的语句
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._statements = OrderedDict()
+        self._counter = 0
+
+    def execute(self, cur, key: tuple, sql: str, params: tuple) -> None:
+        """
+        执行预编译语句，缓存中没有时先PREPARE
+        :param cur: 该连接的游标
+        :param key: 缓存键，如(操作, 表名, 字段元组, 主键元组)
+        :param sql: 使用$1、$2占位符的sql语句，只在缓存未命中时使用
+        :param params: 参数元组
+        :return: 无
+        """
+        name = self._statements.get(key)
+        if name is None:
+            self.misses += 1
+            self._counter += 1
+            name = f"qs_stmt_{self._counter}"
+            # 传入空参数，保持与普通execute相同的%转义规则
+            cur.execute(f"PREPARE {name} AS {sql}", ())
+            self._statements[key] = name
+            # 超出容量时淘汰最久未使用的语句
+            while len(self._statements) > self.max_size:
+                _, old_name = self._statements.popitem(last=False)
+                cur.execute(f"DEALLOCATE {old_name}")
+        else:
+            self.hits += 1
+            self._statements.move_to_end(key)
+        placeholders = ','.join(['%s'] * len(params))
+        if placeholders:
+            cur.execute(f"EXECUTE {name} ({placeholders})", params)
+        else:
+            cur.execute(f"EXECUTE {name}")
+
+    def __len__(self) -> int:
+        return len(self._statements)
@@ -1,4 +1,4 @@
-from project_position import executable_file_path, project_path
+from file_rw_io.project_position import executable_file_path, project_path
 
 
 # 执行文件的目录（可执行文件exe或者main.py所在的目录）
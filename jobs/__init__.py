@@ -0,0 +1,16 @@
+"""
+任务包，本包中的所有模块会在调度器启动时被导入
+任务示例（jobs/example.py）：
+
+from runner import job
+from db_connect import pg
+from logger import log
+
+
+@job(interval=300, timeout=60)
+def refresh_quotes():
+    rows = pg.select_custom("SELECT ...")
+    log.info('更新了%s条数据', len(rows))
+
+timeout只用于报警，超时的任务不会被中断；use_process的任务在spawn启动的工作进程中执行，函数必须定义在模块顶层
+"""
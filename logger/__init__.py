@@ -1,10 +1,34 @@
-from logger.logger import setup_logger
-from config import config_
+import threading
 
 """
 log日志实例
 1 使用方法log.info("记录信息")
 2 相关内容详见配置文件
+3 log在第一次使用时才创建（读取配置、建立日志目录和文件），导入本模块没有副作用
 """
 
-log = setup_logger('main', config_)
\ No newline at end of file
+_lock = threading.Lock()
+
+
+def get_log():
+    """
+    获取全局日志记录器，第一次调用时按配置文件创建
+    :return: 日志记录器
+    """
+    global log
+    with _lock:
+        if 'log' not in globals():
+            from config import config_
+            from logger.logger import setup_logger
+            log = setup_logger('main', config_)
+    return log
+
+
+def __getattr__(name: str):
+    # from logger import log 时才创建日志记录器
+    if name == 'log':
+        return get_log()
+    if name == 'setup_logger':
+        from logger.logger import setup_logger
+        return setup_logger
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,103 @@
+"""
+日志格式模块
+full：原有格式，包含文件路径和行号；compact：不查找调用位置的精简格式；json：每行一个json对象
+"""
+import json
+import logging
+import time
+
+# 原有格式，把时间，信息等级，文件地址，文件名，行号，日志内容都展示出来
+FULL_FORMAT = '%(asctime)s.%(msecs)03d | %(levelname)s | %(pathname)s | %(filename)s:%(lineno)d | %(message)s'
+# 精简格式，不需要调用位置
+COMPACT_FORMAT = '%(asctime)s.%(msecs)03d | %(levelname)s | %(name)s | %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class CachedTimeFormatter(logging.Formatter):
+    """
+    文本格式器，同一秒内的时间字符串只生成一次
+    """
+    def __init__(self, fmt: str = COMPACT_FORMAT, datefmt: str = DATE_FORMAT) -> None:
+        super().__init__(fmt, datefmt=datefmt)
+        # (秒, 时间字符串)，放在一个元组里，多线程下读写都是原子的
+        self._time_cache = (None, '')
+
+    def formatTime(self, record: logging.LogRecord, datefmt: str = None) -> str:
+        """
+        格式化时间，毫秒部分由格式中的%(msecs)03d输出
+        :param record: 日志记录
+        :param datefmt: 时间格式
+        :return: 时间字符串
+        """
+        second, text = self._time_cache
+        if second != int(record.created):
+            text = time.strftime(datefmt or self.datefmt, self.converter(record.created))
+            self._time_cache = (int(record.created), text)
+        return text
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    json格式器，每条日志输出一行json，便于日志系统采集
+    """
+    def __init__(self, caller_info: bool = False, datefmt: str = DATE_FORMAT) -> None:
+        """
+        初始化json格式器
+        :param caller_info: 是否输出文件名、行号和函数名
+        :param datefmt: 时间格式
+        """
+        super().__init__(datefmt=datefmt)
+        self.caller_info = caller_info
+        # (秒, 时间字符串)，放在一个元组里，多线程下读写都是原子的
+        self._time_cache = (None, '')
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        格式化为一行json
+        :param record: 日志记录
+        :return: json字符串
+        """
+        second, text = self._time_cache
+        if second != int(record.created):
+            text = time.strftime(self.datefmt, self.converter(record.created))
+            self._time_cache = (int(record.created), text)
+        data = {
+            'time': f"{text}.{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if self.caller_info:
+            data['file'] = record.filename
+            data['line'] = record.lineno
+            data['func'] = record.funcName
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        if record.stack_info:
+            data['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def build_formatter(config) -> logging.Formatter:
+    """
+    按配置文件生成格式器
+    不需要调用位置时关闭logging模块的调用栈查找，对整个进程的logging生效
+    :param config: 配置文件对象
+    :return: 格式器
+    """
+    log_format = config.get('log', 'log_format', fallback='full').lower()
+    caller_info = config.getboolean('log', 'log_caller_info', fallback=True)
+    if not caller_info:
+        logging._srcfile = None
+
+    if log_format == 'json':
+        return JsonLinesFormatter(caller_info=caller_info)
+    if log_format == 'compact' or not caller_info:
+        # 没有调用位置时，full格式中的路径和行号都是空的，也使用精简格式
+        return CachedTimeFormatter(COMPACT_FORMAT)
+    if log_format == 'full':
+        return CachedTimeFormatter(FULL_FORMAT)
+    raise ValueError(f'不支持的日志格式：{log_format}')
@@ -2,7 +2,12 @@ import logging
 from logging import StreamHandler
 from logging.handlers import TimedRotatingFileHandler
 from file_rw_io.file_name import tf_filename_compliant
+from logger.formatters import build_formatter
+from logger.queue_logging import BoundedQueueHandler, BatchingQueueListener
+from logger.rotating_handler import SizedTimedRotatingFileHandler
+import atexit
 import os
+import queue
 
 
 def set_handler_level(handler: logging.Handler, level: str) -> None:
@@ -43,14 +48,10 @@ def setup_logger(name: str, config) -> logging.Logger:
     console_log_level = config.get('log', 'console_log_level')
     set_handler_level(console_handler, console_log_level)
 
-    # 输出格式，这里就同一了，不更改了，把时间，信息等级，文件地址，文件名，行号，日志内容都展示出来
-    custom_format = '%(asctime)s.%(msecs)03d | %(levelname)s | %(pathname)s | %(filename)s:%(lineno)d | %(message)s'
-
-    console_formatter = logging.Formatter(custom_format, datefmt='%Y-%m-%d %H:%M:%S')
+    # 输出格式，由配置文件的log_format和log_caller_info决定，详见formatters模块
+    console_formatter = build_formatter(config)
     # 设置 console_handler 的格式器
     console_handler.setFormatter(console_formatter)
-    # 将 console_handler 添加到 logger
-    logger.addHandler(console_handler)
 
     # 读取文件目录
     log_path = config.get('log', 'log_path')
@@ -88,25 +89,69 @@ def setup_logger(name: str, config) -> logging.Logger:
     log_backup_count = config.get('log', 'log_backup_count')
     # 配置编码格式
     log_encoding = config.get('log', 'log_encoding')
+    # 配置单个log文件最大字节数、切换后的压缩方式、旧文件最多占用的字节数
+    log_max_bytes = int(config.get('log', 'log_max_bytes', fallback='0'))
+    log_compress = config.get('log', 'log_compress', fallback='none')
+    log_retention_bytes = int(config.get('log', 'log_retention_bytes', fallback='0'))
 
     # 创建一个文件日志处理器
-    file_handler = TimedRotatingFileHandler(
-        os.path.join(logs_dir, log_file_name),
-        when=log_switch_time,
-        backupCount=int(log_backup_count),
-        encoding=log_encoding
-    )
+    if log_max_bytes > 0 or log_compress != 'none' or log_retention_bytes > 0:
+        # 按时间和大小切换，后台压缩，按磁盘空间保留，此时不再使用log_backup_count
+        file_handler = SizedTimedRotatingFileHandler(
+            os.path.join(logs_dir, log_file_name),
+            when=log_switch_time,
+            max_bytes=log_max_bytes,
+            compress=log_compress,
+            retention_bytes=log_retention_bytes,
+            encoding=log_encoding
+        )
+    else:
+        file_handler = TimedRotatingFileHandler(
+            os.path.join(logs_dir, log_file_name),
+            when=log_switch_time,
+            backupCount=int(log_backup_count),
+            encoding=log_encoding
+        )
 
     # 设置 file_handler 的日志级别为 DEBUG
     file_log_level = config.get('log', 'file_log_level')
     set_handler_level(file_handler, file_log_level)
 
     # 输出格式
-    file_formatter = logging.Formatter(custom_format, datefmt='%Y-%m-%d %H:%M:%S')
+    file_formatter = build_formatter(config)
     # 设置 file_handler 的格式器
     file_handler.setFormatter(file_formatter)
-    # 将 file_handler 添加到 logger
-    logger.addHandler(file_handler)
+
+    handlers = [console_handler, file_handler]
+    queue_handler = None
+    if config.getboolean('log', 'log_async', fallback=False):
+        # 异步模式，logger只挂一个队列处理器，由后台线程写控制台和文件
+        log_queue = queue.Queue(maxsize=int(config.get('log', 'log_queue_size', fallback='10000')))
+        queue_handler = BoundedQueueHandler(log_queue, config.get('log', 'log_overflow_policy', fallback='block'))
+        # 两个处理器都不要的级别不必进队列
+        queue_handler.setLevel(min(handler.level for handler in handlers))
+        listener = BatchingQueueListener(log_queue, handlers,
+                                         batch_size=int(config.get('log', 'log_batch_size', fallback='500')))
+        listener.start()
+        # 程序退出时写完队列中剩余的日志
+        atexit.register(listener.stop)
+        logger.addHandler(queue_handler)
+        logger.queue_listener = listener
+    else:
+        # 将 console_handler 和 file_handler 添加到 logger
+        for handler in handlers:
+            logger.addHandler(handler)
+
+    def on_log_config_change(new_config) -> None:
+        # 配置文件重新读取后更新各处理器的日志级别，其他日志配置需要重启生效
+        set_handler_level(console_handler, new_config.get('log', 'console_log_level'))
+        set_handler_level(file_handler, new_config.get('log', 'file_log_level'))
+        if queue_handler is not None:
+            queue_handler.setLevel(min(handler.level for handler in handlers))
+
+    # 支持热加载的配置对象才订阅
+    if hasattr(config, 'subscribe'):
+        config.subscribe('log', on_log_config_change)
 
     return logger
 
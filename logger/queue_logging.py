@@ -0,0 +1,150 @@
+"""
+异步日志模块
+业务线程只把日志记录放进有界队列，由后台线程批量写入控制台和文件
+"""
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler
+
+# 队列满时的处理策略
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_DEBUG = 'drop_debug'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_DEBUG, OVERFLOW_DROP_OLDEST)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    把日志记录放入有界队列的处理器，队列满时按策略处理
+    block：等待队列有空位；drop_debug：丢弃DEBUG级别的记录，其他级别等待；drop_oldest：丢弃队列中最旧的记录
+    """
+    def __init__(self, log_queue: queue.Queue, overflow_policy: str = OVERFLOW_BLOCK) -> None:
+        """
+        初始化队列日志处理器
+        :param log_queue: 有界队列
+        :param overflow_policy: 队列满时的处理策略
+        """
+        super().__init__(log_queue)
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f'不支持的日志队列溢出策略：{overflow_policy}')
+        self.overflow_policy = overflow_policy
+        # 因队列满而丢弃的记录数
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        只合并消息参数，时间和格式化交给后台线程
+        参数在调用线程里合并，防止可变参数在写入前被修改
+        :param record: 日志记录
+        :return: 放入队列的日志记录
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """
+        按溢出策略放入队列
+        :param record: 日志记录
+        :return: 无
+        """
+        if self.overflow_policy == OVERFLOW_BLOCK:
+            self.queue.put(record)
+        elif self.overflow_policy == OVERFLOW_DROP_DEBUG:
+            if record.levelno <= logging.DEBUG:
+                try:
+                    self.queue.put_nowait(record)
+                except queue.Full:
+                    self.dropped += 1
+            else:
+                self.queue.put(record)
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(record)
+                    return
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+
+
+class BatchingQueueListener(object):
+    """
+    后台写日志的线程，每次从队列取出一批记录写入，写完一批再统一flush
+    """
+    _sentinel = None
+
+    def __init__(self, log_queue: queue.Queue, handlers: list[logging.Handler], batch_size: int = 500) -> None:
+        """
+        初始化日志写入线程
+        :param log_queue: 有界队列
+        :param handlers: 实际写日志的处理器
+        :param batch_size: 每批最多处理的记录数
+        """
+        self.queue = log_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self._thread = None
+
+    def start(self) -> None:
+        """
+        启动后台线程
+        :return: 无
+        """
+        self._thread = threading.Thread(target=self._monitor, name='log_writer', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        写完队列中剩余的记录后停止后台线程
+        :return: 无
+        """
+        if self._thread is None:
+            return
+        self.queue.put(self._sentinel)
+        self._thread.join()
+        self._thread = None
+
+    def _monitor(self) -> None:
+        """
+        后台线程主循环
+        :return: 无
+        """
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = self._sentinel in batch
+            self._handle_batch([record for record in batch if record is not self._sentinel])
+            if stop:
+                return
+
+    def _handle_batch(self, batch: list[logging.LogRecord]) -> None:
+        """
+        处理一批记录，处理期间暂停每条记录后的flush，整批写完后flush一次
+        :param batch: 日志记录列表
+        :return: 无
+        """
+        if not batch:
+            return
+        for handler in self.handlers:
+            # 处理器只在本线程中使用，可以临时替换flush
+            handler.flush = _noop
+            try:
+                for record in batch:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            finally:
+                del handler.flush
+                handler.flush()
+
+
+def _noop() -> None:
+    pass
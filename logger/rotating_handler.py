@@ -0,0 +1,166 @@
+"""
+按时间和大小切换的日志文件处理器
+切换时只重命名文件，压缩和按磁盘空间清理旧文件都放在后台线程中执行
+"""
+import gzip
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import TimedRotatingFileHandler
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 压缩方式对应的文件后缀
+COMPRESS_SUFFIXES = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+# 每写多少条日志检查一次文件大小，文本文件的tell()需要先刷新缓冲区，每条都检查会明显降低吞吐量
+SIZE_CHECK_RECORDS = 100
+
+
+class SizedTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """
+    到达切换时间或者文件超过指定大小时切换日志文件
+    切换后的文件名为：日志文件名.时间.序号[.gz|.zst]
+    """
+    def __init__(self, filename: str, when: str = 'midnight', max_bytes: int = 0, compress: str = 'gzip',
+                 retention_bytes: int = 0, encoding: str = None) -> None:
+        """
+        初始化日志文件处理器
+        :param filename: 日志文件路径
+        :param when: 切换时间，与TimedRotatingFileHandler相同
+        :param max_bytes: 单个文件的最大字节数，为0时只按时间切换；每SIZE_CHECK_RECORDS条检查一次，文件可能略超过该值
+        :param compress: 压缩方式，none、gzip或zstd，没有安装zstandard时使用gzip
+        :param retention_bytes: 切换后的旧文件最多占用的字节数，超出时从最旧的文件开始删除，为0时不删除
+        :param encoding: 文件编码
+        """
+        super().__init__(filename, when=when, backupCount=0, encoding=encoding)
+        if compress not in COMPRESS_SUFFIXES:
+            raise ValueError(f'不支持的日志压缩方式：{compress}')
+        if compress == 'zstd' and zstandard is None:
+            compress = 'gzip'
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.retention_bytes = retention_bytes
+        self._records_since_check = 0
+        # 单线程执行，压缩和清理按切换顺序进行
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='log_compress')
+
+    def shouldRollover(self, record) -> bool:
+        """
+        判断是否需要切换文件
+        :param record: 日志记录
+        :return: 到达切换时间或文件超过大小时返回True
+        """
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes > 0:
+            self._records_since_check += 1
+            if self._records_since_check < SIZE_CHECK_RECORDS:
+                return False
+            self._records_since_check = 0
+            if self.stream is None:
+                self.stream = self._open()
+            if self.stream.tell() >= self.max_bytes:
+                return True
+        return False
+
+    def doRollover(self) -> None:
+        """
+        切换文件：关闭当前文件，重命名后交给后台线程压缩，再打开新文件
+        :return: 无
+        """
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        now = int(time.time())
+        # 用当前时间段的起始时间命名，与TimedRotatingFileHandler一致
+        period_start = self.rolloverAt - self.interval
+        time_tuple = time.gmtime(period_start) if self.utc else time.localtime(period_start)
+        prefix = f"{self.baseFilename}.{time.strftime(self.suffix, time_tuple)}"
+        # 同一时间段内按大小切换了多次时，用递增的序号区分，旧文件被清理后序号也不回退
+        rotated = f"{prefix}.{self._next_index(prefix)}"
+        if os.path.exists(self.baseFilename):
+            os.rename(self.baseFilename, rotated)
+            self._executor.submit(self._compress_and_clean, rotated)
+
+        if now >= self.rolloverAt:
+            new_rollover_at = self.computeRollover(now)
+            while new_rollover_at <= now:
+                new_rollover_at += self.interval
+            self.rolloverAt = new_rollover_at
+        if not self.delay:
+            self.stream = self._open()
+
+    @staticmethod
+    def _next_index(prefix: str) -> int:
+        """
+        获取同一时间段内下一个切换文件的序号
+        :param prefix: 切换文件名中序号之前的部分
+        :return: 已有最大序号加1
+        """
+        dir_name, base_name = os.path.split(prefix)
+        index = 0
+        for file_name in os.listdir(dir_name):
+            if file_name.startswith(f"{base_name}."):
+                number = file_name[len(base_name) + 1:].split('.')[0]
+                if number.isdigit():
+                    index = max(index, int(number))
+        return index + 1
+
+    def _compress_and_clean(self, path: str) -> None:
+        """
+        后台线程：压缩切换下来的文件，然后按磁盘空间清理旧文件
+        后台线程中不能再写日志，出错时直接忽略
+        :param path: 切换下来的文件路径
+        :return: 无
+        """
+        try:
+            if self.compress == 'gzip':
+                with open(path, 'rb') as src, gzip.open(f"{path}.gz", 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                os.remove(path)
+            elif self.compress == 'zstd':
+                with open(path, 'rb') as src, open(f"{path}.zst", 'wb') as dst:
+                    zstandard.ZstdCompressor().copy_stream(src, dst)
+                os.remove(path)
+        except OSError:
+            pass
+        if self.retention_bytes > 0:
+            self._enforce_retention()
+
+    def _enforce_retention(self) -> None:
+        """
+        旧文件总大小超过retention_bytes时，从最旧的文件开始删除
+        :return: 无
+        """
+        dir_name, base_name = os.path.split(self.baseFilename)
+        files = []
+        for file_name in os.listdir(dir_name):
+            if file_name.startswith(f"{base_name}."):
+                path = os.path.join(dir_name, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.retention_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def close(self) -> None:
+        """
+        等待后台压缩完成后关闭文件
+        :return: 无
+        """
+        self._executor.shutdown(wait=True)
+        super().close()
@@ -1,6 +1,52 @@
+"""
+脚本执行入口
+python main.py              启动调度器，按计划执行所有任务
+python main.py --list       列出已注册的任务
+python main.py --run 名称   立即执行一次指定任务后退出
+"""
+import argparse
+import sys
 
 
+def main() -> int:
+    parser = argparse.ArgumentParser(description='任务调度')
+    parser.add_argument('--list', action='store_true', help='列出已注册的任务')
+    parser.add_argument('--run', metavar='NAME', help='立即执行一次指定任务后退出')
+    args = parser.parse_args()
 
-if __name__ == '__main__':
+    from config import config_
+    from runner import discover
+    jobs = discover(config_.get('runner', 'jobs_package', fallback='jobs'))
+
+    if args.list:
+        for name, spec in jobs.items():
+            plan = f'每{spec.interval}秒' if spec.interval else (spec.cron.expression if spec.cron else '手动')
+            print(f"{name:<30} {plan:<20} {'进程池' if spec.use_process else '线程池'}")
+        return 0
+
+    from runner.scheduler import Scheduler
+    scheduler = Scheduler(
+        jobs,
+        thread_workers=config_.getint('runner', 'thread_workers', fallback=4),
+        process_workers=config_.getint('runner', 'process_workers', fallback=0),
+        warm_pg=config_.getboolean('runner', 'warm_pg', fallback=True),
+        warm_push=config_.getboolean('runner', 'warm_push', fallback=True),
+        notify_failure=config_.getboolean('runner', 'notify_failure', fallback=False),
+    )
+    try:
+        if args.run:
+            if args.run not in jobs:
+                print(f'任务不存在：{args.run}')
+                return 1
+            scheduler.run_once(args.run)
+            return 0
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.stop()
+    return 0
 
-    pass
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,77 @@
-from config import config_
-from dingding import Dingding
+import threading
 
-if config_.getboolean('MessagePush', 'is_enable'):
-    # 是否钉钉消息推送开启
-    if config_.getboolean('DingDing', 'enable'):
-        dingding_ = Dingding()
+"""
+消息推送实例
+1 dingding_：钉钉机器人，使用方法dingding_.send_message("消息")
+2 publisher_：多渠道推送，同时推送到所有开启的渠道，使用方法publisher_.publish("消息")
+3 outbox_：发件箱，消息先写入本地文件再由后台发送，失败重试，重启后继续发送，使用方法outbox_.put("消息")
+4 以上实例在第一次使用时才创建，未开启的为None，导入本模块没有副作用
+"""
 
-else:
-    dingding_ = None
\ No newline at end of file
+_lock = threading.Lock()
+_NAMES = ('dingding_', 'publisher_', 'outbox_')
+
+
+def _build() -> None:
+    """
+    按配置文件创建消息推送实例
+    :return: 无
+    """
+    global dingding_, publisher_, outbox_
+    with _lock:
+        if 'publisher_' in globals():
+            return
+        from config import config_
+
+        dingding = None
+        publisher = None
+        outbox = None
+        if config_.getboolean('MessagePush', 'is_enable'):
+            from message_push.channel import DingdingChannel, WeComChannel, LocalFileChannel, HttpStubChannel
+            from message_push.publisher import FanoutPublisher
+
+            outbox_enable = config_.getboolean('MessagePush', 'outbox_enable', fallback=False)
+            channels = []
+            # 是否钉钉消息推送开启
+            if config_.getboolean('DingDing', 'enable'):
+                from message_push.dingding import Dingding
+                dingding = Dingding()
+                channels.append(DingdingChannel(dingding, use_dispatcher=not outbox_enable))
+            # 是否企业微信消息推送开启
+            if config_.getboolean('MessagePush', 'WeCom'):
+                channels.append(WeComChannel(config_.get('WeCom', 'webhook'),
+                                             float(config_.get('WeCom', 'connect_timeout', fallback='3')),
+                                             float(config_.get('WeCom', 'read_timeout', fallback='5'))))
+            # 是否写入本地文件
+            if config_.getboolean('MessagePush', 'LocalFile', fallback=False):
+                channels.append(LocalFileChannel(config_.get('LocalFile', 'path')))
+            # 是否推送到自定义HTTP地址
+            if config_.getboolean('MessagePush', 'HttpStub', fallback=False):
+                channels.append(HttpStubChannel(config_.get('HttpStub', 'url'),
+                                                float(config_.get('HttpStub', 'connect_timeout', fallback='3')),
+                                                float(config_.get('HttpStub', 'read_timeout', fallback='5'))))
+            publisher = FanoutPublisher(channels)
+            # 是否开启发件箱
+            if outbox_enable:
+                from message_push.outbox import MessageOutbox
+                outbox = MessageOutbox(config_.get('MessagePush', 'outbox_path', fallback='outbox.sqlite3'), channels)
+        dingding_, outbox_ = dingding, outbox
+        # publisher_最后赋值，作为创建完成的标志
+        publisher_ = publisher
+
+
+def get_publisher():
+    """
+    获取多渠道推送实例，第一次调用时按配置文件创建
+    :return: FanoutPublisher，未开启消息推送时为None
+    """
+    _build()
+    return publisher_
+
+
+def __getattr__(name: str):
+    # from message_push import dingding_ 时才创建实例
+    if name in _NAMES:
+        _build()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,167 @@
+"""
+消息推送渠道模块
+每个渠道实现send方法，由FanoutPublisher同时向所有开启的渠道推送
+"""
+from logger import log
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class MessageChannel(object):
+    """
+    消息推送渠道基类
+    """
+    # 渠道名称，用于统计和日志
+    name = 'base'
+
+    def send(self, message_text: str, at_mobiles: list = None, is_at_all: bool = False) -> bool:
+        """
+        发送一条消息
+        :param message_text: 消息文本
+        :param at_mobiles: 需要@的手机号列表
+        :param is_at_all: 是否@所有人
+        :return: 是否发送成功
+        """
+        raise NotImplementedError
+
+    def wait_time(self) -> float:
+        """
+        距离渠道可以发送还需要等待的秒数，渠道有频率限制时重写，发件箱据此暂停该渠道
+        限流本身在send中进行，这里只查询不占用额度
+        :return: 0表示可以立即发送，否则为还需要等待的秒数
+        """
+        return 0.0
+
+
+class DingdingChannel(MessageChannel):
+    """
+    钉钉渠道，Dingding开启异步发送且use_dispatcher为True时只放入其发送队列，否则同步发送
+    两种方式都经过Dingding的限流器，与其他途径的钉钉发送合计不超过机器人的频率限制
+    """
+    name = 'dingding'
+
+    def __init__(self, dingding, use_dispatcher: bool = True) -> None:
+        """
+        :param dingding: Dingding实例
+        :param use_dispatcher: 是否使用Dingding的异步发送队列，由发件箱负责重试时应关闭，以获取真实的发送结果
+        """
+        self.dingding = dingding
+        self.use_dispatcher = use_dispatcher
+
+    def wait_time(self) -> float:
+        return self.dingding.limiter.wait_time()
+
+    def send(self, message_text: str, at_mobiles: list = None, is_at_all: bool = False) -> bool:
+        if self.use_dispatcher and self.dingding.dispatcher is not None:
+            return self.dingding.dispatcher.submit(message_text, at_mobiles, is_at_all)
+        # 超出频率限制时等待
+        return self.dingding._is_success(self.dingding.send_message_sync(message_text, at_mobiles, is_at_all))
+
+
+class HttpChannel(MessageChannel):
+    """
+    通过HTTP POST json推送的渠道基类，复用连接并设置超时
+    """
+    def __init__(self, url: str, connect_timeout: float = 3, read_timeout: float = 5) -> None:
+        """
+        :param url: 推送地址
+        :param connect_timeout: 连接超时秒数
+        :param read_timeout: 读取超时秒数
+        """
+        if not url:
+            raise ValueError(f'未配置{self.name}推送地址')
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _post_json(self, body: dict) -> requests.Response:
+        """
+        发送json请求
+        :param body: 请求体
+        :return: HTTP响应对象
+        """
+        return self.session.post(self.url, data=json.dumps(body, ensure_ascii=False).encode('utf-8'),
+                                 headers={'Content-Type': 'application/json;charset=utf-8'},
+                                 timeout=self.timeout)
+
+
+class WeComChannel(HttpChannel):
+    """
+    企业微信群机器人渠道
+    """
+    name = 'wecom'
+
+    def send(self, message_text: str, at_mobiles: list = None, is_at_all: bool = False) -> bool:
+        mentioned = list(at_mobiles or [])
+        if is_at_all:
+            mentioned.append('@all')
+        body = {
+            'msgtype': 'text',
+            'text': {
+                'content': message_text,
+                'mentioned_mobile_list': mentioned,
+            },
+        }
+        response = self._post_json(body)
+        if response.status_code == 200 and response.json().get('errcode') == 0:
+            return True
+        log.warning('企业微信消息推送失败: %s', response.text)
+        return False
+
+
+class HttpStubChannel(HttpChannel):
+    """
+    通用HTTP渠道，把消息以json推送到指定地址，可以对接本地的模拟服务或自建的告警服务
+    """
+    name = 'http'
+
+    def send(self, message_text: str, at_mobiles: list = None, is_at_all: bool = False) -> bool:
+        body = {
+            'text': message_text,
+            'at_mobiles': at_mobiles or [],
+            'is_at_all': is_at_all,
+            'time': time.time(),
+        }
+        response = self._post_json(body)
+        if 200 <= response.status_code < 300:
+            return True
+        log.warning('HTTP消息推送失败: %s', response.status_code)
+        return False
+
+
+class LocalFileChannel(MessageChannel):
+    """
+    本地文件渠道，每条消息追加一行json，用于本地留档和测试
+    """
+    name = 'local_file'
+
+    def __init__(self, path: str) -> None:
+        """
+        :param path: 文件路径，目录不存在时自动创建
+        """
+        if not path:
+            raise ValueError('未配置本地消息文件路径')
+        self.path = path
+        dir_name = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dir_name, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def send(self, message_text: str, at_mobiles: list = None, is_at_all: bool = False) -> bool:
+        line = json.dumps({
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'text': message_text,
+            'at_mobiles': at_mobiles or [],
+            'is_at_all': is_at_all,
+        }, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        return True
@@ -3,7 +3,9 @@
 """
 from config import config_
 from logger import log
+from message_push.dispatcher import MessageDispatcher, RateLimiter
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import time
 import hashlib
@@ -13,6 +15,8 @@ import urllib.parse
 
 
 class Dingding:
+    # 签名缓存时间，秒，小于钉钉允许的1小时误差
+    _SIGNATURE_TTL = 30 * 60
 
     def __init__(self):
         """
@@ -22,8 +26,48 @@ class Dingding:
         try:
             self._read_config(config_)
         except Exception as e:
-            log.error(f"配置文件读取错误: {str(e)}")
+            log.error("配置文件读取错误: %s", str(e))
             raise
+        # 签名缓存，(生成时间, timestamp, sign)
+        self._signature_cache = None
+        # 复用连接的HTTP会话，连续发送时不用重新建立TCP和TLS连接
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        # 同步发送、后台线程和发件箱共用的限流器，合计不超过机器人的频率限制
+        self.limiter = RateLimiter(self.rate_limit_per_minute)
+        # 异步发送时，消息由后台线程按频率限制发送
+        self.dispatcher = None
+        if self.async_send:
+            self.dispatcher = MessageDispatcher(self._send_batch,
+                                                queue_size=self.queue_size,
+                                                max_retries=self.max_retries,
+                                                name='dingding_dispatcher',
+                                                limiter=self.limiter)
+        # 配置文件热加载时更新webhook、加签、限流等参数
+        if hasattr(config_, 'subscribe'):
+            config_.subscribe('DingDing', self._on_config_change)
+
+    def _on_config_change(self, config):
+        """
+        DingDing段落变化后的回调，新配置不合法时保留原配置
+        async_send和queue_size需要重启生效
+        :param config:重新读取后的配置对象
+        :return None
+        """
+        old_values = dict(self.__dict__)
+        try:
+            self._read_config(config)
+        except Exception:
+            self.__dict__.update(old_values)
+            raise
+        self.async_send = old_values['async_send']
+        self.queue_size = old_values['queue_size']
+        # 密钥可能变化，签名重新生成
+        self._signature_cache = None
+        # 保留已有的发送记录，调小限制后不会立即多发
+        self.limiter.max_calls = self.rate_limit_per_minute
+        if self.dispatcher is not None:
+            self.dispatcher.max_retries = self.max_retries
 
     def _read_config(self, config):
         """
@@ -41,6 +85,12 @@ class Dingding:
         self.access_token = webhook_all.split('?')[1].split('=')[1]
         self.keyword = config.get('DingDing', 'keyword')
         self.secret = config.get('DingDing', 'secret')
+        self.async_send = config.getboolean('DingDing', 'async_send', fallback=True)
+        self.rate_limit_per_minute = int(config.get('DingDing', 'rate_limit_per_minute', fallback='20'))
+        self.queue_size = int(config.get('DingDing', 'queue_size', fallback='1000'))
+        self.max_retries = int(config.get('DingDing', 'max_retries', fallback='3'))
+        self.connect_timeout = float(config.get('DingDing', 'connect_timeout', fallback='3'))
+        self.read_timeout = float(config.get('DingDing', 'read_timeout', fallback='5'))
 
         # 检验配置项的合法性
         if not self._is_bool(self.is_enable):
@@ -72,26 +122,33 @@ class Dingding:
             # 如果不是字符串则返回False
             return False
 
-    @staticmethod
     def _generate_signature(self):
         """
         根据钉钉文档提供的算法生成签名
+        钉钉要求timestamp与服务器时间相差不超过1小时，所以签名在有效期内缓存复用
+        :return: (timestamp, sign)
         """
-        timestamp = str(round(time.time() * 1000))
+        signature = self._signature_cache
+        if signature is not None and time.time() - signature[0] < self._SIGNATURE_TTL:
+            return signature[1], signature[2]
+        now = time.time()
+        timestamp = str(round(now * 1000))
         secret_enc = self.secret.encode('utf-8')
         string_to_sign = '{}\n{}'.format(timestamp, self.secret)
         string_to_sign_enc = string_to_sign.encode('utf-8')
         hmac_code = hmac.new(secret_enc, string_to_sign_enc, digestmod=hashlib.sha256).digest()
         sign = urllib.parse.quote_plus(base64.b64encode(hmac_code))
+        self._signature_cache = (now, timestamp, sign)
         return timestamp, sign
 
     def send_message(self, message_text, at_mobiles=None, is_at_all=False):
         """
         发送钉钉群机器人消息
+        开启异步发送时只把消息放入队列并立即返回，由后台线程限流发送
         :param message_text: 消息文本
         :param at_mobiles: 需要@的手机号列表，可选，默认为空列表不@任何人
         :param is_at_all: 是否@所有人，布尔值，默认为False
-        :return: 返回HTTP响应对象
+        :return: 同步发送时返回HTTP响应对象，异步发送时返回None
         """
         # 先检查是否开启消息推送
         if not self.is_enable:
@@ -101,19 +158,30 @@ class Dingding:
         if not self.is_dingding:
             log.info('钉钉消息推送未开启')
             return None
-        # 处理请求头
-        headers = {
-            'Content-Type': 'application/json;charset=utf-8'
-        }
-        # 处理query参数
-        params = {
-            'access_token': self.access_token
-        }
-        # 如果开启了加签功能，则添加signature字段
-        if self.secret:
-            timestamp, sign = self._generate_signature(self)
-            params['timestamp'] = timestamp
-            params['sign'] = sign
+        if self.dispatcher is not None:
+            self.dispatcher.submit(message_text, at_mobiles, is_at_all)
+            return None
+        return self.send_message_sync(message_text, at_mobiles, is_at_all)
+
+    def send_message_sync(self, message_text, at_mobiles=None, is_at_all=False):
+        """
+        同步发送钉钉群机器人消息，等待请求完成，超出频率限制时先等待
+        :param message_text: 消息文本
+        :param at_mobiles: 需要@的手机号列表，可选，默认为空列表不@任何人
+        :param is_at_all: 是否@所有人，布尔值，默认为False
+        :return: 返回HTTP响应对象，网络请求失败时返回None
+        """
+        self.limiter.acquire()
+        return self._send_text(message_text, at_mobiles, is_at_all)
+
+    def _send_text(self, message_text, at_mobiles=None, is_at_all=False):
+        """
+        发送一条文本消息，不经过限流，调用方负责限流
+        :param message_text: 消息文本
+        :param at_mobiles: 需要@的手机号列表
+        :param is_at_all: 是否@所有人
+        :return: 返回HTTP响应对象，网络请求失败时返回None
+        """
         # 处理消息主体
         message = {
             'msgtype': 'text',
@@ -122,16 +190,93 @@ class Dingding:
             },
         }
         # 如果需要@人员，则添加@字段
-        if at_mobiles:
+        if at_mobiles or is_at_all:
             message['at'] = {
-                'atMobiles': at_mobiles,
+                'atMobiles': at_mobiles or [],
                 'isAtAll': is_at_all
             }
-
-        # 发送request请求
-        response = requests.post(self.webhook, data=json.dumps(message), headers=headers, params=params)
-        if response.status_code == 200 and response.json()['errcode'] == 0:
+        try:
+            response = self._post(message)
+        except requests.RequestException as e:
+            log.warning('钉钉消息推送失败: %s', e)
+            return None
+        if self._is_success(response):
             log.info('钉钉消息推送成功')
         else:
-            log.warn('钉钉消息推送失败')
+            log.warning('钉钉消息推送失败')
         return response
+
+    def _send_batch(self, batch: list) -> bool:
+        """
+        后台线程发送一批消息，只有一条时按文本消息发送，多条时合并为一条markdown消息，后台线程已经限流
+        :param batch: 消息列表，每条为(消息文本, 需要@的手机号列表, 是否@所有人)
+        :return: 是否发送成功
+        """
+        if len(batch) == 1:
+            return self._is_success(self._send_text(*batch[0]))
+        at_mobiles = sorted({mobile for _, mobiles, _ in batch for mobile in (mobiles or [])})
+        is_at_all = any(at_all for _, _, at_all in batch)
+        lines = [f"#### {self.keyword}温馨提示（共{len(batch)}条）"]
+        lines.extend(f"- {message_text}" for message_text, _, _ in batch)
+        # markdown消息需要在正文中写出@的手机号才会提醒
+        if at_mobiles:
+            lines.append(' '.join(f"@{mobile}" for mobile in at_mobiles))
+        message = {
+            'msgtype': 'markdown',
+            'markdown': {
+                'title': f"{self.keyword}温馨提示",
+                'text': '\n'.join(lines),
+            },
+            'at': {
+                'atMobiles': at_mobiles,
+                'isAtAll': is_at_all
+            },
+        }
+        response = self._post(message)
+        if self._is_success(response):
+            log.info('钉钉消息推送成功，合并%s条消息', len(batch))
+            return True
+        log.warning('钉钉消息推送失败')
+        return False
+
+    def _post(self, message: dict):
+        """
+        向webhook发送请求
+        :param message: 消息主体
+        :return: HTTP响应对象
+        """
+        # 处理请求头
+        headers = {
+            'Content-Type': 'application/json;charset=utf-8'
+        }
+        # 处理query参数
+        params = {
+            'access_token': self.access_token
+        }
+        # 如果开启了加签功能，则添加signature字段
+        if self.secret:
+            timestamp, sign = self._generate_signature()
+            params['timestamp'] = timestamp
+            params['sign'] = sign
+        # 发送request请求
+        return self.session.post(self.webhook, data=json.dumps(message), headers=headers, params=params,
+                                 timeout=(self.connect_timeout, self.read_timeout))
+
+    @staticmethod
+    def _is_success(response) -> bool:
+        """
+        判断钉钉接口是否返回成功
+        :param response: HTTP响应对象
+        :return: 是否成功
+        """
+        return response is not None and response.status_code == 200 and response.json().get('errcode') == 0
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        等待异步发送队列中的消息全部发送完成，程序退出前调用
+        :param timeout: 最多等待的秒数，为空时一直等待
+        :return: 是否在超时前全部发送完成
+        """
+        if self.dispatcher is None:
+            return True
+        return self.dispatcher.flush(timeout)
@@ -0,0 +1,185 @@
+"""
+消息异步发送模块
+消息先进入有界队列，由后台线程按机器人的频率限制发送，调用方不用等待网络请求
+限流期间排队的多条消息合并为一条发送
+后台线程为守护线程，程序退出时在atexit中等待队列发送完成，最多等待exit_timeout秒
+"""
+from logger import log
+from collections import deque
+import atexit
+import queue
+import threading
+import time
+
+
+class RateLimiter(object):
+    """
+    滑动窗口限流器，任意period秒内最多max_calls次，可以被多个发送线程共用
+    令牌桶在桶满时允许先发出一整桶再按速率补充，一分钟内会超出机器人的限制，所以按发送时间计数
+    """
+    def __init__(self, max_calls: int, period: float = 60) -> None:
+        """
+        初始化限流器
+        :param max_calls: 每个时间窗口内允许发送的次数，可以在运行中修改
+        :param period: 时间窗口，秒
+        """
+        self.max_calls = max_calls
+        self.period = period
+        # 窗口内每次发送的时间
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def wait_time(self) -> float:
+        """
+        距离下一次允许发送还需要等待的秒数
+        :return: 秒数，可以发送时为0
+        """
+        with self._lock:
+            return self._wait_time(time.monotonic())
+
+    def _wait_time(self, now: float) -> float:
+        """
+        清理窗口外的发送记录，调用方持有锁
+        :param now: 当前时间
+        :return: 距离下一次允许发送还需要等待的秒数，可以发送时为0
+        """
+        while self._calls and self._calls[0] <= now - self.period:
+            self._calls.popleft()
+        max_calls = max(self.max_calls, 1)
+        if len(self._calls) < max_calls:
+            return 0.0
+        # 调小max_calls后窗口内的记录可能多于限制，要等到多出的记录都移出窗口
+        return self._calls[len(self._calls) - max_calls] + self.period - now
+
+    def try_acquire(self) -> float:
+        """
+        可以发送时记录一次发送，不能发送时不等待
+        :return: 0表示已记录，否则为还需要等待的秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = self._wait_time(now)
+            if wait <= 0:
+                self._calls.append(now)
+            return wait
+
+    def acquire(self) -> None:
+        """
+        记录一次发送，超出限制时等待
+        :return: 无
+        """
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+class MessageDispatcher(object):
+    """
+    后台消息发送线程
+    send_func接收一批消息，返回是否发送成功；每条消息为(消息文本, 需要@的手机号列表, 是否@所有人)
+    """
+    def __init__(self, send_func, rate_per_minute: int = 20, queue_size: int = 1000,
+                 max_retries: int = 3, max_batch: int = 50, name: str = 'message_dispatcher',
+                 exit_timeout: float = 30, limiter: RateLimiter = None) -> None:
+        """
+        初始化消息发送线程
+        :param send_func: 发送函数，参数为消息列表，返回True表示发送成功
+        :param rate_per_minute: 每分钟最多发送的次数
+        :param queue_size: 队列长度，队列满时丢弃新消息
+        :param max_retries: 发送失败后的重试次数
+        :param max_batch: 单次合并发送的最大消息条数
+        :param name: 线程名称
+        :param exit_timeout: 程序退出时等待队列发送完成的最长秒数
+        :param limiter: 限流器，与同步发送共用同一个限流器时两条路径合计不超过限制，为空时按rate_per_minute新建
+        """
+        self.send_func = send_func
+        self.limiter = limiter if limiter is not None else RateLimiter(rate_per_minute)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.max_retries = max_retries
+        self.max_batch = max_batch
+        self.exit_timeout = exit_timeout
+        # 因队列满丢弃的消息数、最终发送失败的消息数
+        self.dropped = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self._flush_at_exit)
+
+    def submit(self, message_text: str, at_mobiles: list = None, is_at_all: bool = False) -> bool:
+        """
+        把消息放入队列，立即返回
+        :param message_text: 消息文本
+        :param at_mobiles: 需要@的手机号列表
+        :param is_at_all: 是否@所有人
+        :return: 是否成功放入队列
+        """
+        try:
+            self.queue.put_nowait((message_text, at_mobiles, is_at_all))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            log.warning('消息队列已满，丢弃消息：%s', message_text)
+            return False
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        等待队列中的消息全部发送完成，程序退出前调用
+        :param timeout: 最多等待的秒数，为空时一直等待
+        :return: 是否在超时前全部发送完成
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _flush_at_exit(self) -> None:
+        """
+        程序退出时发送队列中剩余的消息，超时后放弃并记录未发送的条数
+        :return: 无
+        """
+        if not self.flush(self.exit_timeout):
+            log.error('程序退出时仍有%s条消息未发送', self.queue.unfinished_tasks)
+
+    def _run(self) -> None:
+        """
+        后台线程主循环：等待限流，取出当前排队的所有消息一起发送
+        :return: 无
+        """
+        while True:
+            batch = [self.queue.get()]
+            self.limiter.acquire()
+            # 等待限流期间进来的消息一起发送，单次合并条数有上限，避免超出消息长度限制
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._send_with_retry(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _send_with_retry(self, batch: list) -> None:
+        """
+        发送一批消息，失败后按指数退避重试，重试也计入发送次数
+        :param batch: 消息列表
+        :return: 无
+        """
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                time.sleep(min(2 ** attempt, 60))
+                self.limiter.acquire()
+            try:
+                if self.send_func(batch):
+                    return
+            except Exception as e:
+                log.warning('消息发送异常: %s', e)
+        self.failed += len(batch)
+        log.error('消息发送失败，已重试%s次，丢弃%s条消息', self.max_retries, len(batch))
@@ -0,0 +1,259 @@
+"""
+消息发件箱模块
+消息先写入本地SQLite日志，由后台线程发送，发送失败的消息按退避时间重试，程序重启后继续发送
+调用方只把消息放入内存缓冲区，写入线程每隔一小段时间把缓冲区中的消息在一个事务中提交（组提交），
+所以程序崩溃时最多丢失最后一个提交间隔内的消息
+每个渠道一个发送线程，按渠道的频率限制发送；渠道发送失败后整个渠道按退避时间暂停，慢或者失败的渠道不会阻塞其他渠道
+"""
+from logger import log
+from contextlib import closing
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# 消息状态
+STATUS_PENDING = 0
+STATUS_SENT = 1
+STATUS_FAILED = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    dedupe_key TEXT NOT NULL,
+    message_text TEXT NOT NULL,
+    at_mobiles TEXT NOT NULL,
+    is_at_all INTEGER NOT NULL,
+    status INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS outbox_pending_dedupe ON outbox (channel, dedupe_key) WHERE status = 0;
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, next_attempt_at);
+"""
+
+
+class MessageOutbox(object):
+    """
+    持久化的消息发件箱
+    每条消息按渠道拆成多行，每个渠道独立发送、限流和重试；同一渠道中尚未发送的相同消息只保留一条
+    """
+    def __init__(self, path: str, channels: list, commit_interval: float = 0.05, retry_base: float = 5,
+                 max_attempts: int = 20, poll_interval: float = 1.0) -> None:
+        """
+        初始化发件箱并启动写入线程和发送线程
+        :param path: SQLite文件路径
+        :param channels: MessageChannel列表
+        :param commit_interval: 组提交间隔，秒
+        :param retry_base: 第一次重试的等待秒数，之后每次翻倍，最长10分钟；渠道连续失败时整个渠道的暂停时间同理
+        :param max_attempts: 最多发送次数，超过后标记为失败不再发送
+        :param poll_interval: 没有新消息时，发送线程检查待重试消息的间隔，秒
+        """
+        self.path = path
+        self.channels = {channel.name: channel for channel in channels}
+        self.commit_interval = commit_interval
+        self.retry_base = retry_base
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        dir_name = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dir_name, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._has_buffer = threading.Event()
+        # 渠道名称 -> 有新消息提交的事件
+        self._has_committed = {name: threading.Event() for name in self.channels}
+        # 渠道名称 -> 连续失败次数
+        self._channel_failures = {name: 0 for name in self.channels}
+        self._stopping = False
+        self._stop_event = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, name='outbox_writer', daemon=True)
+        self._senders = [threading.Thread(target=self._send_loop, args=(name,), name=f'outbox_sender_{name}',
+                                          daemon=True) for name in self.channels]
+        self._writer.start()
+        for sender in self._senders:
+            sender.start()
+        # 程序退出时把缓冲区中的消息写入磁盘
+        atexit.register(self.close)
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        打开SQLite连接，WAL模式下写入线程和发送线程可以同时读写
+        :return: 连接
+        """
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=FULL')
+        return conn
+
+    def put(self, message_text: str, at_mobiles: list = None, is_at_all: bool = False) -> None:
+        """
+        把消息放入发件箱，只写内存缓冲区，立即返回
+        :param message_text: 消息文本
+        :param at_mobiles: 需要@的手机号列表
+        :param is_at_all: 是否@所有人
+        :return: 无
+        """
+        with self._buffer_lock:
+            self._buffer.append((message_text, at_mobiles or [], bool(is_at_all), time.time()))
+        self._has_buffer.set()
+
+    def _write_loop(self) -> None:
+        """
+        写入线程：攒一个提交间隔的消息，在一个事务中写入并提交
+        :return: 无
+        """
+        conn = self._connect()
+        while True:
+            self._has_buffer.wait()
+            # 等待一个提交间隔，让这段时间内的消息一起提交
+            time.sleep(self.commit_interval)
+            self._has_buffer.clear()
+            with self._buffer_lock:
+                batch, self._buffer = self._buffer, []
+            if batch:
+                self._write_batch(conn, batch)
+                for event in self._has_committed.values():
+                    event.set()
+            if self._stopping:
+                conn.close()
+                return
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: list) -> None:
+        """
+        把一批消息写入SQLite，每条消息每个渠道一行
+        :param conn: 连接
+        :param batch: 消息列表
+        :return: 无
+        """
+        rows = []
+        for message_text, at_mobiles, is_at_all, created_at in batch:
+            at_mobiles_json = json.dumps(at_mobiles)
+            dedupe_key = hashlib.sha1(f"{message_text}\n{at_mobiles_json}\n{is_at_all}".encode('utf-8')).hexdigest()
+            for channel in self.channels:
+                rows.append((channel, dedupe_key, message_text, at_mobiles_json, int(is_at_all),
+                             created_at, created_at))
+        try:
+            with conn:
+                conn.executemany(
+                    'INSERT OR IGNORE INTO outbox (channel, dedupe_key, message_text, at_mobiles, is_at_all, '
+                    'next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        except sqlite3.Error as e:
+            log.error('消息写入发件箱失败: %s', e)
+
+    def _send_loop(self, channel_name: str) -> None:
+        """
+        渠道的发送线程：发送该渠道所有到期的待发送消息
+        没有到期消息时等待新消息提交或者轮询间隔；限流或者渠道暂停时等待到期，期间不因新消息提前唤醒
+        :param channel_name: 渠道名称
+        :return: 无
+        """
+        conn = self._connect()
+        has_committed = self._has_committed[channel_name]
+        while not self._stopping:
+            has_committed.clear()
+            try:
+                wait = self._send_due(conn, channel_name)
+            except sqlite3.Error as e:
+                log.error('读取发件箱失败: %s', e)
+                wait = None
+            if wait is None:
+                has_committed.wait(self.poll_interval)
+            elif wait > 0:
+                self._stop_event.wait(wait)
+        conn.close()
+
+    def _send_due(self, conn: sqlite3.Connection, channel_name: str, limit: int = 100):
+        """
+        发送一个渠道的一批到期消息并更新状态
+        :param conn: 连接
+        :param channel_name: 渠道名称
+        :param limit: 每批最多发送的条数
+        :return: 下一轮之前需要等待的秒数，0为立即继续，没有到期的消息时为None
+        """
+        rows = conn.execute(
+            'SELECT id, message_text, at_mobiles, is_at_all, attempts FROM outbox '
+            'WHERE status = ? AND next_attempt_at <= ? AND channel = ? ORDER BY id LIMIT ?',
+            (STATUS_PENDING, time.time(), channel_name, limit)).fetchall()
+        if not rows:
+            return None
+        channel = self.channels[channel_name]
+        for row_id, message_text, at_mobiles, is_at_all, attempts in rows:
+            if self._stopping:
+                return 0
+            # 超出渠道频率限制时暂停该渠道，等到有额度再发送，不在send中阻塞发送线程
+            wait = channel.wait_time()
+            if wait > 0:
+                return wait
+            try:
+                success = channel.send(message_text, json.loads(at_mobiles), bool(is_at_all))
+            except Exception as e:
+                log.warning('%s渠道发送发件箱消息异常: %s', channel_name, e)
+                success = False
+            attempts += 1
+            with conn:
+                if success:
+                    conn.execute('UPDATE outbox SET status = ?, attempts = ?, sent_at = ? WHERE id = ?',
+                                 (STATUS_SENT, attempts, time.time(), row_id))
+                elif attempts >= self.max_attempts:
+                    log.error('%s渠道消息发送%s次仍失败，不再重试: %s', channel_name, attempts, message_text)
+                    conn.execute('UPDATE outbox SET status = ?, attempts = ? WHERE id = ?',
+                                 (STATUS_FAILED, attempts, row_id))
+                else:
+                    delay = min(self.retry_base * 2 ** (attempts - 1), 600)
+                    conn.execute('UPDATE outbox SET attempts = ?, next_attempt_at = ? WHERE id = ?',
+                                 (attempts, time.time() + delay, row_id))
+            if success:
+                self._channel_failures[channel_name] = 0
+            else:
+                # 渠道不可用时其余消息大概率也会失败，暂停整个渠道，不逐条等待超时
+                self._channel_failures[channel_name] += 1
+                failures = self._channel_failures[channel_name]
+                return min(self.retry_base * 2 ** (failures - 1), 600)
+        return 0
+
+    def pending_count(self) -> int:
+        """
+        尚未发送成功的消息数（按渠道计）
+        :return: 条数
+        """
+        with self._buffer_lock:
+            buffered = len(self._buffer) * len(self.channels)
+        with closing(self._connect()) as conn:
+            return buffered + conn.execute('SELECT COUNT(*) FROM outbox WHERE status = ?',
+                                           (STATUS_PENDING,)).fetchone()[0]
+
+    def purge_sent(self, older_than_seconds: float = 7 * 24 * 3600) -> int:
+        """
+        删除已经发送成功的旧记录
+        :param older_than_seconds: 删除多少秒之前发送的记录
+        :return: 删除的条数
+        """
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute('DELETE FROM outbox WHERE status = ? AND sent_at < ?',
+                                  (STATUS_SENT, time.time() - older_than_seconds))
+            return cursor.rowcount
+
+    def close(self) -> None:
+        """
+        把缓冲区中的消息写入磁盘后停止后台线程，未发送的消息下次启动后继续发送
+        :return: 无
+        """
+        if self._stopping:
+            return
+        self._stopping = True
+        self._stop_event.set()
+        self._has_buffer.set()
+        for event in self._has_committed.values():
+            event.set()
+        self._writer.join()
+        for sender in self._senders:
+            sender.join()
@@ -0,0 +1,91 @@
+"""
+消息分发模块
+同一条消息同时推送到所有开启的渠道，总耗时取决于最慢的渠道而不是所有渠道之和
+"""
+from logger import log
+from concurrent.futures import ThreadPoolExecutor, wait
+import threading
+import time
+
+
+class FanoutPublisher(object):
+    """
+    多渠道并发推送
+    """
+    def __init__(self, channels: list, timeout: float = 10) -> None:
+        """
+        初始化多渠道推送
+        :param channels: MessageChannel列表
+        :param timeout: 等待所有渠道完成的最长秒数，超时的渠道记为失败
+        """
+        self.channels = channels
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max(len(channels), 1), thread_name_prefix='message_push')
+        self._lock = threading.Lock()
+        # 渠道名称 -> 统计数据
+        self._metrics = {channel.name: {'sent': 0, 'failed': 0, 'total_seconds': 0.0, 'max_seconds': 0.0}
+                         for channel in channels}
+
+    def publish(self, message_text: str, at_mobiles: list = None, is_at_all: bool = False) -> dict:
+        """
+        向所有渠道推送同一条消息
+        :param message_text: 消息文本
+        :param at_mobiles: 需要@的手机号列表
+        :param is_at_all: 是否@所有人
+        :return: {渠道名称: 是否成功}
+        """
+        futures = {channel.name: self._executor.submit(self._send, channel, message_text, at_mobiles, is_at_all)
+                   for channel in self.channels}
+        wait(futures.values(), timeout=self.timeout)
+        results = {}
+        for name, future in futures.items():
+            if future.done():
+                results[name] = future.result()
+            else:
+                # 超时的渠道在后台继续执行，完成后再计入统计
+                log.warning('%s渠道推送超时', name)
+                results[name] = False
+        return results
+
+    def _send(self, channel, message_text: str, at_mobiles: list, is_at_all: bool) -> bool:
+        """
+        向单个渠道推送并记录耗时
+        :param channel: 渠道
+        :param message_text: 消息文本
+        :param at_mobiles: 需要@的手机号列表
+        :param is_at_all: 是否@所有人
+        :return: 是否成功
+        """
+        start = time.perf_counter()
+        try:
+            success = bool(channel.send(message_text, at_mobiles, is_at_all))
+        except Exception as e:
+            log.warning('%s渠道推送异常: %s', channel.name, e)
+            success = False
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            metrics = self._metrics[channel.name]
+            metrics['sent' if success else 'failed'] += 1
+            metrics['total_seconds'] += elapsed
+            metrics['max_seconds'] = max(metrics['max_seconds'], elapsed)
+        return success
+
+    def metrics(self) -> dict:
+        """
+        各渠道的推送统计
+        :return: {渠道名称: {'sent', 'failed', 'avg_seconds', 'max_seconds'}}
+        """
+        with self._lock:
+            return {name: {
+                'sent': metrics['sent'],
+                'failed': metrics['failed'],
+                'avg_seconds': metrics['total_seconds'] / max(metrics['sent'] + metrics['failed'], 1),
+                'max_seconds': metrics['max_seconds'],
+            } for name, metrics in self._metrics.items()}
+
+    def close(self) -> None:
+        """
+        等待正在推送的消息完成后关闭线程池
+        :return: 无
+        """
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,8 @@
+from runner.registry import JOBS, JobSpec, discover, job
+
+"""
+任务调度
+1 在任务包（默认jobs）中用@job(interval=60)或@job(cron='*/5 9-15 * * 1-5')装饰任务函数
+2 python main.py 启动调度器，所有任务在同一个进程中按计划执行，共用数据库连接池、日志和消息推送
+3 导入本模块只注册任务，不会读取配置文件
+"""
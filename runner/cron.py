@@ -0,0 +1,96 @@
+"""
+简化的cron表达式
+支持五个字段：分 时 日 月 周，每个字段可以是 *、数字、a-b、*/n、a-b/n 以及用逗号分隔的组合
+周的取值为0-6，0为周日；日和周都不是*时，满足其一即可，与cron一致
+"""
+import datetime
+
+# 每个字段的取值范围
+_FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+
+def _parse_field(text: str, low: int, high: int) -> frozenset:
+    """
+    解析一个字段
+    :param text: 字段文本
+    :param low: 最小值
+    :param high: 最大值
+    :return: 允许的取值集合
+    """
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step <= 0:
+                raise ValueError(f'cron步长必须大于0：{text}')
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-', 1))
+        else:
+            start = end = int(part)
+            # a/n 表示从a开始每隔n
+            if step != 1:
+                end = high
+        if start < low or end > high or start > end:
+            raise ValueError(f'cron字段超出范围{low}-{high}：{text}')
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronSchedule(object):
+    """
+    cron计划，计算下一次执行时间
+    """
+    def __init__(self, expression: str) -> None:
+        """
+        解析cron表达式
+        :param expression: 五个字段的cron表达式，如 '*/5 9-15 * * 1-5'
+        """
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'cron表达式需要5个字段：{expression}')
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            _parse_field(field, low, high) for field, (low, high) in zip(fields, _FIELD_RANGES))
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, date: datetime.date) -> bool:
+        """
+        日期是否满足日和周字段
+        :param date: 日期
+        :return: 是否满足
+        """
+        day_ok = date.day in self.days
+        # Python中周一为0，cron中周日为0
+        weekday_ok = (date.weekday() + 1) % 7 in self.weekdays
+        if self._any_day:
+            return weekday_ok
+        if self._any_weekday:
+            return day_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment: datetime.datetime) -> datetime.datetime:
+        """
+        计算moment之后（不含）的下一次执行时间，按天、小时跳过不满足的时间段
+        :param moment: 起始时间
+        :return: 下一次执行时间
+        """
+        candidate = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        # 最多向后找5年，防止2月30日这类永远不满足的表达式死循环
+        limit = candidate + datetime.timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months or not self._day_matches(candidate.date()):
+                candidate = (candidate + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = (candidate + datetime.timedelta(hours=1)).replace(minute=0)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += datetime.timedelta(minutes=1)
+                continue
+            return candidate
+        raise ValueError(f'cron表达式没有可执行的时间：{self.expression}')
@@ -0,0 +1,76 @@
+"""
+任务注册模块
+用@job装饰任务函数即完成注册，调度器启动时导入任务包中的所有模块
+"""
+from runner.cron import CronSchedule
+import importlib
+import pkgutil
+
+# 任务名称 -> JobSpec
+JOBS = {}
+
+
+class JobSpec(object):
+    """
+    任务定义
+    """
+    def __init__(self, func, name: str, interval: float = None, cron: str = None, max_concurrency: int = 1,
+                 timeout: float = None, use_process: bool = False, run_at_start: bool = False) -> None:
+        """
+        :param func: 任务函数，无参数
+        :param name: 任务名称
+        :param interval: 执行间隔，秒，与cron二选一；都为空时只能手动执行
+        :param cron: cron表达式，见CronSchedule
+        :param max_concurrency: 同一任务同时执行的最大数量，达到上限时跳过本次执行
+        :param timeout: 超时秒数，超时后只记录日志、计入timeouts并按notify_failure推送报警，不会取消或终止任务：
+                        任务继续执行并占用并发数，结束后照常记录；需要限时的任务应在函数内部自行检查耗时或设置语句超时
+        :param use_process: 是否在进程池中执行，计算密集的任务使用，函数必须定义在模块顶层
+        :param run_at_start: 调度器启动时是否立即执行一次
+        """
+        if interval is not None and cron is not None:
+            raise ValueError(f'任务{name}不能同时设置interval和cron')
+        if interval is not None and interval <= 0:
+            raise ValueError(f'任务{name}的interval必须大于0')
+        if max_concurrency < 1:
+            raise ValueError(f'任务{name}的max_concurrency必须大于0')
+        self.func = func
+        self.name = name
+        self.interval = interval
+        self.cron = CronSchedule(cron) if cron else None
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.use_process = use_process
+        self.run_at_start = run_at_start
+        # 进程池中按模块名和函数名重新找到任务函数
+        self.module = func.__module__
+        self.qualname = func.__qualname__
+
+
+def job(name: str = None, interval: float = None, cron: str = None, max_concurrency: int = 1,
+        timeout: float = None, use_process: bool = False, run_at_start: bool = False):
+    """
+    注册任务的装饰器，用法：
+    @job(interval=60)
+    def sync_quotes(): ...
+    参数见JobSpec，name为空时使用函数名
+    """
+    def decorator(func):
+        job_name = name or func.__name__
+        if job_name in JOBS and JOBS[job_name].func is not func:
+            raise ValueError(f'任务名称重复：{job_name}')
+        JOBS[job_name] = JobSpec(func, job_name, interval, cron, max_concurrency, timeout, use_process,
+                                 run_at_start)
+        return func
+    return decorator
+
+
+def discover(package_name: str) -> dict:
+    """
+    导入任务包及其所有子模块，使其中的@job完成注册
+    :param package_name: 任务包名称
+    :return: 已注册的任务，{任务名称: JobSpec}
+    """
+    package = importlib.import_module(package_name)
+    for module_info in pkgutil.walk_packages(getattr(package, '__path__', []), f'{package_name}.'):
+        importlib.import_module(module_info.name)
+    return JOBS
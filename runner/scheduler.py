@@ -0,0 +1,264 @@
+"""
+任务调度模块
+所有任务在一个长期运行的进程中按计划执行，数据库连接池、日志、消息推送只初始化一次
+一般任务在共享线程池中执行，use_process的任务在共享进程池中执行，进程池的每个工作进程启动时预先初始化上述对象
+进程池使用spawn方式启动工作进程：fork出的子进程会继承主进程已经打开的数据库连接和没有后台线程的异步日志队列，
+共用连接会使双方的查询结果错乱，日志也会丢失；spawn的工作进程从头导入模块，各自创建自己的连接池和日志
+任务超时只记录和报警，不会中断任务，见JobSpec
+"""
+from logger import log
+from runner.registry import JobSpec
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import datetime
+import heapq
+import importlib
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+
+
+def _warm_up(warm_pg: bool, warm_push: bool) -> None:
+    """
+    初始化日志、数据库连接池和消息推送，未开启的跳过
+    进程池的工作进程启动时调用，之后该进程执行的所有任务共用这些对象
+    :param warm_pg: 是否初始化数据库连接池
+    :param warm_push: 是否初始化消息推送
+    :return: 无
+    """
+    import logger
+    logger.get_log()
+    if warm_pg:
+        try:
+            from db_connect import pg  # noqa: F401
+        except ImportError:
+            pass
+    if warm_push:
+        import message_push
+        message_push.get_publisher()
+
+
+def _run_in_process(module_name: str, qualname: str):
+    """
+    在进程池的工作进程中执行任务，按模块名和函数名找到任务函数
+    :param module_name: 模块名
+    :param qualname: 函数名
+    :return: 任务函数的返回值
+    """
+    target = importlib.import_module(module_name)
+    for part in qualname.split('.'):
+        target = getattr(target, part)
+    return target()
+
+
+class Scheduler(object):
+    """
+    任务调度器
+    """
+    def __init__(self, jobs: dict, thread_workers: int = 4, process_workers: int = 0,
+                 warm_pg: bool = True, warm_push: bool = True, notify_failure: bool = False) -> None:
+        """
+        初始化调度器
+        :param jobs: {任务名称: JobSpec}
+        :param thread_workers: 线程池大小
+        :param process_workers: 进程池大小，为0时使用CPU核数；没有use_process的任务时不创建进程池
+        :param warm_pg: 启动时是否初始化数据库连接池
+        :param warm_push: 启动时是否初始化消息推送
+        :param notify_failure: 任务失败或超时时是否推送消息
+        """
+        self.jobs = jobs
+        self.warm_pg = warm_pg
+        self.warm_push = warm_push
+        self.notify_failure = notify_failure
+        self._thread_pool = ThreadPoolExecutor(max_workers=thread_workers, thread_name_prefix='job')
+        self._process_pool = None
+        if any(spec.use_process for spec in jobs.values()):
+            self._process_pool = ProcessPoolExecutor(max_workers=process_workers or os.cpu_count(),
+                                                     mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=_warm_up, initargs=(warm_pg, warm_push))
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        # 任务名称 -> {future: [开始时间, 是否已报告超时]}
+        self._running = {name: {} for name in jobs}
+        self._metrics = {name: {'runs': 0, 'succeeded': 0, 'failed': 0, 'timeouts': 0, 'skipped': 0,
+                                'total_seconds': 0.0, 'max_seconds': 0.0, 'last_seconds': None,
+                                'last_finished_at': None} for name in jobs}
+        # (下次执行时间, 任务名称)
+        self._heap = []
+
+    def warm_up(self) -> None:
+        """
+        在主进程中初始化日志、数据库连接池和消息推送，线程池中的任务共用
+        :return: 无
+        """
+        _warm_up(self.warm_pg, self.warm_push)
+
+    def submit(self, name: str):
+        """
+        立即执行一次任务，同一任务执行中的数量达到上限时跳过
+        :param name: 任务名称
+        :return: Future，跳过时为None
+        """
+        spec = self.jobs[name]
+        with self._lock:
+            running = self._running[name]
+            if len(running) >= spec.max_concurrency:
+                self._metrics[name]['skipped'] += 1
+                log.warning('任务%s已有%s个在执行，跳过本次执行', name, len(running))
+                return None
+            started_at = time.monotonic()
+            if spec.use_process:
+                future = self._process_pool.submit(_run_in_process, spec.module, spec.qualname)
+            else:
+                future = self._thread_pool.submit(spec.func)
+            running[future] = [started_at, False]
+        future.add_done_callback(lambda done: self._on_done(spec, done))
+        return future
+
+    def _on_done(self, spec: JobSpec, future) -> None:
+        """
+        任务结束后的回调，记录耗时和结果
+        :param spec: 任务定义
+        :param future: 任务的Future
+        :return: 无
+        """
+        with self._lock:
+            started_at, _ = self._running[spec.name].pop(future)
+            elapsed = time.monotonic() - started_at
+            metrics = self._metrics[spec.name]
+            metrics['runs'] += 1
+            metrics['total_seconds'] += elapsed
+            metrics['max_seconds'] = max(metrics['max_seconds'], elapsed)
+            metrics['last_seconds'] = elapsed
+            metrics['last_finished_at'] = time.time()
+            error = None if future.cancelled() else future.exception()
+            metrics['failed' if error is not None or future.cancelled() else 'succeeded'] += 1
+        if error is not None:
+            detail = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+            log.error('任务%s执行失败，耗时%.3f秒：%s', spec.name, elapsed, detail)
+            self._notify(f'任务{spec.name}执行失败：{error}')
+        else:
+            log.info('任务%s执行完成，耗时%.3f秒', spec.name, elapsed)
+
+    def _check_timeouts(self) -> None:
+        """
+        检查执行超时的任务，每次超时只报告一次
+        线程和进程池中的任务无法被安全中断，超时的任务继续执行并占用并发数，结束后照常记录
+        :return: 无
+        """
+        now = time.monotonic()
+        timed_out = []
+        with self._lock:
+            for name, running in self._running.items():
+                timeout = self.jobs[name].timeout
+                if not timeout:
+                    continue
+                for state in running.values():
+                    if not state[1] and now - state[0] > timeout:
+                        state[1] = True
+                        self._metrics[name]['timeouts'] += 1
+                        timed_out.append((name, now - state[0]))
+        for name, elapsed in timed_out:
+            log.error('任务%s执行超时，已执行%.1f秒', name, elapsed)
+            self._notify(f'任务{name}执行超时，已执行{elapsed:.0f}秒')
+
+    def _notify(self, message_text: str) -> None:
+        """
+        推送任务失败消息，推送失败不影响调度
+        :param message_text: 消息文本
+        :return: 无
+        """
+        if not self.notify_failure:
+            return
+        try:
+            import message_push
+            publisher = message_push.get_publisher()
+            if publisher is not None:
+                publisher.publish(message_text)
+        except Exception as e:
+            log.warning('任务失败消息推送异常: %s', e)
+
+    @staticmethod
+    def _next_run(spec: JobSpec, after: float):
+        """
+        计算任务的下一次执行时间
+        :param spec: 任务定义
+        :param after: 上一次计划执行的时间戳
+        :return: 时间戳，只能手动执行的任务为None
+        """
+        now = time.time()
+        if spec.interval is not None:
+            # 按固定频率执行，错过的执行不补
+            next_time = after + spec.interval
+            if next_time <= now:
+                next_time = now + spec.interval
+            return next_time
+        if spec.cron is not None:
+            return spec.cron.next_after(datetime.datetime.fromtimestamp(max(after, now))).timestamp()
+        return None
+
+    def run_forever(self) -> None:
+        """
+        按计划执行所有任务，直到调用stop
+        :return: 无
+        """
+        self.warm_up()
+        now = time.time()
+        for name, spec in self.jobs.items():
+            first = now if spec.run_at_start else self._next_run(spec, now)
+            if first is not None:
+                heapq.heappush(self._heap, (first, name))
+        log.info('调度器启动，共%s个任务，%s个按计划执行', len(self.jobs), len(self._heap))
+        while not self._stop_event.is_set():
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                scheduled, name = heapq.heappop(self._heap)
+                self.submit(name)
+                next_time = self._next_run(self.jobs[name], scheduled)
+                if next_time is not None:
+                    heapq.heappush(self._heap, (next_time, name))
+            self._check_timeouts()
+            wait = min(self._heap[0][0] - time.time(), 1.0) if self._heap else 1.0
+            self._stop_event.wait(max(wait, 0))
+        log.info('调度器已停止')
+
+    def run_once(self, name: str, timeout: float = None):
+        """
+        立即执行一次任务并等待结束
+        :param name: 任务名称
+        :param timeout: 最多等待的秒数
+        :return: 任务函数的返回值
+        """
+        self.warm_up()
+        future = self.submit(name)
+        if future is None:
+            return None
+        return future.result(timeout)
+
+    def metrics(self) -> dict:
+        """
+        各任务的执行统计
+        :return: {任务名称: {'runs', 'succeeded', 'failed', 'timeouts', 'skipped', 'running',
+                 'avg_seconds', 'max_seconds', 'last_seconds', 'last_finished_at'}}
+        """
+        with self._lock:
+            result = {}
+            for name, metrics in self._metrics.items():
+                item = dict(metrics)
+                item['running'] = len(self._running[name])
+                item['avg_seconds'] = metrics['total_seconds'] / metrics['runs'] if metrics['runs'] else 0.0
+                del item['total_seconds']
+                result[name] = item
+            return result
+
+    def stop(self, wait: bool = True) -> None:
+        """
+        停止调度，等待执行中的任务结束后关闭线程池和进程池
+        :param wait: 是否等待执行中的任务
+        :return: 无
+        """
+        self._stop_event.set()
+        self._thread_pool.shutdown(wait=wait)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=wait)
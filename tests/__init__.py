@@ -0,0 +1,40 @@
+"""
+测试包
+运行：python -m pytest tests 或 python -m unittest discover tests
+没有设置QS_CONFIG_PATH时以config.ini.dist为模板生成临时配置文件
+设置环境变量QS_TEST_DSN（如 host=127.0.0.1 port=5432 dbname=test user=postgres password=...）时开启数据库，
+运行需要数据库的测试，测试会在该库中建表和删表，不要指向生产库
+"""
+from benchmarks.common import use_temp_config
+import os
+import tempfile
+
+TEST_DSN = os.getenv('QS_TEST_DSN', '')
+
+
+def _dsn_config(dsn: str) -> dict:
+    """
+    把DSN转换为[postgresql]段落的配置项
+    :param dsn: 空格分隔的key=value
+    :return: 配置项字典，DSN为空时只关闭数据库
+    """
+    if not dsn:
+        return {'enable': 'False'}
+    params = dict(item.split('=', 1) for item in dsn.split())
+    return {
+        'enable': 'True',
+        'host': params.get('host', '127.0.0.1'),
+        'port': params.get('port', '5432'),
+        'user': params.get('user', 'postgres'),
+        'password': params.get('password', ''),
+        'database': params.get('dbname', 'postgres'),
+    }
+
+
+if not os.getenv('QS_CONFIG_PATH'):
+    use_temp_config({
+        'log': {'log_path': tempfile.mkdtemp(prefix='qs_test_log_'), 'console_log_level': 'WARNING',
+                'file_log_level': 'WARNING', 'log_async': 'False'},
+        'postgresql': _dsn_config(TEST_DSN),
+        'MessagePush': {'is_enable': 'False'},
+    })
@@ -0,0 +1,63 @@
+"""
+推送渠道限流测试
+"""
+from message_push import dispatcher
+from message_push.dispatcher import RateLimiter
+from tests.test_dispatcher import FakeClock
+from unittest import mock
+import unittest
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+
+def _offline_dingding(rate_limit_per_minute: int):
+    """
+    不读取配置文件的Dingding，HTTP请求被替换为直接返回成功
+    :param rate_limit_per_minute: 每分钟最多发送的消息数
+    :return: Dingding
+    """
+    from message_push.dingding import Dingding
+    dingding = Dingding.__new__(Dingding)
+    dingding.keyword = ''
+    dingding.limiter = RateLimiter(rate_limit_per_minute)
+    dingding.dispatcher = None
+    response = mock.Mock(status_code=200)
+    response.json.return_value = {'errcode': 0}
+    dingding._post = mock.Mock(return_value=response)
+    return dingding
+
+
+@unittest.skipIf(requests is None, '没有安装requests')
+class DingdingChannelTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        patcher = mock.patch.object(dispatcher, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_send_is_rate_limited(self):
+        from message_push.channel import DingdingChannel
+        dingding = _offline_dingding(3)
+        channel = DingdingChannel(dingding)
+        start = self.clock.now
+        for i in range(4):
+            self.assertTrue(channel.send(f'message {i}'))
+        # 第4条等到第1条移出窗口后才发送
+        self.assertEqual(dingding._post.call_count, 4)
+        self.assertAlmostEqual(self.clock.now - start, 60)
+
+    def test_wait_time_does_not_consume(self):
+        from message_push.channel import DingdingChannel
+        dingding = _offline_dingding(1)
+        channel = DingdingChannel(dingding)
+        self.assertEqual(channel.wait_time(), 0)
+        self.assertEqual(channel.wait_time(), 0)
+        channel.send('message')
+        self.assertAlmostEqual(channel.wait_time(), 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+消息发送限流测试
+"""
+from message_push import dispatcher
+from message_push.dispatcher import MessageDispatcher, RateLimiter
+from unittest import mock
+import unittest
+
+
+class FakeClock(object):
+    """
+    替换dispatcher模块中的time，sleep只推进时间
+    """
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        patcher = mock.patch.object(dispatcher, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_no_burst_beyond_limit(self):
+        limiter = RateLimiter(20)
+        for _ in range(20):
+            self.assertEqual(limiter.try_acquire(), 0)
+        self.assertAlmostEqual(limiter.try_acquire(), 60)
+        # 令牌桶在半分钟后会补充10个令牌，滑动窗口在整个窗口内都不能再发送
+        self.clock.now += 30
+        self.assertAlmostEqual(limiter.try_acquire(), 30)
+        self.clock.now += 30
+        self.assertEqual(limiter.try_acquire(), 0)
+
+    def test_any_window_within_limit(self):
+        limiter = RateLimiter(20)
+        sent = []
+        for _ in range(100):
+            limiter.acquire()
+            sent.append(self.clock.now)
+            self.clock.now += 0.1
+        for i, start in enumerate(sent):
+            in_window = [t for t in sent[i:] if t < start + 60]
+            self.assertLessEqual(len(in_window), 20)
+
+    def test_lower_limit_at_runtime(self):
+        limiter = RateLimiter(20)
+        for _ in range(20):
+            limiter.try_acquire()
+            self.clock.now += 1
+        limiter.max_calls = 5
+        # 窗口内已有20次，要等到只剩4次时才能再发送
+        self.assertAlmostEqual(limiter.wait_time(), 1000.0 + 15 + 60 - self.clock.now)
+
+
+class MessageDispatcherTest(unittest.TestCase):
+    def test_shared_limiter(self):
+        limiter = RateLimiter(1000)
+        sent = []
+        message_dispatcher = MessageDispatcher(lambda batch: sent.append(batch) or True, limiter=limiter,
+                                               exit_timeout=0)
+        self.assertIs(message_dispatcher.limiter, limiter)
+        message_dispatcher.submit('hello')
+        self.assertTrue(message_dispatcher.flush(5))
+        self.assertEqual(sent, [[('hello', None, False)]])
+        self.assertEqual(len(limiter._calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+"""
+PgDbOperator测试
+不需要数据库的测试只依赖psycopg2；需要数据库的测试在设置QS_TEST_DSN时运行，见tests/__init__.py
+"""
+from db_connect.query_cache import QueryCache
+from tests import TEST_DSN
+import unittest
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+
+def _offline_operator():
+    """
+    不连接数据库的操作对象，只能调用在取连接之前就返回或报错的逻辑
+    :return: PgDbOperator
+    """
+    from db_connect.pg_db_operator import PgDbOperator
+    pg = PgDbOperator.__new__(PgDbOperator)
+    pg.metrics = None
+    pg.query_cache = None
+    pg.schema = None
+    return pg
+
+
+@unittest.skipIf(psycopg2 is None, '没有安装psycopg2')
+class WriteConditionTest(unittest.TestCase):
+    """
+    删除和更新的条件为空时不能处理全表
+    """
+    def setUp(self) -> None:
+        self.pg = _offline_operator()
+
+    def test_delete_rejects_empty_condition(self):
+        for condition in (None, '', '   '):
+            with self.assertRaises(ValueError):
+                self.pg.delete('t', condition)
+
+    def test_update_rejects_empty_condition(self):
+        for condition in (None, '', '   '):
+            with self.assertRaises(ValueError):
+                self.pg.update('t', {'name': 'ZZ'}, condition)
+
+
+@unittest.skipIf(psycopg2 is None or not TEST_DSN, '没有设置QS_TEST_DSN')
+class DatabaseTestCase(unittest.TestCase):
+    """
+    需要数据库的测试基类，每个测试前重建测试表qs_test_t(id int主键, name text, note text)
+    """
+    pg = None
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        from db_connect.pg_db_operator import PgDbOperator
+        cls.pg = PgDbOperator()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        with cls.pg.connection() as cur:
+            cur.execute('DROP TABLE IF EXISTS qs_test_t')
+        cls.pg.close()
+
+    def setUp(self) -> None:
+        self.pg.schema = None
+        with self.pg.connection() as cur:
+            cur.execute('DROP TABLE IF EXISTS qs_test_t')
+            cur.execute('CREATE TABLE qs_test_t (id int PRIMARY KEY, name text, note text)')
+            cur.execute("INSERT INTO qs_test_t VALUES (1, 'a', 'x'), (2, 'b', 'y')")
+
+    def rows(self) -> list:
+        with self.pg.connection() as cur:
+            cur.execute('SELECT id, name, note FROM qs_test_t ORDER BY id')
+            return cur.fetchall()
+
+
+class WriteConditionDatabaseTest(DatabaseTestCase):
+    def test_empty_condition_leaves_table_unchanged(self):
+        before = self.rows()
+        with self.assertRaises(ValueError):
+            self.pg.delete('qs_test_t', '')
+        with self.assertRaises(ValueError):
+            self.pg.update('qs_test_t', {'name': 'ZZ'}, None)
+        self.assertEqual(self.rows(), before)
+
+    def test_explicit_true_affects_all_rows(self):
+        self.pg.update('qs_test_t', {'name': 'ZZ'}, 'TRUE')
+        self.assertEqual([row[1] for row in self.rows()], ['ZZ', 'ZZ'])
+        self.pg.delete('qs_test_t', 'TRUE')
+        self.assertEqual(self.rows(), [])
+
+
+def _replay(groups: list, key_columns: tuple) -> dict:
+    """
+    按分组结果的顺序模拟执行，得到每个主键最终的字段值
+    :param groups: _group_by_columns的返回值
+    :param key_columns: 主键元组
+    :return: {主键: {字段: 值}}
+    """
+    table = {}
+    for columns, rows in groups:
+        keys = [tuple(dict(zip(columns, values))[col] for col in key_columns) for values in rows]
+        # 同一条语句不能两次处理同一行
+        assert len(set(keys)) == len(keys)
+        for key, values in zip(keys, rows):
+            table.setdefault(key, {}).update(zip(columns, values))
+    return table
+
+
+def _row_by_row(data_list: list, key_columns: tuple) -> dict:
+    """
+    逐行执行的结果，作为分组执行的对照
+    """
+    return _replay([(tuple(row), [tuple(row.values())]) for row in data_list], key_columns)
+
+
+@unittest.skipIf(psycopg2 is None, '没有安装psycopg2')
+class GroupByColumnsTest(unittest.TestCase):
+    """
+    按字段组合分组执行时，同一主键以最后一次出现为准
+    """
+    data_list = [
+        {'id': 1, 'name': 'a'},
+        {'id': 1, 'name': 'b', 'note': 'x'},
+        {'id': 2, 'name': 'd'},
+        {'id': 1, 'name': 'c'},
+        {'id': 2, 'name': 'e', 'note': 'y'},
+        {'id': 3, 'name': 'f'},
+    ]
+
+    def test_last_write_wins_across_column_sets(self):
+        from db_connect.pg_db_operator import _group_by_columns
+        groups = _group_by_columns(self.data_list, ('id',))
+        self.assertEqual(_replay(groups, ('id',)), _row_by_row(self.data_list, ('id',)))
+        self.assertEqual(_replay(groups, ('id',))[(1,)]['name'], 'c')
+
+    def test_same_column_set_merged(self):
+        from db_connect.pg_db_operator import _group_by_columns
+        data_list = [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b', 'note': 'x'}, {'id': 1, 'name': 'c'}]
+        groups = _group_by_columns(data_list, ('id',))
+        self.assertEqual(groups, [(('id', 'name'), [(1, 'c')]), (('id', 'name', 'note'), [(2, 'b', 'x')])])
+
+    def test_updates_last_write_wins(self):
+        from db_connect.pg_db_operator import _group_by_columns
+        data_list = [{'id': 1, 'name': 'a'}, {'id': 1, 'note': 'x'}, {'id': 1, 'name': 'b'}, {'id': 1, 'note': 'y'}]
+        groups = _group_by_columns(data_list, ('id',))
+        self.assertEqual(_replay(groups, ('id',)), _row_by_row(data_list, ('id',)))
+        self.assertEqual(_replay(groups, ('id',))[(1,)], {'id': 1, 'name': 'b', 'note': 'y'})
+
+
+class UpsertDatabaseTest(DatabaseTestCase):
+    def test_upserts_dif_len_dict_last_write_wins(self):
+        self.pg.upserts_dif_len_dict('qs_test_t', GroupByColumnsTest.data_list, ['id'])
+        self.assertEqual(self.rows(), [(1, 'c', 'x'), (2, 'e', 'y'), (3, 'f', None)])
+
+
+class UpdatesDatabaseTest(DatabaseTestCase):
+    def test_updates_last_write_wins(self):
+        data_list = [{'id': 1, 'name': 'p'}, {'id': 1, 'name': 'q', 'note': 'n'}, {'id': 2, 'note': 'm'},
+                     {'id': 1, 'name': 'r'}, {'id': 3, 'name': 'missing'}]
+        self.assertEqual(self.pg.updates('qs_test_t', data_list, 'id'), 4)
+        self.assertEqual(self.rows(), [(1, 'r', 'n'), (2, 'b', 'm')])
+
+
+class SchemaCacheDatabaseTest(DatabaseTestCase):
+    """
+    切换模式后不能读到其他模式的缓存
+    """
+    def setUp(self) -> None:
+        super().setUp()
+        with self.pg.connection() as cur:
+            for schema, name in (('qs_test_sa', 'from sa'), ('qs_test_sb', 'from sb')):
+                cur.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+                cur.execute(f'CREATE SCHEMA {schema}')
+                cur.execute(f'CREATE TABLE {schema}.t (id int PRIMARY KEY, name text)')
+                cur.execute(f'INSERT INTO {schema}.t VALUES (1, %s)', (name,))
+        self.cache = self.pg.query_cache
+        self.pg.query_cache = QueryCache()
+
+    def tearDown(self) -> None:
+        self.pg.query_cache = self.cache
+        self.pg.schema = None
+        with self.pg.connection() as cur:
+            cur.execute('DROP SCHEMA IF EXISTS qs_test_sa CASCADE')
+            cur.execute('DROP SCHEMA IF EXISTS qs_test_sb CASCADE')
+
+    def test_switch_schema(self):
+        self.pg.switch_schema('qs_test_sa')
+        self.assertEqual(self.pg.select_star('t', 'id = 1'), [(1, 'from sa')])
+        self.pg.switch_schema('qs_test_sb')
+        self.assertEqual(self.pg.select_star('t', 'id = 1'), [(1, 'from sb')])
+        self.pg.update('t', {'name': 'changed'}, 'id = 1')
+        self.assertEqual(self.pg.select_star('t', 'id = 1'), [(1, 'changed')])
+        self.pg.switch_schema('qs_test_sa')
+        self.assertEqual(self.pg.select_star('t', 'id = 1'), [(1, 'from sa')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+"""
+查询缓存测试
+"""
+from db_connect.query_cache import QueryCache, qualify_table, tables_in_sql
+import unittest
+
+
+class QualifyTableTest(unittest.TestCase):
+    def test_explicit_schema(self):
+        self.assertEqual(qualify_table('SA."Orders"', 'sb'), ('sa.orders',))
+
+    def test_search_path(self):
+        self.assertEqual(qualify_table('orders', 'sa, public'), ('sa.orders', 'public.orders'))
+        self.assertEqual(qualify_table('orders'), ('public.orders',))
+
+    def test_tables_in_sql(self):
+        self.assertEqual(tables_in_sql('SELECT * FROM a JOIN sb.b ON a.id = b.id', 'sa'), ('sa.a', 'sb.b'))
+
+
+class SchemaIsolationTest(unittest.TestCase):
+    """
+    同一语句在不同模式下的缓存互不影响，写入只使对应模式的缓存失效
+    """
+    def setUp(self) -> None:
+        self.cache = QueryCache()
+
+    def put(self, sql: str, schema: str, value) -> str:
+        key = self.cache.make_key(sql, None, schema)
+        tables = tables_in_sql(sql, schema)
+        self.cache.set(key, value, tables, self.cache.snapshot(tables))
+        return key
+
+    def test_key_includes_schema(self):
+        key_a = self.put('SELECT * FROM t', 'sa', ['row of sa'])
+        key_b = self.cache.make_key('SELECT * FROM t', None, 'sb')
+        self.assertNotEqual(key_a, key_b)
+        self.assertEqual(self.cache.get(key_b), (False, None))
+        self.assertEqual(self.cache.get(key_a), (True, ['row of sa']))
+
+    def test_invalidate_only_matching_schema(self):
+        key_a = self.put('SELECT * FROM t', 'sa', ['row of sa'])
+        key_b = self.put('SELECT * FROM t', 'sb', ['row of sb'])
+        self.cache.invalidate('t', 'sb')
+        self.assertEqual(self.cache.get(key_a), (True, ['row of sa']))
+        self.assertEqual(self.cache.get(key_b), (False, None))
+        self.cache.invalidate('sa.t')
+        self.assertEqual(self.cache.get(key_a), (False, None))
+
+    def test_unqualified_write_invalidates_search_path(self):
+        key = self.put('SELECT * FROM public.t', None, ['row of public'])
+        self.cache.invalidate('t', 'sa, public')
+        self.assertEqual(self.cache.get(key), (False, None))
+
+
+if __name__ == '__main__':
+    unittest.main()